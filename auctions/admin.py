@@ -1,16 +1,55 @@
 from django.contrib import admin
-from .models import User, Listing, Bid, Comment
+from .models import (User, Category, Listing, Bid, ProxyBid, Comment, Notification, Event, ListingSummary,
+                     UserSummary, ListingScore, ArchivedListing, ArchivedBidSummary)
 
 class UserAdmin(admin.ModelAdmin):
     list_display = ("id", "username")
     pass
 
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "active_count", "closed_count")
+    readonly_fields = ("active_count", "closed_count")
+
 class ListingAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "user")
+    list_display = ("id", "name", "user", "current_high_bid", "bid_count")
+
+class EventAdmin(admin.ModelAdmin):
+    # The log is append-only: staff can read it, never change it
+    list_display = ("id", "kind", "listing_id", "user_id", "amount", "timestamp")
+    list_filter = ("kind",)
+    readonly_fields = ("kind", "listing_id", "user_id", "amount", "timestamp")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+class ListingSummaryAdmin(admin.ModelAdmin):
+    list_display = ("listing_id", "bid_count", "high_bid", "comment_count", "watchers", "closed_at")
+
+class UserSummaryAdmin(admin.ModelAdmin):
+    list_display = ("user_id", "bid_count", "highest_bid", "comment_count", "watching", "wins")
+
+class ListingScoreAdmin(admin.ModelAdmin):
+    list_display = ("listing_id", "hot", "watchers")
+    ordering = ("-hot",)
 
 # Register your models here.
 admin.site.register(User, UserAdmin)
+admin.site.register(Category, CategoryAdmin)
 admin.site.register(Listing, ListingAdmin)
 admin.site.register(Bid)
+admin.site.register(ProxyBid)
 admin.site.register(Comment)
+admin.site.register(Notification)
+admin.site.register(Event, EventAdmin)
+admin.site.register(ListingSummary, ListingSummaryAdmin)
+admin.site.register(UserSummary, UserSummaryAdmin)
+admin.site.register(ListingScore, ListingScoreAdmin)
+admin.site.register(ArchivedListing)
+admin.site.register(ArchivedBidSummary)
 
@@ -0,0 +1,177 @@
+""" Read-only JSON API for listings, bids and comments, served under /api/
+
+Collections are paged with ?after=<id> cursors and ?limit=, and ?fields= picks the
+fields returned. Every response carries an ETag, and the listing resources also a
+Last-Modified taken from their newest bid or comment, so a client that sends them
+back gets a 304 for the cost of one indexed lookup, before any rows are serialized.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import condition, require_safe
+
+from .caching import (generation, listing_scope, LISTINGS_SCOPE)
+from .models import (Listing, Bid, Comment)
+from .util import (parse_cursor, parse_int)
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# Field name in the API -> model field path or expression, per resource
+LISTING_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'description': 'description',
+    'seller': 'user__username',
+    'category': 'category__name',
+    'starting_bid': 'starting_bid',
+    'price': Coalesce('current_high_bid', 'starting_bid'),
+    'high_bidder': 'high_bidder__username',
+    'bid_count': 'bid_count',
+    'active': 'active',
+    'ends_at': 'ends_at',
+    'image_url': 'image_url',
+}
+BID_FIELDS = {'id': 'id', 'amount': 'amount', 'user': 'user__username', 'timestamp': 'timestamp'}
+COMMENT_FIELDS = {'id': 'id', 'content': 'content', 'user': 'user__username', 'timestamp': 'timestamp'}
+
+
+class BadRequest(Exception):
+    """ Raised for an unknown field or a malformed parameter; answered with a 400 """
+
+
+def selected(request, fields):
+    """ The ?fields= the client asked for (all fields by default) and the values() arguments for them
+
+    Expressions are selected under an api_ prefix, as values() won't let an annotation
+    take the name of a model field (e.g. category); shape() renames them back.
+    """
+    names = request.GET.get('fields')
+    names = [name.strip() for name in names.split(',') if name.strip()] if names else list(fields)
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(fields)}")
+    plain = [name for name in names if fields[name] == name]
+    expressions = {f'api_{name}': F(fields[name]) if isinstance(fields[name], str) else fields[name]
+                   for name in names if fields[name] != name}
+    return names, plain, expressions
+
+def shape(row, names):
+    """ A values() row with the requested fields in the requested order """
+    return {name: row[name] if name in row else row[f'api_{name}'] for name in names}
+
+def page(request, queryset, fields, url):
+    """ One keyset page of the queryset as {'results': [...], 'next': url or None} """
+    after = parse_cursor(request.GET.get('after'))
+    limit = parse_int(request.GET.get('limit')) or DEFAULT_LIMIT
+    if not 0 < limit <= MAX_LIMIT:
+        raise BadRequest(f"limit must be between 1 and {MAX_LIMIT}")
+    names, plain, expressions = selected(request, fields)
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    # The cursor needs the id, even when the client didn't ask for it
+    rows = list(queryset.order_by('id').values(*plain, api_cursor=F('id'), **expressions)[:limit + 1])
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        query = request.GET.copy()
+        query['after'] = rows[-1]['api_cursor']
+        next_url = f"{url}?{query.urlencode()}"
+    return {'results': [shape(row, names) for row in rows], 'next': next_url}
+
+def api_view(view):
+    """ GET/HEAD only, with BadRequest turned into a 400 JSON error """
+    @require_safe
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return JsonResponse({'error': str(error)}, status=400)
+    return wrapper
+
+
+def listing_version(request, listing_id):
+    """ What a listing's representations depend on, read once per request in one indexed query
+
+    The newest bid and comment come from the (listing, timestamp) indexes; the listing's own
+    columns, and its modified_at, catch closes and edits that don't add a bid or comment.
+    """
+    if not hasattr(request, '_listing_version'):
+        newest = lambda model: Subquery(model.objects.filter(listing=OuterRef('pk'))
+                                        .order_by('-timestamp').values('timestamp')[:1])
+        request._listing_version = (Listing.objects.filter(pk=listing_id)
+                                    .annotate(last_bid=newest(Bid), last_comment=newest(Comment))
+                                    .values('active', 'current_high_bid', 'bid_count', 'image_key',
+                                            'category_id', 'modified_at', 'last_bid', 'last_comment')
+                                    .first())
+    return request._listing_version
+
+def listing_etag(request, listing_id):
+    version = listing_version(request, listing_id)
+    if version is None:
+        return None
+    # The listing generation also catches edits to the name or description
+    key = (f"{request.path}?{request.GET.urlencode()}:{sorted(version.items())}:"
+           f"{generation(listing_scope(listing_id))}")
+    return hashlib.md5(key.encode()).hexdigest()
+
+def listing_last_modified(request, listing_id):
+    version = listing_version(request, listing_id)
+    if version is None:
+        return None
+    return max(stamp for stamp in (version['modified_at'], version['last_bid'], version['last_comment']) if stamp)
+
+def listings_etag(request):
+    # Listing writes bump the listings generation; bids don't, so the newest bid id covers prices
+    newest_bid = Bid.objects.aggregate(newest=Max('id'))['newest']
+    key = f"{request.GET.urlencode()}:{generation(LISTINGS_SCOPE)}:{newest_bid}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+@api_view
+@condition(etag_func=listings_etag)
+def listings(request):
+    """ All listings, oldest first; ?active=1 or ?active=0 and ?category=<id> filter them """
+    queryset = Listing.objects.all()
+    if request.GET.get('active') in ('0', '1'):
+        queryset = queryset.open() if request.GET['active'] == '1' else queryset.closed()
+    if 'category' in request.GET:
+        category_id = parse_int(request.GET['category'])
+        if category_id is None:
+            raise BadRequest("category must be a category id")
+        queryset = queryset.filter(category_id=category_id)
+    return JsonResponse(page(request, queryset, LISTING_FIELDS, reverse('api_listings')))
+
+@api_view
+@condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
+def listing(request, listing_id):
+    """ One listing """
+    names, plain, expressions = selected(request, LISTING_FIELDS)
+    row = Listing.objects.filter(pk=listing_id).values(*plain, **expressions).first()
+    if row is None:
+        raise Http404("No such listing")
+    return JsonResponse(shape(row, names))
+
+@api_view
+@condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
+def bids(request, listing_id):
+    """ A listing's bids, oldest first """
+    if listing_version(request, listing_id) is None:
+        raise Http404("No such listing")
+    return JsonResponse(page(request, Bid.objects.filter(listing_id=listing_id), BID_FIELDS,
+                             reverse('api_bids', args=[listing_id])))
+
+@api_view
+@condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
+def comments(request, listing_id):
+    """ A listing's comments, oldest first """
+    if listing_version(request, listing_id) is None:
+        raise Http404("No such listing")
+    return JsonResponse(page(request, Comment.objects.filter(listing_id=listing_id), COMMENT_FIELDS,
+                             reverse('api_comments', args=[listing_id])))
@@ -0,0 +1,104 @@
+""" Moving long-closed listings out of the live tables
+
+archive_closed() copies each old closed listing into ArchivedListing, with its comments
+inline and its bid history collapsed to one ArchivedBidSummary row per bidder, and then
+deletes it from the live tables. The archive models can be routed to a separate SQLite
+file (AUCTIONS_ARCHIVE_DB, see database.ArchiveRouter); the copy is committed before the
+delete, so an interrupted run only leaves rows to be archived again.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, router, transaction
+from django.db.models import Count, F, Max, Min
+from django.db.models.functions import Coalesce
+from django.http import Http404
+from django.utils.timezone import now
+
+from .caching import (invalidate_listing, invalidate_listings)
+from .events import (record_dropped_watches)
+from .models import (Listing, Bid, Comment, Notification, ProxyBid, ListingScore, ArchivedListing,
+                     ArchivedBidSummary)
+
+# Listings archived per batch
+BATCH_SIZE = 200
+
+
+def archivable(older_than=None):
+    """ Closed listings that closed (or, if that wasn't recorded, ended) before the cutoff """
+    if older_than is None:
+        older_than = timedelta(days=settings.AUCTIONS_ARCHIVE_AFTER_DAYS)
+    return (Listing.objects.closed().annotate(closed=Coalesce('closed_at', 'ends_at'))
+            .filter(closed__lt=now() - older_than))
+
+def archive_closed(older_than=None, batch_size=None):
+    """ Archive every archivable listing, a batch at a time; return how many were moved """
+    batch_size = batch_size or BATCH_SIZE
+    archived = 0
+    while True:
+        listing_ids = list(archivable(older_than).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not listing_ids:
+            return archived
+        copy_to_archive(listing_ids)
+        delete_live(listing_ids)
+        archived += len(listing_ids)
+
+def copy_to_archive(listing_ids):
+    """ Write the archive rows for the given listings, replacing any left by an earlier run """
+    listings = {row['id']: ArchivedListing(
+        category=row.pop('category_name') or '', winner=row.pop('winner') or '', comments=[], **row)
+        for row in Listing.objects.filter(pk__in=listing_ids).values(
+            'id', 'name', 'description', 'starting_bid', 'image_url', 'image_key', 'ends_at', 'closed_at',
+            'bid_count', seller=F('user__username'), category_name=F('category__name'),
+            final_price=F('current_high_bid'), winner=F('high_bidder__username'))}
+    for comment in (Comment.objects.filter(listing_id__in=listing_ids).order_by('timestamp', 'id')
+                    .values('listing_id', 'content', 'timestamp', user_name=F('user__username'))):
+        listings[comment['listing_id']].comments.append({
+            'user': comment['user_name'], 'content': comment['content'],
+            'timestamp': comment['timestamp'].isoformat()})
+    summaries = [ArchivedBidSummary(listing_id=row['listing_id'], user=row['user__username'],
+                                    bid_count=row['count'], highest_bid=row['highest'],
+                                    first_bid_at=row['first'], last_bid_at=row['last'])
+                 for row in (Bid.objects.filter(listing_id__in=listing_ids)
+                             .values('listing_id', 'user__username')
+                             .annotate(count=Count('id'), highest=Max('amount'),
+                                       first=Min('timestamp'), last=Max('timestamp'))
+                             .order_by('listing_id', '-highest'))]
+    database = router.db_for_write(ArchivedListing)
+    with transaction.atomic(using=database):
+        ArchivedListing.objects.using(database).filter(pk__in=listing_ids).delete()
+        ArchivedListing.objects.using(database).bulk_create(listings.values())
+        ArchivedBidSummary.objects.using(database).bulk_create(summaries)
+
+def delete_live(listing_ids):
+    """ Delete listings with their bids, proxy bids, comments, watches, notifications and scores
+
+    Plain DELETEs: going through the ORM would load and signal every bid and comment one
+    by one. The listing triggers still drop the search rows and adjust the category counts,
+    and the dropped watches are logged as unwatch events, as removing them one by one would be.
+    """
+    placeholders = ', '.join(['%s'] * len(listing_ids))
+    watch_table = Listing.watched_by.through._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        record_dropped_watches(listing_ids)
+        cursor.execute(f"UPDATE {Listing._meta.db_table} SET winning_bid_id = NULL "
+                       f"WHERE id IN ({placeholders})", listing_ids)
+        for table in (Notification._meta.db_table, watch_table, ProxyBid._meta.db_table, Bid._meta.db_table,
+                      Comment._meta.db_table, ListingScore._meta.db_table):
+            cursor.execute(f"DELETE FROM {table} WHERE listing_id IN ({placeholders})", listing_ids)
+        cursor.execute(f"DELETE FROM {Listing._meta.db_table} WHERE id IN ({placeholders})", listing_ids)
+
+        def announce():
+            invalidate_listings()
+            for listing_id in listing_ids:
+                invalidate_listing(listing_id)
+        transaction.on_commit(announce)
+
+def archived_page(listing_id):
+    """ Template context for the page of an archived listing; Http404 if it was never archived """
+    try:
+        listing = ArchivedListing.objects.get(pk=listing_id)
+    except ArchivedListing.DoesNotExist:
+        raise Http404("No such listing")
+    return {'listing': listing, 'bidders': list(listing.bid_summaries.order_by('-highest_bid'))}
@@ -0,0 +1,109 @@
+""" Async variants of the read-heavy pages, served under /async/ by the ASGI entry point """
+
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+
+from .archive import (archived_page)
+from .caching import (cache_anonymous_page, listing_scope, LISTINGS_SCOPE)
+from .forms import (BidForm, CommentForm)
+from .middleware import (render)
+from .models import (Bid, Category, Listing, Comment)
+from .util import (keyset_page, parse_cursor, recent_notifications, watched_listings)
+
+
+def db(function):
+    """ Run an ORM call off the event loop; independent reads run concurrently on pooled threads
+
+    The request's own close_old_connections() never reaches those threads, so each call
+    does it itself: their connections are dropped past CONN_MAX_AGE or once unusable,
+    rather than kept forever.
+    """
+    @wraps(function)
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)
+
+# Rendering may still touch lazy querysets (the bid and comment lists), so it gets a thread too
+render_async = sync_to_async(render)
+
+async def current_user(request):
+    """ The signed-in user; loading it may read the session or user table, so it runs off the event loop """
+    return await sync_to_async(get_user)(request)
+
+
+@cache_anonymous_page(lambda: LISTINGS_SCOPE)
+async def index(request):
+    """ Homepage; the active and closed pages are read concurrently """
+    active_after = parse_cursor(request.GET.get('active_after'))
+    closed_after = parse_cursor(request.GET.get('closed_after'))
+    (active_listings, active_next), (closed_listings, closed_next) = await asyncio.gather(
+        db(keyset_page)(Listing.objects.open(), active_after),
+        db(keyset_page)(Listing.objects.closed(), closed_after),
+    )
+    return await render_async(request, "auctions/index.html", {'active_listings': active_listings,
+                                                               'closed_listings': closed_listings,
+                                                               'active_after': active_after,
+                                                               'closed_after': closed_after,
+                                                               'active_next': active_next,
+                                                               'closed_next': closed_next
+                                                               })
+
+@cache_anonymous_page(listing_scope)
+async def listing(request, listing_id):
+    """ Listing page; the listing row and the watch check are read concurrently """
+    user = await current_user(request)
+
+    def get_listing():
+        return Listing.objects.select_related('user', 'high_bidder').filter(pk=listing_id).first()
+
+    def is_watching():
+        return user.is_authenticated and Listing.watched_by.through.objects.filter(
+            listing_id=listing_id, user_id=user.pk).exists()
+
+    current_listing, watching = await asyncio.gather(db(get_listing)(), db(is_watching)())
+    if current_listing is None:
+        # Long-closed auctions have moved to the archive tables
+        return await render_async(request, "auctions/archived_listing.html", await db(archived_page)(listing_id))
+    return await render_async(request, "auctions/listing.html", {
+        'id': listing_id,
+        'listing': current_listing,
+        'bids': Bid.objects.filter(listing__id=listing_id).order_by('timestamp'),
+        'bidform': BidForm(),
+        'comments': Comment.objects.filter(listing__id=listing_id).order_by('timestamp'),
+        'commentform': CommentForm(),
+        'watchbutton': 'Remove from watchlist' if watching else 'Add to watchlist',
+        'watching': watching,
+        'mylisting': current_listing.user_id == user.pk,
+        'active': current_listing.active,
+        'winner': current_listing.high_bidder or "no one"
+    })
+
+@cache_anonymous_page(lambda: LISTINGS_SCOPE)
+async def categories(request):
+    """ Overview of all categories with their listing counts """
+    return await render_async(request, "auctions/categories.html", {
+        'categories': Category.objects.order_by('name'),
+        'uncategorized': Listing.objects.filter(category__isnull=True).exists
+    })
+
+async def watchlist(request):
+    """ The signed-in user's watchlist with bidding status, plus the outbid notifications """
+    user = await current_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    current_watchlist, notifications = await asyncio.gather(
+        db(lambda: list(watched_listings(user)))(),
+        db(recent_notifications)(user))
+    if any(not notification['read'] for notification in notifications):
+        await db(lambda: user.notifications.filter(read=False).update(read=True))()
+    return await render_async(request, "auctions/watchlist.html", {'watchlist': current_watchlist,
+                                                                  'notifications': notifications})
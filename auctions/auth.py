@@ -0,0 +1,41 @@
+""" Authentication backend that loads the signed-in user from the cache instead of the user table """
+
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from .models import User
+
+# Entries are dropped when a user is saved (see signals.py); the timeout is only a backstop
+# for writes that send no signal, like queryset.update()
+USER_TIMEOUT = 15 * 60
+
+
+def _user_key(user_id):
+    return f'auctions:user:{user_id}'
+
+def cached_user(user_id):
+    """ The user with this id, read from the cache when possible; None if there is no such user """
+    key = _user_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user, USER_TIMEOUT)
+    return user
+
+def invalidate_user(user_id):
+    cache.delete(_user_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """ ModelBackend whose per-request user lookup is served by cached_user()
+
+    AuthenticationMiddleware calls get_user() on every signed-in request; together with a
+    cached session store that leaves such requests with no session or user queries at all.
+    Password changes still sign other sessions out: the session hash is checked against
+    the cached user, which a password save has already evicted.
+    """
+
+    def get_user(self, user_id):
+        user = cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
@@ -0,0 +1,304 @@
+""" Load generator and latency benchmark for the main auction flows
+
+seed() fills a (throwaway) database at a chosen scale, run_mix() drives a weighted mix of
+requests through the Django test client, and summarize()/compare() turn the samples into
+per-endpoint figures and check them against a stored baseline.
+"""
+
+import random
+import re
+import statistics
+import threading
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.db.models import Max
+from django.template.loader import render_to_string
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+
+from .bidding import (place_bid, BidRejected)
+from .caching import (invalidate_listing)
+from .forms import (BidForm, CommentForm)
+from .models import (User, Category, Listing, Bid, Comment)
+from .util import (keyset_page, rebuild_bid_totals)
+
+# Relative weight of each endpoint in the request mix
+DEFAULT_MIX = {
+    'index': 25,
+    'listing': 35,
+    'categories': 10,
+    'watchlist': 10,
+    'add_bid': 15,
+    'add_watchlist': 5,
+}
+
+# Rows per bulk_create while seeding
+SEED_BATCH = 2000
+
+
+def _batched_create(model, objects):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, SEED_BATCH))
+        if not batch:
+            return
+        model.objects.bulk_create(batch)
+
+def seed(users=50, listings=500, bids=10, comments=3, watches=20, categories=20, seed=0):
+    """ Fill the database: `bids`, `comments` per listing and `watches` watched listings per user """
+    rng = random.Random(seed)
+    password = make_password("benchmark")
+    _batched_create(User, (User(id=n, username=f"user{n}", password=password)
+                           for n in range(1, users + 1)))
+    category_ids = [category.id for category in
+                    Category.objects.bulk_create(Category(name=f"Category {n}") for n in range(categories))]
+    start = now()
+    _batched_create(Listing, (
+        Listing(id=n, name=f"Listing {n}", user_id=rng.randint(1, users),
+                description=f"Benchmark listing number {n}", starting_bid=rng.randint(1, 50),
+                category_id=rng.choice(category_ids) if rng.random() < 0.9 else None,
+                active=rng.random() < 0.8, ends_at=start + timedelta(days=rng.randint(1, 30)))
+        for n in range(1, listings + 1)))
+    _batched_create(Bid, (
+        Bid(listing_id=n, user_id=rng.randint(1, users), amount=60 + step * 5)
+        for n in range(1, listings + 1) for step in range(bids)))
+    _batched_create(Comment, (
+        Comment(listing_id=n, user_id=rng.randint(1, users), content=f"Comment {step}")
+        for n in range(1, listings + 1) for step in range(comments)))
+    Watch = Listing.watched_by.through
+    _batched_create(Watch, (
+        Watch(user_id=user, listing_id=listing)
+        for user in range(1, users + 1)
+        for listing in rng.sample(range(1, listings + 1), min(watches, listings))))
+    rebuild_bid_totals()
+    cache.clear()
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def run_mix(requests=1000, mix=None, clients=10, anonymous=0.2, seed=0):
+    """ Send a weighted mix of requests; return {endpoint: [(seconds, queries), ...]} and wall time """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    user_ids = list(User.objects.values_list('id', flat=True)[:clients])
+    signed_in = []
+    for user_id in user_ids:
+        client = Client()
+        client.force_login(User.objects.get(pk=user_id))
+        signed_in.append(client)
+    signed_out = Client()
+    listing_ids = list(Listing.objects.open().values_list('id', flat=True))
+    high_bids = dict(Listing.objects.open().values_list('id', 'current_high_bid'))
+    endpoints, weights = zip(*mix.items())
+    samples = {endpoint: [] for endpoint in endpoints}
+
+    # Far more writes per client than a person makes; the rate limiter would answer most of them
+    with override_settings(AUCTIONS_RATE_LIMITS={}):
+        started = time.perf_counter()
+        for _ in range(requests):
+            endpoint = rng.choices(endpoints, weights)[0]
+            listing_id = rng.choice(listing_ids)
+            writes = endpoint in ('add_bid', 'add_watchlist', 'watchlist')
+            client = signed_out if not writes and rng.random() < anonymous else rng.choice(signed_in)
+            with CaptureQueriesContext(connection) as queries:
+                request_started = time.perf_counter()
+                if endpoint == 'add_bid':
+                    high_bids[listing_id] = (high_bids[listing_id] or 0) + rng.randint(1, 5)
+                    client.post(reverse('add_bid', args=[listing_id]), {'bid_amount': high_bids[listing_id]})
+                elif endpoint == 'add_watchlist':
+                    client.post(reverse('add_watchlist', args=[listing_id]))
+                elif endpoint == 'listing':
+                    client.get(reverse('listing', args=[listing_id]))
+                else:
+                    client.get(reverse(endpoint))
+                elapsed = time.perf_counter() - request_started
+            samples[endpoint].append((elapsed, len(queries)))
+        wall_time = time.perf_counter() - started
+    return samples, wall_time
+
+def summarize(samples, wall_time):
+    """ Per-endpoint latency percentiles (ms), throughput and query counts """
+    endpoints = {}
+    for endpoint, runs in samples.items():
+        if not runs:
+            continue
+        latencies = [seconds * 1000 for seconds, _ in runs]
+        queries = [count for _, count in runs]
+        endpoints[endpoint] = {
+            'requests': len(runs),
+            'p50_ms': round(_percentile(latencies, 0.50), 3),
+            'p95_ms': round(_percentile(latencies, 0.95), 3),
+            'p99_ms': round(_percentile(latencies, 0.99), 3),
+            'mean_queries': round(statistics.mean(queries), 2),
+            'max_queries': max(queries),
+        }
+    total = sum(len(runs) for runs in samples.values())
+    return {'requests': total, 'throughput_rps': round(total / wall_time, 1), 'endpoints': endpoints}
+
+def compare(results, baseline, tolerance=0.2):
+    """ Regressions against a baseline: slower p95 beyond the tolerance, or more queries """
+    regressions = []
+    for endpoint, figures in results['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(endpoint)
+        if before is None:
+            continue
+        if figures['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {before['p95_ms']}ms -> {figures['p95_ms']}ms")
+        if figures['max_queries'] > before['max_queries']:
+            regressions.append(f"{endpoint}: queries {before['max_queries']} -> {figures['max_queries']}")
+    if 'throughput_rps' in baseline and results['throughput_rps'] < baseline['throughput_rps'] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput_rps']} -> {results['throughput_rps']} req/s")
+    return regressions
+
+def bid_contention(writers=8, readers=8, bids=100, listings=5, seed=0):
+    """ Concurrent bidders on a few hot listings while readers load them; return figures
+
+    Each thread uses its own connection, so this only means something on a file database.
+    """
+    rng = random.Random(seed)
+    users = list(User.objects.order_by('id')[:writers])
+    listing_ids = list(Listing.objects.open().values_list('id', flat=True)[:listings])
+    amounts = {listing_id: iter(range(1000, 10 ** 9)) for listing_id in listing_ids}
+    lock = threading.Lock()
+    figures = {'accepted': 0, 'outbid': 0, 'errors': 0, 'reads': 0}
+    latencies = []
+    writing = threading.Event()
+
+    def count(key, latency=None):
+        with lock:
+            figures[key] += 1
+            if latency is not None:
+                latencies.append(latency)
+
+    def bidder(user, picks):
+        try:
+            for listing_id in picks:
+                amount = next(amounts[listing_id])
+                started = time.perf_counter()
+                try:
+                    place_bid(listing_id, user, amount)
+                    count('accepted', time.perf_counter() - started)
+                except BidRejected:
+                    count('outbid', time.perf_counter() - started)
+                except OperationalError:
+                    count('errors')
+        finally:
+            connection.close()
+
+    def reader(picker):
+        # Reads for as long as the bidders run, so the read rate is measured rather than fixed
+        try:
+            while writing.is_set():
+                try:
+                    list(Bid.objects.filter(listing_id=picker.choice(listing_ids)).order_by('-amount')[:10])
+                    count('reads')
+                except OperationalError:
+                    count('errors')
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=bidder, args=(user, [rng.choice(listing_ids) for _ in range(bids)]))
+               for user in users]
+    watchers = [threading.Thread(target=reader, args=(random.Random(rng.random()),)) for _ in range(readers)]
+    writing.set()
+    started = time.perf_counter()
+    for thread in threads + watchers:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+    writing.clear()
+    for thread in watchers:
+        thread.join()
+    writes = figures['accepted'] + figures['outbid']
+    return dict(figures, **{
+        'writes_per_second': round(writes / wall_time, 1),
+        'reads_per_second': round(figures['reads'] / wall_time, 1),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+    })
+
+def _is_auth_query(sql):
+    """ A session lookup or the load of one user by id, as the auth middleware does """
+    return 'FROM "django_session"' in sql or re.search(r'FROM "auctions_user" WHERE "auctions_user"."id" = ', sql)
+
+def auth_round_trips(requests=20, pages=('index', 'listing', 'watchlist')):
+    """ Average queries per signed-in request to each page, split into session/user lookups and the rest
+
+    Measures whatever SESSION_ENGINE and AUTHENTICATION_BACKENDS are in effect, after one
+    warm-up request per page; needs at least one user and one listing.
+    """
+    user = User.objects.order_by('id').first()
+    listing_id = Listing.objects.order_by('id').values_list('id', flat=True).first()
+    urls = {'index': reverse('index'), 'listing': reverse('listing', args=[listing_id]),
+            'watchlist': reverse('watchlist')}
+    client = Client()
+    client.force_login(user)
+    figures = {}
+    for page in pages:
+        client.get(urls[page])
+        auth = other = 0
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as queries:
+                client.get(urls[page])
+            for query in queries:
+                if _is_auth_query(query['sql']):
+                    auth += 1
+                else:
+                    other += 1
+        figures[page] = {'auth_queries': round(auth / requests, 2), 'other_queries': round(other / requests, 2)}
+    return figures
+
+def render_times(bid_counts=(10, 1000, 10000), repeat=5):
+    """ Median milliseconds to render index.html and listing.html, per listing size
+
+    For each size a listing with that many bids is added (to a throwaway database) and both
+    templates are rendered with the contexts their views build: "cold" with the bid and
+    comment fragments dropped before each render, so the lists are rebuilt, and "warm" with
+    them cached.
+    """
+    seller = User.objects.order_by('id').first()
+    bidders = list(User.objects.values_list('id', flat=True)[:20])
+    request = RequestFactory().get('/')
+    request.user = seller
+    figures = {}
+    for count in bid_counts:
+        listing_id = (Listing.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        Listing.objects.create(id=listing_id, name=f"Render {count}", user=seller,
+                               description=f"A listing with {count} bids", starting_bid=1)
+        _batched_create(Bid, (Bid(listing_id=listing_id, user_id=bidders[n % len(bidders)], amount=2 + n)
+                              for n in range(count)))
+        rebuild_bid_totals(Listing.objects.filter(pk=listing_id))
+        active_listings, active_next = keyset_page(Listing.objects.open())
+        closed_listings, closed_next = keyset_page(Listing.objects.closed())
+        listing = Listing.objects.select_related('user', 'high_bidder').get(pk=listing_id)
+        contexts = {
+            'index': ("auctions/index.html", {
+                'active_listings': active_listings, 'closed_listings': closed_listings,
+                'active_next': active_next, 'closed_next': closed_next}),
+            'listing': ("auctions/listing.html", {
+                'id': listing_id, 'listing': listing, 'active': True, 'winner': listing.high_bidder,
+                'bids': Bid.objects.filter(listing__id=listing_id).order_by('timestamp'),
+                'comments': Comment.objects.filter(listing__id=listing_id).order_by('timestamp'),
+                'bidform': BidForm(), 'commentform': CommentForm(), 'watchbutton': 'Add to watchlist',
+                'watching': False, 'mylisting': True}),
+        }
+        for page, (template, context) in contexts.items():
+            for mode in ('cold', 'warm'):
+                samples = []
+                for _ in range(repeat):
+                    if mode == 'cold':
+                        invalidate_listing(listing_id)
+                    started = time.perf_counter()
+                    render_to_string(template, context, request)
+                    samples.append(time.perf_counter() - started)
+                figures[(page, count, mode)] = round(statistics.median(samples) * 1000, 3)
+    return figures
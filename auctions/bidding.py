@@ -0,0 +1,175 @@
+""" Bid placement and proxy (automatic maximum) bidding, safe against concurrent bidders """
+
+import random
+import time
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from .models import (Listing, Bid, ProxyBid, Notification)
+
+# How often to retry when another writer holds the database lock
+LOCK_RETRIES = 50
+LOCK_BACKOFF = 0.002
+LOCK_BACKOFF_MAX = 0.05
+
+# Step by which a proxy outbids its competitors
+INCREMENT = 1
+
+
+class BidRejected(Exception):
+    """ Raised when a bid does not beat the current high bid or the listing is closed or expired """
+
+
+class _Stale(Exception):
+    """ The listing changed between reading and updating it; the resolution is run again """
+
+
+def _retrying(attempt_once):
+    """ Run a bid transaction, retrying while another writer holds the lock or got in first """
+    for attempt in range(LOCK_RETRIES):
+        try:
+            with transaction.atomic():
+                return attempt_once()
+        except (OperationalError, _Stale) as error:
+            if ('locked' not in str(error) and not isinstance(error, _Stale)) or attempt == LOCK_RETRIES - 1:
+                raise
+            time.sleep(random.uniform(0, min(LOCK_BACKOFF * 2 ** attempt, LOCK_BACKOFF_MAX)))
+
+def _biddable(listing_id):
+    return Listing.objects.filter(pk=listing_id, active=True).filter(Q(ends_at__isnull=True) | Q(ends_at__gt=now()))
+
+def place_bid(listing_id, user, amount):
+    """ Accept a bid only if it beats the real current high bid, checked inside one transaction
+
+    The listing row is moved to the new high bid with a conditional UPDATE, so two
+    bidders racing for the same price can never both win: the second UPDATE matches
+    no row once the first has committed. When proxies compete for the listing, they
+    are settled by resolve() in the same transaction.
+    """
+    def attempt():
+        proxies = _proxies(listing_id)
+        if proxies:
+            bids = resolve(listing_id, user, proxies, amount=amount)
+            return next(bid for bid in bids if bid.user_id == user.pk and bid.amount == amount)
+        updated = _biddable(listing_id).filter(
+            Q(current_high_bid__lt=amount) |
+            Q(current_high_bid__isnull=True, starting_bid__lt=amount)
+        ).update(current_high_bid=amount, high_bidder=user, bid_count=F('bid_count') + 1)
+        if not updated:
+            raise BidRejected('Must be higher than highest bid so far.')
+        notify_displaced_leader(listing_id, user.pk, amount)
+        return Bid.objects.create(user=user, amount=amount, listing_id=listing_id)
+    return _retrying(attempt)
+
+def set_proxy(listing_id, user, maximum):
+    """ Store (or change) the user's hidden maximum and let the proxies bid it out
+
+    Returns the proxy bid. Lowering a maximum below the current price is refused.
+    """
+    def attempt():
+        proxy, created = ProxyBid.objects.get_or_create(listing_id=listing_id, user=user,
+                                                        defaults={'maximum': maximum})
+        if not created and proxy.maximum != maximum:
+            # Keeps its timestamp: raising a maximum doesn't win ties it would have lost
+            proxy.maximum = maximum
+            proxy.save(update_fields=['maximum'])
+        resolve(listing_id, user, _proxies(listing_id), maximum=maximum)
+        return proxy
+    return _retrying(attempt)
+
+def _proxies(listing_id):
+    """ (user id, maximum) of the listing's proxies, oldest first """
+    return list(ProxyBid.objects.filter(listing_id=listing_id).order_by('timestamp', 'id')
+                .values_list('user_id', 'maximum'))
+
+def resolve(listing_id, user, proxies, amount=None, maximum=None):
+    """ Settle an incoming bid (amount) or proxy (maximum) against every proxy on the listing
+
+    Rather than replaying the bidding war one increment at a time, the outcome follows
+    from the two highest maximums: the highest wins at one increment above the runner-up
+    (capped at its own maximum), and the runner-up's proxy is recorded at its maximum.
+    That is O(proxies) work and at most three bid rows, one listing UPDATE and one
+    notification INSERT, however many proxies compete. Notified are those it beat: the
+    previous leader, the losing proxy and a manual bid a proxy answered. Returns the bids written.
+    """
+    listing = _biddable(listing_id).values('current_high_bid', 'high_bidder_id', 'starting_bid').first()
+    if listing is None:
+        raise BidRejected('This auction is closed.')
+    price, leader = listing['current_high_bid'], listing['high_bidder_id']
+    floor = (price if price is not None else listing['starting_bid']) + INCREMENT
+    if (amount if amount is not None else maximum) < floor:
+        raise BidRejected('Must be higher than highest bid so far.')
+
+    # Each contender's reach; dict order is tie priority: the leader, then proxies oldest first
+    reach = {}
+    if leader is not None:
+        reach[leader] = price
+    proxied = set()
+    for user_id, proxy_maximum in proxies:
+        if proxy_maximum > (price or 0):
+            reach[user_id] = max(reach.get(user_id, 0), proxy_maximum)
+            proxied.add(user_id)
+    if amount is not None:
+        reach[user.pk] = max(reach.get(user.pk, 0), amount)
+    ranking = sorted(reach.items(), key=lambda item: -item[1])
+    winner, top = ranking[0]
+    runner_up, second = ranking[1] if len(ranking) > 1 else (None, None)
+
+    new_price = floor if second is None else max(floor, min(top, second + INCREMENT))
+    if winner == leader and amount is None:
+        # A leader can't be pushed up by their own proxy, only by a competitor
+        new_price = price if second is None or second < price else max(price, min(top, second + INCREMENT))
+    if amount is not None and winner == user.pk:
+        new_price = max(new_price, amount)
+
+    placed = []
+    if amount is not None:
+        placed.append((user.pk, amount))
+    if runner_up in proxied and second > (price or 0) and (runner_up, second) not in placed:
+        placed.append((runner_up, second))
+    if (winner != leader or new_price != price) and (winner, new_price) not in placed:
+        placed.append((winner, new_price))
+    if not placed:
+        return []
+    # Lowest first; at equal amounts the winner's bid goes first, so it is the top bid by (-amount, id)
+    placed.sort(key=lambda bid: (bid[1], bid[0] != winner))
+
+    updated = _biddable(listing_id).filter(current_high_bid=price, high_bidder_id=leader) if price is not None \
+        else _biddable(listing_id).filter(current_high_bid__isnull=True)
+    if not updated.update(current_high_bid=new_price, high_bidder_id=winner,
+                          bid_count=F('bid_count') + len(placed)):
+        raise _Stale()
+    bids = [Bid.objects.create(user_id=user_id, amount=bid_amount, listing_id=listing_id)
+            for user_id, bid_amount in placed]
+    notify_outbid(listing_id, [leader, runner_up if runner_up in proxied else None,
+                               user.pk if amount is not None else None], winner, new_price)
+    return bids
+
+def notify_outbid(listing_id, user_ids, winner_id, amount):
+    """ Tell the bidders a bid just displaced that they were outbid, in one INSERT
+
+    Only those the bid beat: anyone outbid earlier was told then. None entries are skipped.
+    """
+    outbid = sorted({user_id for user_id in user_ids if user_id is not None} - {winner_id})
+    Notification.objects.bulk_create([Notification(user_id=user_id, listing_id=listing_id, amount=amount)
+                                      for user_id in outbid])
+
+def notify_displaced_leader(listing_id, winner_id, amount):
+    """ notify_outbid for a plain bid, with the leader it displaced found by the INSERT itself
+
+    Runs after the listing UPDATE, under its lock, and before the new bid is written, so the
+    top bid is the displaced leader's, with no separate read. Reading high_bidder_id before
+    the UPDATE would hold a read lock on the listing table across it, which SQLite's
+    shared-cache mode (the in-memory test database) turns into lock failures between bidders.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in ('user_id', 'listing_id', 'amount', 'timestamp', 'read'))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(Notification._meta.db_table)} ({columns}) "
+            f"SELECT user_id, listing_id, %s, %s, %s FROM ("
+            f"SELECT user_id, listing_id FROM {quote(Bid._meta.db_table)} WHERE listing_id = %s "
+            f"ORDER BY amount DESC, id LIMIT 1) WHERE user_id != %s",
+            [amount, connection.ops.adapt_datetimefield_value(now()), False, listing_id, winner_id])
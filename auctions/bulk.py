@@ -0,0 +1,174 @@
+""" Streaming bulk import of listings and export of listings, bids and comments
+
+Rows are read, validated and written a chunk at a time, so memory use stays flat
+however large the file is.
+"""
+
+import csv
+import io
+import json
+import re
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .caching import invalidate_listings
+from .forms import ListingImportForm
+from .models import (Category, Listing, Bid, Comment)
+
+# Rows validated and inserted per bulk_create
+BATCH_SIZE = 500
+
+# Per-row errors kept for the report; later ones are only counted
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = ('csv', 'jsonl')
+
+# What text_stream turns bytes that aren't UTF-8 into
+_UNDECODABLE = re.compile('[\udc80-\udcff]')
+
+# Columns written by the exports, per kind
+EXPORTS = {
+    'listings': (Listing.objects.order_by('id'),
+                 ['id', 'name', 'description', 'starting_bid', 'category__name', 'image_url',
+                  'ends_at', 'active', 'current_high_bid', 'bid_count', 'user__username']),
+    'bids': (Bid.objects.order_by('id'),
+             ['id', 'listing_id', 'user__username', 'amount', 'timestamp']),
+    'comments': (Comment.objects.order_by('id'),
+                 ['id', 'listing_id', 'user__username', 'content', 'timestamp']),
+}
+
+
+class UnknownFormat(Exception):
+    """ Raised when an import or export is asked for a format other than CSV or JSONL """
+
+
+class ImportResult:
+    """ Running totals of an import """
+
+    def __init__(self):
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+
+def format_for(filename, default='csv'):
+    """ Guess the format from a file name's extension """
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in FORMATS else default
+
+def read_rows(stream, format):
+    """ Yield (line number, dict) for every row of a CSV or JSONL text stream
+
+    A row that can't be read, because it isn't valid CSV, JSON or UTF-8, comes out as
+    (line number, exception) instead, and reading goes on with the next one.
+    """
+    if format == 'csv':
+        rows = _csv_rows(stream)
+    elif format == 'jsonl':
+        rows = _jsonl_rows(stream)
+    else:
+        raise UnknownFormat(f"Unknown format {format!r}, expected one of {', '.join(FORMATS)}")
+    for line, row in rows:
+        if isinstance(row, dict) and any(_UNDECODABLE.search(str(value)) for value in (*row, *row.values())):
+            row = UnicodeError("Not valid UTF-8 text")
+        yield line, row
+
+def _csv_rows(stream):
+    reader = csv.DictReader(stream)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            # line_num still stands at the end of the previous row
+            yield reader.line_num + 1, error
+            continue
+        yield reader.line_num, row
+
+def _jsonl_rows(stream):
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as error:
+            yield line, error
+            continue
+        yield line, row if isinstance(row, dict) else ValueError("Row is not a JSON object")
+
+def import_listings(rows, user, batch_size=None):
+    """ Validate rows with the ListingForm rules and insert the valid ones in batches
+
+    A bad row is recorded in the result and skipped; it never aborts its batch.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    result = ImportResult()
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        valid = []
+        for line, row in chunk:
+            if isinstance(row, Exception):
+                result.add_error(line, {'__all__': [{'message': str(row), 'code': 'invalid'}]})
+                continue
+            if 'category' in row and 'category_name' not in row:
+                row['category_name'] = row['category']
+            form = ListingImportForm(row)
+            if form.is_valid():
+                valid.append((form.instance, form.cleaned_data['category_name'].strip()))
+            else:
+                result.add_error(line, form.errors.get_json_data())
+        result.created += _create_listings(valid, user)
+    if result.created:
+        invalidate_listings()
+    return result
+
+def _create_listings(valid, user):
+    """ Insert one batch of validated listings, creating their categories in two queries """
+    names = {name for _, name in valid if name}
+    Category.objects.bulk_create([Category(name=name) for name in names], ignore_conflicts=True)
+    categories = dict(Category.objects.filter(name__in=names).values_list('name', 'id'))
+    for listing, name in valid:
+        listing.user = user
+        listing.category_id = categories.get(name)
+    Listing.objects.bulk_create([listing for listing, _ in valid])
+    return len(valid)
+
+
+class _Echo:
+    """ File-like object that hands back what is written, for streaming csv.writer output """
+
+    def write(self, value):
+        return value
+
+def export_rows(kind, format):
+    """ Yield an export of listings, bids or comments as CSV or JSONL text chunks """
+    queryset, columns = EXPORTS[kind]
+    rows = queryset.values_list(*columns).iterator(chunk_size=BATCH_SIZE)
+    header = [column.replace('__', '_') for column in columns]
+    if format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(header, row))) + '\n'
+
+def text_stream(binary):
+    """ Decode an uploaded or opened binary file lazily, line by line
+
+    Bytes that aren't UTF-8 are kept as surrogates rather than failing the whole file;
+    read_rows reports the rows they are in.
+    """
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', errors='surrogateescape', newline='')
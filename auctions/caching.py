@@ -0,0 +1,85 @@
+""" Rendered-page and template-fragment caching, invalidated when auction data is written """
+
+import asyncio
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+
+# Entries are invalidated by signals (see signals.py); the timeout is only a backstop
+PAGE_TIMEOUT = 60 * 60
+
+# Scope shared by every page that lists auctions (index, categories, category)
+LISTINGS_SCOPE = 'listings'
+
+
+def listing_scope(listing_id):
+    return f'listing:{listing_id}'
+
+def generation(scope):
+    """ Current generation of a scope; pages cached under an older generation are never read again """
+    return cache.get_or_set(f'auctions:generation:{scope}', time.time_ns, None)
+
+def bump(*scopes):
+    """ Invalidate every page cached under the given scopes """
+    cache.set_many({f'auctions:generation:{scope}': time.time_ns() for scope in scopes}, None)
+
+def invalidate_listing(listing_id):
+    """ Drop the cached pages and fragments that show a listing's bids or comments """
+    bump(listing_scope(listing_id))
+    cache.delete_many([make_template_fragment_key('bid_list', [listing_id]),
+                       make_template_fragment_key('comment_list', [listing_id])])
+
+def invalidate_listings():
+    """ Drop the cached pages and fragments that list auctions """
+    bump(LISTINGS_SCOPE)
+    cache.delete(make_template_fragment_key('category_index'))
+
+def invalidate_all():
+    """ Drop everything, for bulk jobs that write without sending signals """
+    bump('all')
+
+def _page_key(request, page_scope):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"auctions:page:{page_scope}:{generation('all')}:{generation(page_scope)}:{path}"
+
+def cache_anonymous_page(scope):
+    """ Cache whole GET responses for signed-out visitors
+
+    `scope` maps the view's URL kwargs to the scope it belongs to; the page is served
+    from cache until that scope is bumped by a write. Works on sync and async views.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # Resolving request.user may hit the session table, which must not run on the event loop
+                authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+                if request.method != 'GET' or authenticated:
+                    return await view(request, *args, **kwargs)
+                # So must the cache calls: the file and Redis backends block on I/O
+                key = await sync_to_async(_page_key)(request, scope(**kwargs))
+                response = await sync_to_async(cache.get)(key)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    if response.status_code == 200:
+                        await sync_to_async(cache.set)(key, response, PAGE_TIMEOUT)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            key = _page_key(request, scope(**kwargs))
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response, PAGE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
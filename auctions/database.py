@@ -0,0 +1,85 @@
+""" SQLite connection tuning and the optional read-replica and archive routers """
+
+import contextvars
+from functools import wraps
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+REPLICA = 'replica'
+ARCHIVE = 'archive'
+
+# Models that ArchiveRouter keeps in the archive database
+ARCHIVE_MODELS = {'archivedlisting', 'archivedbidsummary'}
+
+_read_only = contextvars.ContextVar('auctions_read_only', default=False)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """ Apply settings.SQLITE_PRAGMAS to every new SQLite connection
+
+    Only per-connection pragmas belong there. The journal mode is stored in the database
+    file, so migration 0025 switches it to WAL once instead of every connection rewriting it.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        # On the raw connection, so the pragmas don't show up in query counts
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+
+def read_only(view):
+    """ Route the reads of GET and HEAD requests to the replica, when one is configured """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        token = _read_only.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_only.reset(token)
+    return wrapper
+
+
+class ReadReplicaRouter:
+    """ Send the reads of @read_only views to the 'replica' connection, everything else to default """
+
+    def db_for_read(self, model, **hints):
+        return REPLICA if _read_only.get() else None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases point at the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+class ArchiveRouter:
+    """ Keep the archive models, and only them, in the 'archive' database """
+
+    def archived(self, model):
+        return model._meta.app_label == 'auctions' and model._meta.model_name in ARCHIVE_MODELS
+
+    def db_for_read(self, model, **hints):
+        return ARCHIVE if self.archived(model) else None
+
+    def db_for_write(self, model, **hints):
+        return ARCHIVE if self.archived(model) else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if self.archived(type(obj1)) and self.archived(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == ARCHIVE:
+            return app_label == 'auctions' and model_name in ARCHIVE_MODELS
+        if app_label == 'auctions' and model_name in ARCHIVE_MODELS:
+            return False
+        return None
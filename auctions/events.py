@@ -0,0 +1,131 @@
+""" Append-only event log of auction activity and the summaries projected from it
+
+Bids, comments and watch toggles are logged by the receivers in signals.py, closes by
+expiry.close_listings, each in the transaction of the change itself. project() folds the
+events after its stored position into ListingSummary and UserSummary a batch at a time,
+touching only the summaries the batch concerns; replay() rebuilds them from the whole log.
+Both are run by management commands, away from the request path, so analytics read the
+summaries instead of aggregating the live tables.
+"""
+
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from .models import (Listing, Event, ListingSummary, UserSummary, Projection)
+
+# Events applied per transaction
+BATCH_SIZE = 1000
+
+# Name of the summaries' row in Projection
+SUMMARIES = 'summaries'
+
+
+def record(kind, listing_id, user_id=None, amount=None, timestamp=None):
+    Event.objects.create(kind=kind, listing_id=listing_id, user_id=user_id, amount=amount,
+                         timestamp=timestamp or now())
+
+def record_watches(kind, pairs):
+    """ Log watch or unwatch events for (listing id, user id) pairs, in one INSERT """
+    Event.objects.bulk_create([Event(kind=kind, listing_id=listing_id, user_id=user_id)
+                               for listing_id, user_id in pairs])
+
+def record_closes(listing_ids):
+    """ Log a close, with the winner and price, for each of the listings that is still open
+
+    Must run in the closing transaction, before the UPDATE: a single INSERT ... SELECT, so
+    listings another worker closed first are skipped rather than logged twice.
+    """
+    placeholders = ', '.join(['%s'] * len(listing_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {Event._meta.db_table} (kind, listing_id, user_id, amount, timestamp) "
+            f"SELECT %s, id, high_bidder_id, current_high_bid, %s FROM {Listing._meta.db_table} "
+            f"WHERE active AND id IN ({placeholders})",
+            [Event.CLOSE, connection.ops.adapt_datetimefield_value(now()), *listing_ids])
+
+def record_dropped_watches(listing_ids):
+    """ Log an unwatch for every watch on the given listings
+
+    Must run in the deleting transaction, before the watch rows go: a single INSERT ... SELECT,
+    so archiving a listing takes it off its watchers' projected counts.
+    """
+    placeholders = ', '.join(['%s'] * len(listing_ids))
+    watch_table = Listing.watched_by.through._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {Event._meta.db_table} (kind, listing_id, user_id, amount, timestamp) "
+            f"SELECT %s, listing_id, user_id, NULL, %s FROM {watch_table} "
+            f"WHERE listing_id IN ({placeholders}) ORDER BY listing_id, user_id",
+            [Event.UNWATCH, connection.ops.adapt_datetimefield_value(now()), *listing_ids])
+
+
+def project(batch_size=None):
+    """ Apply the next batch of events to the summaries; return how many were applied
+
+    The position is moved with a conditional UPDATE first, so two projectors running at
+    once can't apply the same batch twice: the second one finds it moved and stops.
+    """
+    with transaction.atomic():
+        position = Projection.objects.get_or_create(name=SUMMARIES)[0].position
+        events = list(Event.objects.filter(id__gt=position).order_by('id')[:batch_size or BATCH_SIZE])
+        if not events:
+            return 0
+        if not Projection.objects.filter(name=SUMMARIES, position=position).update(position=events[-1].id):
+            return 0
+        listings = ListingSummary.objects.in_bulk({event.listing_id for event in events})
+        users = UserSummary.objects.in_bulk({event.user_id for event in events} - {None})
+        existing = set(listings), set(users)
+        for event in events:
+            listing = listings.setdefault(event.listing_id, ListingSummary(listing_id=event.listing_id))
+            user = event.user_id and users.setdefault(event.user_id, UserSummary(user_id=event.user_id))
+            apply(event, listing, user)
+        _save(ListingSummary, listings, existing[0])
+        _save(UserSummary, users, existing[1])
+    return len(events)
+
+def apply(event, listing, user):
+    """ Fold one event into the summaries of its listing and user (None for a close without winner) """
+    if user and event.kind != Event.CLOSE:
+        user.last_active_at = event.timestamp
+    if event.kind == Event.BID:
+        listing.bid_count += 1
+        listing.first_bid_at = listing.first_bid_at or event.timestamp
+        listing.last_bid_at = event.timestamp
+        # Strictly higher: of equal bids the first one leads, as in bidding.place_bid
+        if listing.high_bid is None or event.amount > listing.high_bid:
+            listing.high_bid, listing.high_bidder_id = event.amount, event.user_id
+        user.bid_count += 1
+        user.highest_bid = max(user.highest_bid or 0, event.amount)
+    elif event.kind == Event.COMMENT:
+        listing.comment_count += 1
+        user.comment_count += 1
+    elif event.kind in (Event.WATCH, Event.UNWATCH):
+        change = 1 if event.kind == Event.WATCH else -1
+        listing.watchers += change
+        user.watching += change
+    elif event.kind == Event.CLOSE:
+        listing.closed_at, listing.winner_id = event.timestamp, event.user_id
+        if user:
+            user.wins += 1
+
+def _save(model, summaries, existing):
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    model.objects.bulk_create([summary for key, summary in summaries.items() if key not in existing])
+    model.objects.bulk_update([summary for key, summary in summaries.items() if key in existing], fields)
+
+def replay(batch_size=None):
+    """ Rebuild the summaries from the start of the log, one batch at a time; return the events applied
+
+    Only a batch of events is held in memory at once. Readers see partial totals until
+    the replay catches up.
+    """
+    with transaction.atomic():
+        ListingSummary.objects.all().delete()
+        UserSummary.objects.all().delete()
+        Projection.objects.update_or_create(name=SUMMARIES, defaults={'position': 0})
+    applied = 0
+    while True:
+        batch = project(batch_size)
+        if not batch:
+            return applied
+        applied += batch
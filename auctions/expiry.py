@@ -0,0 +1,56 @@
+""" Closing auctions, by their owner or automatically when their end time passes """
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils.timezone import now
+
+from .caching import (invalidate_listing, invalidate_listings)
+from .events import (record_closes)
+from .live import hub
+from .ranking import (drop)
+from .models import (Listing, Bid)
+
+# Listings closed per UPDATE when settling expired auctions
+BATCH_SIZE = 500
+
+
+def close_listings(listing_ids):
+    """ Close the given open listings in one UPDATE, recording each one's winning bid """
+    top_bid = Bid.objects.filter(listing=OuterRef('pk')).order_by('-amount', 'id')
+    with transaction.atomic():
+        record_closes(listing_ids)
+        closed_at = now()
+        closed = Listing.objects.open().filter(pk__in=listing_ids).update(
+            active=False, closed_at=closed_at, modified_at=closed_at,
+            winning_bid=Subquery(top_bid.values('id')[:1]))
+        drop(listing_ids)
+
+        # UPDATE sends no post_save, so tell the caches and live streams ourselves
+        def announce():
+            invalidate_listings()
+            for listing_id in listing_ids:
+                invalidate_listing(listing_id)
+                hub.publish(listing_id, 'close', {})
+        transaction.on_commit(announce)
+    return closed
+
+def settle_expired(until=None, batch_size=None):
+    """ Close every open listing whose end time has passed, a batch at a time
+
+    Each batch is picked off the (active, ends_at) index in end-time order, so the
+    cost depends on how many auctions are due, not on the size of the listing table.
+    """
+    until = until or now()
+    batch_size = batch_size or BATCH_SIZE
+    settled = 0
+    while True:
+        due = list(Listing.objects.open().filter(ends_at__lte=until)
+                   .order_by('ends_at').values_list('id', flat=True)[:batch_size])
+        if not due:
+            return settled
+        settled += close_listings(due)
+
+def next_expiry():
+    """ End time of the open auction that expires first, or None """
+    return (Listing.objects.open().filter(ends_at__isnull=False)
+            .order_by('ends_at').values_list('ends_at', flat=True).first())
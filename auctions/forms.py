@@ -1,31 +1,52 @@
 from django import forms
-from django.core.exceptions import ValidationError
 from django.forms import ModelForm
-from django.utils.translation import gettext as _
 
-from .models import (Listing)
+from .images import (store_upload, upload_extension, ImageError, MAX_SOURCE_BYTES)
+from .models import (Category, Listing)
 
 class ListingForm(ModelForm):
     """ Form to create a new listing """
+    category_name = forms.CharField(label='Category', max_length=64, required=False)
+    image = forms.FileField(label='Or upload an image', required=False)
+    field_order = ['user', 'name', 'description', 'starting_bid', 'category_name', 'image_url', 'image', 'ends_at']
+
     class Meta:
         model = Listing
-        fields = ['user', 'name', 'description', 'starting_bid', 'category', 'image_url']
+        fields = ['user', 'name', 'description', 'starting_bid', 'image_url', 'ends_at']
         widgets = {'user': forms.HiddenInput()}
 
+    def save(self, commit=True):
+        # Categories are typed in freely; the first listing to use a name creates it
+        name = self.cleaned_data['category_name'].strip()
+        if name:
+            self.instance.category = Category.objects.get_or_create(name=name)[0]
+        # Uploads are stored as-is; the image worker makes the thumbnails later
+        if self.cleaned_data.get('image'):
+            self.instance.image_url = store_upload(self.cleaned_data['image'])
+        return super().save(commit)
+
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if image and image.size > MAX_SOURCE_BYTES:
+            raise forms.ValidationError("Images can be at most 10 MB.")
+        if image:
+            # Decoded here, so only real raster images are ever stored and served
+            try:
+                upload_extension(image.read())
+            except ImageError:
+                raise forms.ValidationError("Upload a JPEG, PNG, WebP or GIF image.")
+        return image
+
+class ListingImportForm(ListingForm):
+    """ ListingForm rules for one row of a bulk import; the importer sets the owner and category """
+    class Meta(ListingForm.Meta):
+        fields = ['name', 'description', 'starting_bid', 'image_url', 'ends_at']
+
 class CommentForm(forms.Form):
     """ Form to comment on a listing """
     comment_content = forms.CharField(label='Your comment', max_length=256)
 
 class BidForm(forms.Form):
-    """ Form to place a bid """
+    """ Form to place a bid, checked against the high bid by bidding.place_bid or set_proxy """
     bid_amount = forms.IntegerField(label='Your bid', max_value=9999, validators=[])
-    min_bid = forms.IntegerField(label='MIN', widget=forms.HiddenInput())
-
-    def clean(self):
-        # Don't allow bids that are below current limit
-        cleaned_data = super(BidForm, self).clean()
-        min_bid = cleaned_data.get('min_bid')
-        bid_amount = cleaned_data.get('bid_amount')
-        if min_bid >= bid_amount:
-            raise ValidationError(_('Must be higher than highest bid so far.'))
-        return cleaned_data
\ No newline at end of file
+    auto = forms.BooleanField(label='Bid automatically up to this amount', required=False)
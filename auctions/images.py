@@ -0,0 +1,193 @@
+""" Listing image pipeline: fetch the source once, store fixed-size JPEG and WebP thumbnails
+
+Thumbnails are named after the SHA-256 of the source image, so a file never changes once
+written and can be served with a year-long cache lifetime. process_pending() is run by the
+process_images management command, away from the request path.
+"""
+
+import hashlib
+import io
+import ipaddress
+import logging
+import re
+import socket
+import urllib.request
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Only the image worker needs Pillow
+    Image = ImageOps = None
+
+from .caching import (invalidate_listing, invalidate_listings)
+from .models import Listing
+
+logger = logging.getLogger(__name__)
+
+# Square thumbnail edge lengths in pixels: grid tiles and the listing page
+SIZES = (100, 400)
+
+FORMATS = {'jpg': ('JPEG', 'image/jpeg'), 'webp': ('WEBP', 'image/webp')}
+
+# Raster formats an upload may be in, by Pillow format name, and the extension it is stored under
+UPLOAD_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+MEDIA_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp', 'gif': 'image/gif'}
+
+# Larger sources are refused, whether uploaded or fetched
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+# Listings processed per batch, and failures before a listing's image is given up on
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 3
+
+FETCH_TIMEOUT = 10
+
+# Media files that may be served: uploads and thumbnails, all named by content hash. Only
+# image extensions, so nothing served from the site's origin can be taken for a page
+SERVED_NAME = re.compile(r'(uploads/[0-9a-f]{64}\.(jpg|png|webp|gif)|thumbnails/[0-9a-f]{32}-[0-9]+\.(jpg|webp))')
+
+
+class ImageError(Exception):
+    """ Raised when a listing image can't be fetched or decoded """
+
+
+def thumbnail_name(key, size, format):
+    return f"thumbnails/{key}-{size}.{format}"
+
+def check_public(url):
+    """ Raise ImageError unless url is http(s) on a host that resolves only to public addresses
+
+    Sellers choose image URLs, so without this the worker would fetch from the loopback
+    interface, the private network or a cloud metadata service on their behalf.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageError(f"Can't fetch {url}")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or None,
+                                                                 proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError) as error:
+        raise ImageError(f"Can't resolve {parts.hostname}: {error}")
+    for address in addresses:
+        address = ipaddress.ip_address(address.split('%', 1)[0])
+        if not address.is_global or address.is_multicast:
+            raise ImageError(f"Won't fetch from {parts.hostname}: {address} isn't a public address")
+
+class PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """ Follows a redirect only to another public http(s) URL """
+
+    def redirect_request(self, request, fp, code, message, headers, url):
+        check_public(url)
+        return super().redirect_request(request, fp, code, message, headers, url)
+
+opener = urllib.request.build_opener(PublicRedirectHandler)
+
+def fetch(url):
+    """ Default fetcher: read an uploaded image from storage or download a public http(s) URL """
+    if url.startswith(settings.MEDIA_URL):
+        name = url[len(settings.MEDIA_URL):]
+        # Checked before storage sees the name, which raises on paths outside MEDIA_ROOT
+        if not SERVED_NAME.fullmatch(name) or not name.startswith('uploads/') or not default_storage.exists(name):
+            raise ImageError(f"No uploaded image {name}")
+        with default_storage.open(name) as upload:
+            return upload.read(MAX_SOURCE_BYTES + 1)
+    check_public(url)
+    try:
+        with opener.open(url, timeout=FETCH_TIMEOUT) as response:
+            return response.read(MAX_SOURCE_BYTES + 1)
+    except (OSError, ValueError) as error:
+        raise ImageError(f"Fetching {url} failed: {error}")
+
+def media_type(name):
+    """ MIME type of a served media file, one of the image types SERVED_NAME allows """
+    return MEDIA_TYPES[name.rsplit('.', 1)[-1]]
+
+def get_fetcher():
+    """ The fetcher named by settings.AUCTIONS_IMAGE_FETCHER, a callable from URL to bytes """
+    return import_string(getattr(settings, 'AUCTIONS_IMAGE_FETCHER', 'auctions.images.fetch'))
+
+def upload_extension(data):
+    """ The extension to store an upload under, from the format Pillow decodes it as
+
+    The client's file name and content type are ignored: anything that isn't one of the
+    UPLOAD_FORMATS raster images raises ImageError.
+    """
+    if Image is None:
+        raise ImageError("Pillow is not installed")
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ImageError("Image is too large")
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+            format = image.format
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as error:
+        raise ImageError(f"Not a usable image: {error}")
+    if format not in UPLOAD_FORMATS:
+        raise ImageError(f"{format} images aren't accepted")
+    return UPLOAD_FORMATS[format]
+
+def store_upload(upload):
+    """ Save an uploaded image under its content hash and return the URL to use as image_url """
+    upload.seek(0)
+    data = upload.read(MAX_SOURCE_BYTES + 1)
+    name = f"uploads/{hashlib.sha256(data).hexdigest()}.{upload_extension(data)}"
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return default_storage.url(name)
+
+def make_thumbnails(data):
+    """ Write every size and format of a source image; return its content key """
+    if Image is None:
+        raise ImageError("Pillow is not installed")
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ImageError("Image is too large")
+    key = hashlib.sha256(data).hexdigest()[:32]
+    if all(default_storage.exists(thumbnail_name(key, size, format)) for size in SIZES for format in FORMATS):
+        return key
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            image = ImageOps.exif_transpose(source).convert('RGB')
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        raise ImageError(f"Not a usable image: {error}")
+    for size in SIZES:
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for format, (pil_format, _) in FORMATS.items():
+            output = io.BytesIO()
+            thumbnail.save(output, pil_format, quality=80)
+            name = thumbnail_name(key, size, format)
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(output.getvalue()))
+    return key
+
+def pending():
+    """ Listings with an image URL but no thumbnails yet, that haven't failed too often """
+    return Listing.objects.filter(image_key='').exclude(image_url='').filter(image_failures__lt=MAX_ATTEMPTS)
+
+def process_pending(batch_size=None):
+    """ Make thumbnails for one batch of pending listings; return how many succeeded """
+    fetcher = get_fetcher()
+    done = 0
+    for listing_id, url in pending().order_by('id').values_list('id', 'image_url')[:batch_size or BATCH_SIZE]:
+        try:
+            key = make_thumbnails(fetcher(url))
+        except Exception as error:
+            # Any failure is counted against its listing, so none can hold up the ones behind it
+            if not isinstance(error, ImageError):
+                logger.exception("Making thumbnails for listing %s failed", listing_id)
+            Listing.objects.filter(pk=listing_id).update(image_failures=F('image_failures') + 1)
+            continue
+        # UPDATE sends no post_save, so drop the cached pages ourselves
+        Listing.objects.filter(pk=listing_id, image_url=url).update(image_key=key, modified_at=now())
+        invalidate_listing(listing_id)
+        done += 1
+    if done:
+        invalidate_listings()
+    return done
@@ -0,0 +1,105 @@
+""" Live listing updates, pushed to browsers as Server-Sent Events over ASGI """
+
+import asyncio
+import json
+import re
+import threading
+
+# Path of the event stream for one listing, served next to the Django app
+EVENTS_PATH = re.compile(r'^/listing/(?P<listing_id>\d+)/events$')
+
+# Seconds between keep-alive comments, so proxies don't drop idle streams
+KEEPALIVE = 15
+
+# Events buffered per subscriber before a slow client starts missing them
+QUEUE_SIZE = 100
+
+
+def _offer(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        pass
+
+
+class Hub:
+    """ In-process fan-out of listing events to every subscribed stream
+
+    Publishers may run in any thread (Django's sync views run in a thread pool under
+    ASGI); each message is handed to the subscriber's own event loop. A broker such as
+    Redis pub/sub can replace this class by offering the same subscribe/publish calls.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, listing_id):
+        queue = asyncio.Queue(QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(listing_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, listing_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(listing_id, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(listing_id, None)
+
+    def subscriber_count(self, listing_id):
+        with self._lock:
+            return len(self._subscribers.get(listing_id, ()))
+
+    def publish(self, listing_id, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+        with self._lock:
+            subscribers = list(self._subscribers.get(listing_id, ()))
+        for loop, queue in subscribers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_offer, queue, message)
+
+
+hub = Hub()
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def listing_events(listing_id, receive, send):
+    """ Stream one listing's bids, comments and close event until the client goes away """
+    queue = hub.subscribe(listing_id)
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')],
+        })
+        while True:
+            message = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({message, disconnect}, timeout=KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if message in done:
+                await send({'type': 'http.response.body', 'body': message.result(), 'more_body': True})
+                continue
+            message.cancel()
+            if disconnect in done:
+                break
+            await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+    finally:
+        disconnect.cancel()
+        hub.unsubscribe(listing_id, queue)
+
+
+def with_listing_events(application):
+    """ Wrap an ASGI application so the listing event streams are served before it """
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            match = EVENTS_PATH.match(scope['path'])
+            if match:
+                return await listing_events(int(match.group('listing_id')), receive, send)
+        return await application(scope, receive, send)
+    return router
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from auctions.archive import (archive_closed)
+
+
+class Command(BaseCommand):
+    help = "Move listings closed longer than the archive age into the archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=settings.AUCTIONS_ARCHIVE_AFTER_DAYS,
+                            help="archive listings closed at least this many days ago")
+        parser.add_argument('--batch-size', type=int, default=None, help="listings moved per batch")
+
+    def handle(self, *args, **options):
+        archived = archive_closed(timedelta(days=options['days']), batch_size=options['batch_size'])
+        self.stdout.write(f"Archived {archived} listings")
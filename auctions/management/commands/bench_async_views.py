@@ -0,0 +1,93 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+
+from auctions.benchmark import seed
+from auctions.models import User
+
+# (page, sync url, async url); {id} is filled with a listing id per request
+PAGES = [
+    ("index", "/", "/async/"),
+    ("listing", "/listing/{id}", "/async/listing/{id}"),
+    ("categories", "/categories", "/async/categories"),
+    ("watchlist", "/watchlist", "/async/watchlist"),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare the sync and async page variants under concurrent load, on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help="requests per page and variant")
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--listings', type=int, default=200)
+        parser.add_argument('--bids', type=int, default=20, help="bids per listing")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            cookie = self.seed(options['listings'], options['bids'])
+            from commerce.asgi import application
+            self.stdout.write(f"{'page':<12}{'variant':<8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}")
+            for page, sync_url, async_url in PAGES:
+                for variant, url in (("sync", sync_url), ("async", async_url)):
+                    latencies, elapsed = asyncio.run(self.load(application, url, cookie, options))
+                    quantiles = statistics.quantiles(latencies, n=20)
+                    self.stdout.write(f"{page:<12}{variant:<8}{len(latencies) / elapsed:>9.1f}"
+                                      f"{quantiles[9] * 1000:>9.1f}{quantiles[18] * 1000:>9.1f}")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, listings, bids):
+        """ Fill the database with one bidder watching every listing; return their session cookie """
+        seed(users=10, listings=listings, bids=bids, comments=3, watches=listings)
+        client = Client()
+        client.force_login(User.objects.get(pk=1))
+        return client.cookies.output(header='', sep='; ').strip()
+
+    async def load(self, application, url, cookie, options):
+        """ Fire requests at the ASGI app with a fixed number in flight """
+        listings = options['listings']
+        queue = asyncio.Queue()
+        for n in range(options['requests']):
+            queue.put_nowait(url.format(id=n % listings + 1))
+        latencies = []
+
+        async def worker():
+            while not queue.empty():
+                path = queue.get_nowait()
+                started = time.perf_counter()
+                status = await self.request(application, path, cookie)
+                if status != 200:
+                    raise RuntimeError(f"{path} returned {status}")
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+        return latencies, time.perf_counter() - started
+
+    async def request(self, application, path, cookie):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': b'', 'root_path': '', 'server': ('localhost', 80),
+            'client': ('127.0.0.1', 0), 'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+        }
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        response = {}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+
+        await application(scope, receive, send)
+        return response['status']
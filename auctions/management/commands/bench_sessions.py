@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from auctions.benchmark import (auth_round_trips, seed)
+
+# (profile, session engine, authentication backends); "stock" is Django's default setup
+PROFILES = [
+    ("stock", 'django.contrib.sessions.backends.db', ['django.contrib.auth.backends.ModelBackend']),
+    ("cookies", 'django.contrib.sessions.backends.signed_cookies', settings.AUTHENTICATION_BACKENDS),
+    ("tuned", settings.SESSION_ENGINE, settings.AUTHENTICATION_BACKENDS),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare the session and user queries of signed-in requests per session setup, on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help="measured requests per page")
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        saved = settings_dict.get('TEST')
+        self.stdout.write(f"{'profile':<9}{'page':<11}{'auth queries':>14}{'other queries':>15}")
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict['TEST'] = dict(saved or {}, NAME=os.path.join(directory, 'sessions.sqlite3'))
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                seed(users=5, listings=20, bids=3, comments=2, watches=5, categories=3)
+                for profile, engine, backends in PROFILES:
+                    cache.clear()
+                    with override_settings(SESSION_ENGINE=engine, AUTHENTICATION_BACKENDS=backends):
+                        figures = auth_round_trips(requests=options['requests'])
+                    for page, counts in figures.items():
+                        self.stdout.write(f"{profile:<9}{page:<11}{counts['auth_queries']:>14}"
+                                          f"{counts['other_queries']:>15}")
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                settings_dict['TEST'] = saved
+                teardown_test_environment()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from auctions.benchmark import (render_times, seed)
+
+LOADERS = ['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader']
+
+# (profile, loaders, template debug); see AUCTIONS_TEMPLATES in settings
+PROFILES = [
+    ("development", LOADERS, True),
+    ("production", [('django.template.loaders.cached.Loader', LOADERS)], False),
+]
+
+
+class Command(BaseCommand):
+    help = "Time the rendering of index.html and listing.html per template profile, on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bids', type=int, nargs='+', default=[10, 1000, 10000], help="bids per listing")
+        parser.add_argument('--repeat', type=int, default=5, help="renders per measurement")
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        saved = settings_dict.get('TEST')
+        setup_test_environment()
+        self.stdout.write(f"{'profile':<13}{'page':<9}{'bids':>7}{'cold ms':>10}{'warm ms':>10}")
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict['TEST'] = dict(saved or {}, NAME=os.path.join(directory, 'templates.sqlite3'))
+            for profile, loaders, debug in PROFILES:
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                templates = [dict(settings.TEMPLATES[0],
+                                  OPTIONS=dict(settings.TEMPLATES[0]['OPTIONS'], loaders=loaders, debug=debug))]
+                try:
+                    seed(users=20, listings=100, bids=3, comments=2, watches=0, categories=5)
+                    with override_settings(TEMPLATES=templates):
+                        figures = render_times(bid_counts=options['bids'], repeat=options['repeat'])
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+                for page in ('index', 'listing'):
+                    for count in options['bids']:
+                        self.stdout.write(f"{profile:<13}{page:<9}{count:>7}{figures[(page, count, 'cold')]:>10}"
+                                          f"{figures[(page, count, 'warm')]:>10}")
+            settings_dict['TEST'] = saved
+        teardown_test_environment()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from auctions.benchmark import (bid_contention, seed)
+
+# (profile, journal mode, pragmas, connection timeout in seconds); "stock" is SQLite's behaviour
+# without tuning. The journal mode is set after migrating, which switches every database to WAL
+PROFILES = [
+    ("stock", 'delete', {}, 5),
+    ("tuned", 'wal', settings.SQLITE_PRAGMAS, 20),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare concurrent bidding on stock and tuned SQLite settings, on throwaway database files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help="concurrent bidders")
+        parser.add_argument('--readers', type=int, default=8, help="concurrent readers of the bid lists")
+        parser.add_argument('--bids', type=int, default=100, help="bids per bidder")
+        parser.add_argument('--listings', type=int, default=5, help="hot listings the bids go to")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'profile':<8}{'writes/s':>10}{'reads/s':>10}{'p50 ms':>9}{'p95 ms':>9}"
+                          f"{'accepted':>10}{'outbid':>8}{'errors':>8}")
+        for profile, journal_mode, pragmas, timeout in PROFILES:
+            figures = self.run_profile(journal_mode, pragmas, timeout, options)
+            self.stdout.write(f"{profile:<8}{figures['writes_per_second']:>10}{figures['reads_per_second']:>10}"
+                              f"{figures['p50_ms']:>9}{figures['p95_ms']:>9}{figures['accepted']:>10}"
+                              f"{figures['outbid']:>8}{figures['errors']:>8}")
+
+    def run_profile(self, journal_mode, pragmas, timeout, options):
+        settings_dict = connection.settings_dict
+        saved = settings_dict.get('TEST'), settings_dict['OPTIONS']
+        with tempfile.TemporaryDirectory() as directory, override_settings(SQLITE_PRAGMAS=pragmas):
+            settings_dict['TEST'] = dict(saved[0] or {}, NAME=os.path.join(directory, 'contention.sqlite3'))
+            settings_dict['OPTIONS'] = dict(saved[1], timeout=timeout)
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+                seed(users=options['writers'], listings=options['listings'], bids=0, comments=0,
+                     watches=0, categories=1)
+                return bid_contention(writers=options['writers'], readers=options['readers'],
+                                      bids=options['bids'], listings=options['listings'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                settings_dict['TEST'], settings_dict['OPTIONS'] = saved
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from auctions.benchmark import (compare, run_mix, seed, summarize)
+
+
+class Command(BaseCommand):
+    help = "Seed a throwaway database, drive a realistic request mix and report latency per endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--listings', type=int, default=500)
+        parser.add_argument('--bids', type=int, default=10, help="bids per listing")
+        parser.add_argument('--comments', type=int, default=3, help="comments per listing")
+        parser.add_argument('--watches', type=int, default=20, help="watched listings per user")
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--clients', type=int, default=10, help="signed-in users sending requests")
+        parser.add_argument('--anonymous', type=float, default=0.2, help="share of page views from signed-out visitors")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="write the results as JSON to this file")
+        parser.add_argument('--baseline', help="JSON results to compare against; regressions fail the command")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown before p95 counts as a regression")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            seed(users=options['users'], listings=options['listings'], bids=options['bids'],
+                 comments=options['comments'], watches=options['watches'], seed=options['seed'])
+            samples, wall_time = run_mix(requests=options['requests'], clients=options['clients'],
+                                         anonymous=options['anonymous'], seed=options['seed'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        results = summarize(samples, wall_time)
+        results['config'] = {key: options[key] for key in
+                             ('users', 'listings', 'bids', 'comments', 'watches', 'requests', 'clients', 'anonymous', 'seed')}
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = compare(results, json.load(baseline), options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against baseline:\n  " + "\n  ".join(regressions))
+            self.stdout.write("No regressions against baseline")
+
+    def report(self, results):
+        self.stdout.write(f"{'endpoint':<14}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+        for endpoint, figures in sorted(results['endpoints'].items()):
+            self.stdout.write(f"{endpoint:<14}{figures['requests']:>9}{figures['p50_ms']:>9.1f}{figures['p95_ms']:>9.1f}"
+                              f"{figures['p99_ms']:>9.1f}{figures['mean_queries']:>9.1f}")
+        self.stdout.write(f"{results['requests']} requests, {results['throughput_rps']} req/s")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from auctions.bulk import (export_rows, EXPORTS, FORMATS)
+
+
+class Command(BaseCommand):
+    help = "Stream listings, bids or comments out as CSV or JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help="file to write, defaults to stdout")
+
+    def handle(self, *args, **options):
+        chunks = export_rows(options['kind'], options['format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.bulk import (format_for, import_listings, read_rows, text_stream, UnknownFormat)
+from auctions.models import User
+
+
+class Command(BaseCommand):
+    help = "Import listings from a CSV or JSONL file, validating and inserting them in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help="username that will own the listings")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user called {options['user']!r}")
+        format = options['format'] or format_for(options['path'])
+        with open(options['path'], 'rb') as binary:
+            try:
+                result = import_listings(read_rows(text_stream(binary), format), user,
+                                         batch_size=options['batch_size'])
+            except UnknownFormat as error:
+                raise CommandError(error)
+        for error in result.errors:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        self.stdout.write(f"Imported {result.created} listings, {result.error_count} rows rejected")
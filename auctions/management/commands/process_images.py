@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.images import (process_pending, Image)
+
+
+class Command(BaseCommand):
+    help = "Fetch listing images and make their thumbnails"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="listings processed per batch")
+        parser.add_argument('--loop', action='store_true', help="keep running, picking up new listings")
+        parser.add_argument('--sleep', type=float, default=10.0, help="seconds to wait when there is nothing to do")
+
+    def handle(self, *args, **options):
+        if Image is None:
+            raise CommandError("Making thumbnails needs Pillow (pip install Pillow)")
+        while True:
+            done = process_pending(batch_size=options['batch_size'])
+            if done or options['verbosity'] > 1:
+                self.stdout.write(f"Made thumbnails for {done} listings")
+            if not options['loop']:
+                return
+            if not done:
+                time.sleep(options['sleep'])
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.events import (project)
+
+
+class Command(BaseCommand):
+    help = "Apply new events from the event log to the listing and user summaries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="events applied per transaction")
+        parser.add_argument('--loop', action='store_true', help="keep running, picking up new events")
+        parser.add_argument('--sleep', type=float, default=5.0, help="seconds to wait when there is nothing to do")
+
+    def handle(self, *args, **options):
+        while True:
+            applied = 0
+            while True:
+                batch = project(batch_size=options['batch_size'])
+                if not batch:
+                    break
+                applied += batch
+            if applied or options['verbosity'] > 1:
+                self.stdout.write(f"Applied {applied} events")
+            if not options['loop']:
+                return
+            time.sleep(options['sleep'])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from auctions.caching import invalidate_all
+from auctions.util import rebuild_bid_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute each listing's high bid, high bidder and bid count from its bids"
+
+    def handle(self, *args, **options):
+        updated = rebuild_bid_totals()
+        invalidate_all()
+        self.stdout.write(f"Rebuilt bid totals for {updated} listings")
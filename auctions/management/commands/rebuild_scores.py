@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from auctions.ranking import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the hot listing scores from the bids and watchlists"
+
+    def handle(self, *args, **options):
+        scored = rebuild()
+        self.stdout.write(f"Scored {scored} listings")
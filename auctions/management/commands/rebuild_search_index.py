@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from auctions.caching import invalidate_all
+from auctions.triggers import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from the listings table"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = rebuild_search_index()
+        invalidate_all()
+        self.stdout.write(f"Indexed {indexed} listings")
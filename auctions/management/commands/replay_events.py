@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from auctions.events import (replay)
+
+
+class Command(BaseCommand):
+    help = "Rebuild the listing and user summaries from the whole event log"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="events applied per transaction")
+
+    def handle(self, *args, **options):
+        applied = replay(batch_size=options['batch_size'])
+        self.stdout.write(f"Replayed {applied} events")
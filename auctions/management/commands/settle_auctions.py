@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from auctions.expiry import (settle_expired, next_expiry)
+
+
+class Command(BaseCommand):
+    help = "Close auctions whose end time has passed and record their winners"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="listings closed per UPDATE")
+        parser.add_argument('--loop', action='store_true', help="keep running, waking up at the next end time")
+        parser.add_argument('--max-sleep', type=float, default=30.0,
+                            help="seconds to wait at most between checks, so new listings are picked up")
+
+    def handle(self, *args, **options):
+        while True:
+            settled = settle_expired(batch_size=options['batch_size'])
+            if settled or options['verbosity'] > 1:
+                self.stdout.write(f"Settled {settled} auctions")
+            if not options['loop']:
+                return
+            upcoming = next_expiry()
+            wait = options['max_sleep']
+            if upcoming is not None:
+                wait = min(wait, max((upcoming - now()).total_seconds(), 0))
+            time.sleep(wait)
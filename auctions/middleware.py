@@ -0,0 +1,223 @@
+""" Per-request performance instrumentation: query count, DB time, template time and wall time per view """
+
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.shortcuts import render as render_page
+
+logger = logging.getLogger('auctions.performance')
+
+# Same SQL run this many times in one request is reported as a likely N+1
+DUPLICATE_THRESHOLD = 3
+
+# Upper bounds (seconds) of the wall-time histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_current = contextvars.ContextVar('auctions_request_stats', default=None)
+
+
+class RequestStats:
+    """ Figures collected while one sampled request runs """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+        # Async views can run queries for one request on several threads at once
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        """ connection.execute_wrapper hook """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.db_time += elapsed
+                self.queries += 1
+                self.statements[sql] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.statements.items() if count >= DUPLICATE_THRESHOLD}
+
+
+class Registry:
+    """ Running per-view totals, exported in Prometheus text format """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._views = defaultdict(lambda: {
+                'requests': 0, 'seconds': 0.0, 'db_seconds': 0.0, 'template_seconds': 0.0,
+                'queries': 0, 'duplicate_queries': 0, 'buckets': [0] * len(BUCKETS),
+            })
+
+    def record(self, view, wall_time, stats, duplicates):
+        with self._lock:
+            totals = self._views[view]
+            totals['requests'] += 1
+            totals['seconds'] += wall_time
+            totals['db_seconds'] += stats.db_time
+            totals['template_seconds'] += stats.template_time
+            totals['queries'] += stats.queries
+            totals['duplicate_queries'] += sum(duplicates.values())
+            for index, bound in enumerate(BUCKETS):
+                if wall_time <= bound:
+                    totals['buckets'][index] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {view: dict(totals, buckets=list(totals['buckets'])) for view, totals in self._views.items()}
+
+    def prometheus(self):
+        lines = []
+        views = sorted(self.snapshot().items())
+
+        def metric(name, kind, help, key):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for view, totals in views:
+                lines.append(f'{name}{{view="{view}"}} {totals[key]}')
+
+        lines.append("# HELP auctions_request_seconds Wall time per request")
+        lines.append("# TYPE auctions_request_seconds histogram")
+        for view, totals in views:
+            for bound, count in zip(BUCKETS, totals['buckets']):
+                lines.append(f'auctions_request_seconds_bucket{{view="{view}",le="{bound}"}} {count}')
+            lines.append(f'auctions_request_seconds_bucket{{view="{view}",le="+Inf"}} {totals["requests"]}')
+            lines.append(f'auctions_request_seconds_sum{{view="{view}"}} {totals["seconds"]}')
+            lines.append(f'auctions_request_seconds_count{{view="{view}"}} {totals["requests"]}')
+        metric('auctions_db_queries_total', 'counter', "SQL queries run", 'queries')
+        metric('auctions_db_seconds_total', 'counter', "Time spent in SQL queries", 'db_seconds')
+        metric('auctions_template_seconds_total', 'counter', "Time spent rendering templates", 'template_seconds')
+        metric('auctions_duplicate_queries_total', 'counter',
+               "Queries repeated within one request (likely N+1)", 'duplicate_queries')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+def _instrument(connection):
+    # First in line: execute_wrapper() blocks pop the last wrapper when they end
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_query)
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """ Count the queries of every connection, whatever its alias or thread
+
+    Connections are per thread, and the replica and the threads of async views have their
+    own; the request being measured is found through the context, which follows it there.
+    """
+    _instrument(connection)
+
+
+def render(request, template_name, context=None, *args, **kwargs):
+    """ django.shortcuts.render, timed into the template figure of the request being measured
+
+    The views render their pages through this, so only the app's own top-level renders are
+    timed; {% include %} and {% extends %} happen inside them.
+    """
+    stats = _current.get()
+    if stats is None:
+        return render_page(request, template_name, context, *args, **kwargs)
+    started = time.perf_counter()
+    try:
+        return render_page(request, template_name, context, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        with stats._lock:
+            stats.template_time += elapsed
+
+
+class PerformanceMiddleware:
+    """ Measure a sample of requests and add them to the registry and the performance log
+
+    AUCTIONS_METRICS_SAMPLE_RATE (0.0 - 1.0) picks the share of requests measured, so
+    the overhead can be kept negligible at production traffic. Works in sync and async
+    chains, so it doesn't push async views under ASGI into sync mode.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'AUCTIONS_METRICS_SAMPLE_RATE', 1.0)
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        stats, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        stats, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    def _start(self):
+        # Connections opened before this module was loaded sent no connection_created
+        for connection in connections.all():
+            _instrument(connection)
+        stats = RequestStats()
+        return stats, _current.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, started):
+        wall_time = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        duplicates = stats.duplicates()
+        registry.record(view, wall_time, stats, duplicates)
+        line = json.dumps({
+            'view': view,
+            'method': request.method,
+            'status': response.status_code,
+            'wall_ms': round(wall_time * 1000, 3),
+            'db_ms': round(stats.db_time * 1000, 3),
+            'template_ms': round(stats.template_time * 1000, 3),
+            'queries': stats.queries,
+            'duplicate_queries': sum(duplicates.values()),
+        })
+        if duplicates:
+            logger.warning(line, extra={'duplicates': duplicates})
+        else:
+            logger.info(line)
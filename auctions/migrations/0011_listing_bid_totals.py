@@ -0,0 +1,46 @@
+# Generated by Django 3.0.14 on 2026-10-18 18:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_bid_totals(apps, schema_editor):
+    Listing = apps.get_model('auctions', 'Listing')
+    Bid = apps.get_model('auctions', 'Bid')
+    top_bid = Bid.objects.filter(listing=OuterRef('pk')).order_by('-amount', 'id')
+    bid_count = (Bid.objects.filter(listing=OuterRef('pk'))
+                 .order_by().values('listing').annotate(count=Count('id')).values('count'))
+    Listing.objects.update(
+        current_high_bid=Subquery(top_bid.values('amount')[:1]),
+        high_bidder=Subquery(top_bid.values('user')[:1]),
+        bid_count=Coalesce(Subquery(bid_count), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0010_auto_20200810_1531'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='bid_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='current_high_bid',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='high_bidder',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leading_listings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(fill_bid_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+# FTS5 copy of the searchable listing columns, kept in step by triggers so that
+# bulk inserts and queryset updates are indexed too. Bid bookkeeping updates on
+# the listing row don't touch these columns and so never fire the update trigger.
+CREATE_SEARCH_INDEX = [
+    """CREATE VIRTUAL TABLE auctions_listing_fts USING fts5(name, description, category)""",
+    """CREATE TRIGGER auctions_listing_fts_insert AFTER INSERT ON auctions_listing BEGIN
+        INSERT INTO auctions_listing_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+    """CREATE TRIGGER auctions_listing_fts_delete AFTER DELETE ON auctions_listing BEGIN
+        DELETE FROM auctions_listing_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER auctions_listing_fts_update AFTER UPDATE OF name, description, category ON auctions_listing BEGIN
+        DELETE FROM auctions_listing_fts WHERE rowid = old.id;
+        INSERT INTO auctions_listing_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+    """INSERT INTO auctions_listing_fts(rowid, name, description, category)
+        SELECT id, name, description, category FROM auctions_listing""",
+]
+
+DROP_SEARCH_INDEX = [
+    "DROP TRIGGER auctions_listing_fts_update",
+    "DROP TRIGGER auctions_listing_fts_delete",
+    "DROP TRIGGER auctions_listing_fts_insert",
+    "DROP TABLE auctions_listing_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0014_listing_ends_at'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEARCH_INDEX, DROP_SEARCH_INDEX),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery
+import django.db.models.deletion
+
+
+def categories_from_names(apps, schema_editor):
+    """ One Category per distinct non-empty category string, with its listing counts """
+    Category = apps.get_model('auctions', 'Category')
+    Listing = apps.get_model('auctions', 'Listing')
+    names = (Listing.objects.exclude(category_name='').order_by()
+             .values('category_name').annotate(
+                 open_listings=Count('id', filter=Q(active=True)),
+                 closed_listings=Count('id', filter=Q(active=False))))
+    Category.objects.bulk_create(
+        Category(name=row['category_name'], active_count=row['open_listings'], closed_count=row['closed_listings'])
+        for row in names)
+    Listing.objects.exclude(category_name='').update(category=Subquery(
+        Category.objects.filter(name=OuterRef('category_name')).values('id')[:1]))
+
+
+def names_from_categories(apps, schema_editor):
+    Category = apps.get_model('auctions', 'Category')
+    Listing = apps.get_model('auctions', 'Listing')
+    Listing.objects.filter(category__isnull=False).update(category_name=Subquery(
+        Category.objects.filter(id=OuterRef('category')).values('name')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0015_listing_search_index'),
+    ]
+
+    operations = [
+        # SQLite rebuilds the listing table below, taking its triggers with it;
+        # the post_migrate hook in signals.py installs the current ones afterwards
+        migrations.RunSQL([
+            "DROP TRIGGER IF EXISTS auctions_listing_fts_insert",
+            "DROP TRIGGER IF EXISTS auctions_listing_fts_delete",
+            "DROP TRIGGER IF EXISTS auctions_listing_fts_update",
+        ], migrations.RunSQL.noop),
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('active_count', models.IntegerField(default=0)),
+                ('closed_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='listing',
+            name='listing_active_category_idx',
+        ),
+        migrations.RenameField(
+            model_name='listing',
+            old_name='category',
+            new_name='category_name',
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='listings', to='auctions.category'),
+        ),
+        migrations.RunPython(categories_from_names, names_from_categories),
+        migrations.RemoveField(
+            model_name='listing',
+            name='category_name',
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['active', 'category'], name='listing_active_category_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0017_notification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='image_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='image_key',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('image_key', ''), models.Q(_negated=True, image_url='')), fields=['id'], name='listing_image_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:36
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+import django.db.models.deletion
+
+
+def fill_closed_at(apps, schema_editor):
+    # Closed listings never recorded when: take the end time, else the last bid, else now
+    Listing = apps.get_model('auctions', 'Listing')
+    Bid = apps.get_model('auctions', 'Bid')
+    last_bid = Bid.objects.filter(listing=OuterRef('pk')).order_by('-timestamp').values('timestamp')[:1]
+    Listing.objects.filter(active=False).update(
+        closed_at=Coalesce('ends_at', Subquery(last_bid), Value(now())))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0018_listing_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedListing',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=64)),
+                ('seller', models.CharField(max_length=150)),
+                ('description', models.CharField(max_length=256)),
+                ('category', models.CharField(blank=True, max_length=64)),
+                ('starting_bid', models.IntegerField()),
+                ('image_url', models.CharField(blank=True, max_length=256)),
+                ('image_key', models.CharField(blank=True, max_length=32)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('final_price', models.IntegerField(blank=True, null=True)),
+                ('winner', models.CharField(blank=True, max_length=150)),
+                ('bid_count', models.IntegerField(default=0)),
+                ('comments', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_closed_at, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ArchivedBidSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.CharField(max_length=150)),
+                ('bid_count', models.IntegerField()),
+                ('highest_bid', models.IntegerField()),
+                ('first_bid_at', models.DateTimeField()),
+                ('last_bid_at', models.DateTimeField()),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bid_summaries', to='auctions.archivedlisting')),
+            ],
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:48
+
+from django.db import migrations, models
+from django.utils.timezone import now
+import django.utils.timezone
+
+
+def backfill_events(apps, schema_editor):
+    # Start the log from the activity already in the tables; replay_events then builds the summaries
+    Listing = apps.get_model('auctions', 'Listing')
+    Bid = apps.get_model('auctions', 'Bid')
+    Comment = apps.get_model('auctions', 'Comment')
+    Event = apps.get_model('auctions', 'Event')
+    connection = schema_editor.connection
+    watches = Listing._meta.get_field('watched_by').remote_field.through._meta.db_table
+    started = connection.ops.adapt_datetimefield_value(now())
+    insert = f"INSERT INTO {Event._meta.db_table} (kind, listing_id, user_id, amount, timestamp) "
+    with connection.cursor() as cursor:
+        cursor.execute(insert + f"SELECT 'watch', listing_id, user_id, NULL, %s FROM {watches} ORDER BY id",
+                       [started])
+        cursor.execute(insert + f"SELECT 'bid', listing_id, user_id, amount, timestamp "
+                                f"FROM {Bid._meta.db_table} ORDER BY id")
+        cursor.execute(insert + f"SELECT 'comment', listing_id, user_id, NULL, timestamp "
+                                f"FROM {Comment._meta.db_table} ORDER BY timestamp, id")
+        cursor.execute(insert + f"SELECT 'close', id, high_bidder_id, current_high_bid, COALESCE(closed_at, %s) "
+                                f"FROM {Listing._meta.db_table} WHERE NOT active ORDER BY closed_at, id",
+                       [started])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0020_proxy_bid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('bid', 'Bid placed'), ('close', 'Listing closed'), ('watch', 'Watch added'), ('unwatch', 'Watch removed'), ('comment', 'Comment added')], max_length=8)),
+                ('listing_id', models.IntegerField()),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+                ('amount', models.IntegerField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField(blank=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ListingSummary',
+            fields=[
+                ('listing_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('bid_count', models.IntegerField(default=0)),
+                ('high_bid', models.IntegerField(blank=True, null=True)),
+                ('high_bidder_id', models.IntegerField(blank=True, null=True)),
+                ('first_bid_at', models.DateTimeField(blank=True, null=True)),
+                ('last_bid_at', models.DateTimeField(blank=True, null=True)),
+                ('comment_count', models.IntegerField(default=0)),
+                ('watchers', models.IntegerField(default=0)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('winner_id', models.IntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Projection',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('position', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserSummary',
+            fields=[
+                ('user_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('bid_count', models.IntegerField(default=0)),
+                ('highest_bid', models.IntegerField(blank=True, null=True)),
+                ('comment_count', models.IntegerField(default=0)),
+                ('watching', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('last_active_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:02
+
+import math
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+from django.utils.timezone import now
+import django.db.models.deletion
+
+
+def fill_scores(apps, schema_editor):
+    # Frozen copy of ranking.rebuild(), with its constants as of this migration
+    Listing = apps.get_model('auctions', 'Listing')
+    ListingScore = apps.get_model('auctions', 'ListingScore')
+    epoch, decay = datetime(2020, 1, 1, tzinfo=timezone.utc), 6 * 60 * 60 / math.log(2)
+
+    def add(hot, weight, at):
+        shift = (at - epoch).total_seconds() / decay
+        return math.log(max((0 if hot is None else math.exp(hot - shift)) + weight, 1e-6)) + shift
+
+    scores = {}
+    for listing_id, timestamp in (Listing.objects.filter(active__in=[True], bids__isnull=False)
+                                  .values_list('id', 'bids__timestamp').order_by('id', 'bids__timestamp')
+                                  .iterator()):
+        scores[listing_id] = add(scores.get(listing_id, (None, 0))[0], 1.0, timestamp), 0
+    at = now()
+    for listing_id in (Listing.watched_by.through.objects.filter(listing__active__in=[True])
+                       .values_list('listing_id', flat=True).iterator()):
+        hot, watchers = scores.get(listing_id, (add(None, 0, at), 0))
+        scores[listing_id] = hot, watchers + 1
+    ListingScore.objects.bulk_create([ListingScore(listing_id=listing_id, hot=hot, watchers=watchers)
+                                      for listing_id, (hot, watchers) in scores.items()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0021_event_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingScore',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='auctions.listing')),
+                ('hot', models.FloatField()),
+                ('watchers', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='listingscore',
+            index=models.Index(fields=['-hot'], name='listingscore_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listingscore',
+            index=models.Index(fields=['-watchers'], name='listingscore_watchers_idx'),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+    ]
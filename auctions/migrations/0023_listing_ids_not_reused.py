@@ -0,0 +1,40 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:16
+
+from django.db import connections, migrations, models, router
+from django.db.models import Max
+
+
+def skip_archived_ids(apps, schema_editor):
+    # Listings archived before AUTOINCREMENT may sit above the live ids; start the sequence past them
+    connection = schema_editor.connection
+    Listing = apps.get_model('auctions', 'Listing')
+    ArchivedListing = apps.get_model('auctions', 'ArchivedListing')
+    if connection.vendor != 'sqlite' or not router.allow_migrate_model(connection.alias, Listing):
+        return
+    archive = router.db_for_read(ArchivedListing) or connection.alias
+    if ArchivedListing._meta.db_table not in connections[archive].introspection.table_names():
+        return
+    highest = ArchivedListing.objects.using(archive).aggregate(highest=Max('id'))['highest']
+    if highest is None:
+        return
+    table = Listing._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 "
+                       "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)", [table, table])
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s", [highest, table])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0022_listing_score'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='listing',
+            name='id',
+            field=models.AutoField(primary_key=True, serialize=False),
+        ),
+        migrations.RunPython(skip_archived_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0023_listing_ids_not_reused'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='modified_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-18 21:05
+
+from django.db import migrations
+
+
+def journal_mode(mode):
+    def set_mode(apps, schema_editor):
+        # Stored in the database file, so set once here rather than on every connection
+        if schema_editor.connection.vendor == 'sqlite':
+            with schema_editor.connection.cursor() as cursor:
+                cursor.execute(f"PRAGMA journal_mode = {mode}")
+    return set_mode
+
+
+class Migration(migrations.Migration):
+
+    # SQLite can't switch the journal mode inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('auctions', '0024_listing_modified_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(journal_mode('wal'), journal_mode('delete'), atomic=False),
+    ]
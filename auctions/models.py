@@ -6,16 +6,60 @@ from django.utils.timezone import now
 class User(AbstractUser):
     id = models.IntegerField(primary_key=True)
 
+class Category(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+    # Listing counts, kept in step by the triggers in triggers.py
+    active_count = models.IntegerField(default=0)
+    closed_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+class ListingQuerySet(models.QuerySet):
+    # `active IN (...)` rather than filter(active=...): Django 3.1+ compiles the latter
+    # to a bare WHERE "active", which SQLite won't match against the (active, category) index
+    def open(self):
+        return self.filter(active__in=[True])
+
+    def closed(self):
+        return self.filter(active__in=[False])
+
 class Listing(models.Model):
-    id = models.IntegerField(primary_key=True)
+    # AUTOINCREMENT under SQLite, so the id of an archived listing is never handed out again
+    id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=64)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="listings", default=1)
     description = models.CharField(max_length=256)
     starting_bid = models.IntegerField()
     image_url = models.CharField(blank=True, max_length=256)
-    category = models.CharField(max_length=64, blank=True)
+    # Content key of the thumbnails made by images.process_pending; empty until they exist
+    image_key = models.CharField(blank=True, max_length=32)
+    image_failures = models.IntegerField(default=0)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, related_name="listings", null=True, blank=True)
     active = models.BooleanField(default=True)
     watched_by = models.ManyToManyField('User', related_name='watchlist')
+    # Running totals, kept in step with the bids table by bidding.place_bid
+    current_high_bid = models.IntegerField(null=True, blank=True)
+    high_bidder = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="leading_listings", null=True, blank=True)
+    bid_count = models.IntegerField(default=0)
+    # Auction end; expiry.settle_expired closes the listing and records the winning bid
+    ends_at = models.DateTimeField(null=True, blank=True)
+    winning_bid = models.ForeignKey('Bid', on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    # Set by expiry.close_listings; archive.archive_closed moves listings out once it is old enough
+    closed_at = models.DateTimeField(null=True, blank=True)
+    # Last change to the listing row itself, for the API's Last-Modified; queryset updates
+    # that change what the API shows (closing, thumbnails) set it themselves
+    modified_at = models.DateTimeField(auto_now=True)
+
+    objects = ListingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active', 'category'], name='listing_active_category_idx'),
+            models.Index(fields=['active', 'ends_at'], name='listing_active_ends_at_idx'),
+            models.Index(fields=['id'], name='listing_image_pending_idx',
+                         condition=models.Q(image_key='') & ~models.Q(image_url='')),
+        ]
 
     def __str__(self):
         return f"{self.id}: {self.name}"
@@ -26,6 +70,12 @@ class Bid(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bids", default=1)
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="bids")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['listing', '-amount'], name='bid_listing_amount_idx'),
+            models.Index(fields=['listing', 'timestamp'], name='bid_listing_timestamp_idx'),
+        ]
+
     def __str__(self):
         return f"{self.id}: {self.user}'s' bid of {self.amount} on {self.listing}"
 
@@ -35,5 +85,150 @@ class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="comments")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['listing', 'timestamp'], name='comment_listing_timestamp_idx'),
+        ]
+
     def __str__(self):
         return f"{self.id}: {self.user} said \'{self.content}\' about {self.listing}"
+
+class ProxyBid(models.Model):
+    """ A bidder's hidden maximum; bidding.place_bid and set_proxy bid on their behalf up to it """
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="proxy_bids")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="proxy_bids")
+    maximum = models.IntegerField()
+    # Ties between equal maximums go to the earliest proxy
+    timestamp = models.DateTimeField(default=now, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'user'], name='proxybid_listing_user_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user}'s proxy up to {self.maximum} on {self.listing}"
+
+class Notification(models.Model):
+    """ Inbox entry telling a bidder they were outbid, written by bidding.place_bid """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications")
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="+")
+    amount = models.IntegerField()
+    timestamp = models.DateTimeField(default=now, blank=True)
+    read = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.id}: {self.user} outbid on {self.listing} at {self.amount}"
+
+class Event(models.Model):
+    """ Append-only log of auction activity, written in the same transaction as the change itself
+
+    Listings and users are referenced by id rather than by foreign key, so the log outlives
+    archived listings. events.project() folds it into ListingSummary and UserSummary.
+    """
+    BID = 'bid'
+    CLOSE = 'close'
+    WATCH = 'watch'
+    UNWATCH = 'unwatch'
+    COMMENT = 'comment'
+    KINDS = [(BID, 'Bid placed'), (CLOSE, 'Listing closed'), (WATCH, 'Watch added'),
+             (UNWATCH, 'Watch removed'), (COMMENT, 'Comment added')]
+
+    kind = models.CharField(max_length=8, choices=KINDS)
+    listing_id = models.IntegerField()
+    user_id = models.IntegerField(null=True, blank=True)
+    # The bid; for a close, the winning price (and user_id the winner)
+    amount = models.IntegerField(null=True, blank=True)
+    timestamp = models.DateTimeField(default=now, blank=True)
+
+    def __str__(self):
+        return f"{self.id}: {self.kind} on {self.listing_id} by {self.user_id}"
+
+class ListingSummary(models.Model):
+    """ Per-listing totals projected from the event log """
+    listing_id = models.IntegerField(primary_key=True)
+    bid_count = models.IntegerField(default=0)
+    high_bid = models.IntegerField(null=True, blank=True)
+    high_bidder_id = models.IntegerField(null=True, blank=True)
+    first_bid_at = models.DateTimeField(null=True, blank=True)
+    last_bid_at = models.DateTimeField(null=True, blank=True)
+    comment_count = models.IntegerField(default=0)
+    watchers = models.IntegerField(default=0)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    winner_id = models.IntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.listing_id}: {self.bid_count} bids, high {self.high_bid}"
+
+class UserSummary(models.Model):
+    """ Per-user totals projected from the event log """
+    user_id = models.IntegerField(primary_key=True)
+    bid_count = models.IntegerField(default=0)
+    highest_bid = models.IntegerField(null=True, blank=True)
+    comment_count = models.IntegerField(default=0)
+    watching = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    last_active_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.bid_count} bids, {self.wins} wins"
+
+class Projection(models.Model):
+    """ How far a projector has read the event log """
+    name = models.CharField(max_length=32, primary_key=True)
+    position = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} at event {self.position}"
+
+class ListingScore(models.Model):
+    """ A listing's decayed bid velocity and watcher count, kept by ranking.py for the hot listings feed """
+    listing = models.OneToOneField(Listing, on_delete=models.CASCADE, primary_key=True, related_name="score")
+    # Log of the decayed bid velocity, shifted so it needn't change as time passes; see ranking.py
+    hot = models.FloatField()
+    watchers = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-hot'], name='listingscore_hot_idx'),
+            models.Index(fields=['-watchers'], name='listingscore_watchers_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.listing_id}: hot {self.hot:.2f}, {self.watchers} watchers"
+
+class ArchivedListing(models.Model):
+    """ A closed listing moved out of the live tables by archive.archive_closed
+
+    Names are copied rather than referenced, so the archive can live in its own database.
+    """
+    id = models.IntegerField(primary_key=True)
+    name = models.CharField(max_length=64)
+    seller = models.CharField(max_length=150)
+    description = models.CharField(max_length=256)
+    category = models.CharField(max_length=64, blank=True)
+    starting_bid = models.IntegerField()
+    image_url = models.CharField(blank=True, max_length=256)
+    image_key = models.CharField(blank=True, max_length=32)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    final_price = models.IntegerField(null=True, blank=True)
+    winner = models.CharField(max_length=150, blank=True)
+    bid_count = models.IntegerField(default=0)
+    # [{'user', 'content', 'timestamp'}, ...], oldest first
+    comments = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"{self.id}: {self.name} (archived)"
+
+class ArchivedBidSummary(models.Model):
+    """ One bidder's bids on an archived listing, collapsed into a single row """
+    listing = models.ForeignKey(ArchivedListing, on_delete=models.CASCADE, related_name="bid_summaries")
+    user = models.CharField(max_length=150)
+    bid_count = models.IntegerField()
+    highest_bid = models.IntegerField()
+    first_bid_at = models.DateTimeField()
+    last_bid_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user}: {self.bid_count} bids up to {self.highest_bid} on {self.listing_id}"
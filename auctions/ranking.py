@@ -0,0 +1,139 @@
+""" Hot and ending-soon feeds, ranked off indexes instead of by aggregating bids and watches
+
+A listing's heat is its recent bid velocity plus WATCHER_WEIGHT for each current watcher.
+Velocity decays exponentially: each bid adds BID_WEIGHT, which halves every HALF_LIFE.
+Decaying every row as time passes would mean rewriting the whole table, so it is stored
+shifted instead: `hot` is log(velocity) + (t - EPOCH) / DECAY, evaluated at the last bid.
+All velocities decay at the same rate, so the shift keeps their order without updates, and
+a bid only rewrites its own row. Watchers are a plain count, moved by watch toggles.
+
+The receivers in signals.py keep ListingScore in step; closing drops the row. hot_listings
+finds the top K by reading the hot and watchers indexes side by side until no listing
+further down either one could still make the cut.
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from .models import (Listing, ListingScore)
+
+HALF_LIFE = timedelta(hours=6)
+DECAY = HALF_LIFE.total_seconds() / math.log(2)
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+BID_WEIGHT = 1.0
+# A watcher counts for as much as a quarter of a fresh bid, for as long as they watch
+WATCHER_WEIGHT = 0.25
+
+# Velocity stored for a listing without bids: log(0) can't be
+FLOOR = 1e-6
+
+# Listings per feed
+FEED_SIZE = 20
+
+
+def _shift(at):
+    return (at - EPOCH).total_seconds() / DECAY
+
+def velocity(hot, at=None):
+    """ The decayed bid velocity a stored score stands for at a given time """
+    return math.exp(hot - _shift(at or now()))
+
+def heat(hot, watchers, at=None):
+    """ The feed's ranking: bid velocity plus the watchers' share """
+    return velocity(hot, at) + WATCHER_WEIGHT * watchers
+
+def _add(hot, weight, at):
+    """ The score after adding weight at a given time; hot is None for a listing without one """
+    shift = _shift(at)
+    current = 0 if hot is None else math.exp(hot - shift)
+    return math.log(max(current + weight, FLOOR)) + shift
+
+def bump(listing_id, weight, at=None):
+    """ Add a bid's weight to a listing's velocity """
+    at = at or now()
+    with transaction.atomic():
+        # Called in the bid's own transaction, which under SQLite already holds the write
+        # lock (select_for_update does that elsewhere), so no other bump can slip in
+        # between the read and the write and have its weight lost
+        hot = (ListingScore.objects.select_for_update().filter(pk=listing_id)
+               .values_list('hot', flat=True).first())
+        if hot is None:
+            ListingScore.objects.create(listing_id=listing_id, hot=_add(None, weight, at))
+        else:
+            ListingScore.objects.filter(pk=listing_id).update(hot=_add(hot, weight, at))
+
+def watch(listing_id, change):
+    """ Add change (+1 or -1) to a listing's watcher count; closed listings stay off the feed """
+    with transaction.atomic():
+        if ListingScore.objects.filter(pk=listing_id).update(watchers=F('watchers') + change) or change < 0:
+            return
+        # No score yet: a first watch, or a listing closing dropped it
+        if Listing.objects.open().filter(pk=listing_id).exists():
+            ListingScore.objects.create(listing_id=listing_id, hot=_add(None, 0, now()), watchers=change)
+
+def drop(listing_ids):
+    """ Take closed listings off the hot feed """
+    ListingScore.objects.filter(listing_id__in=listing_ids).delete()
+
+def rebuild():
+    """ Recompute every open listing's score from its bids and watchers; return how many were scored
+
+    Scans the whole bid and watch tables, so it is for the rebuild_scores command only.
+    """
+    watch_table = Listing.watched_by.through
+    scores = {}
+    for listing_id, timestamp in (Listing.objects.open().filter(bids__isnull=False)
+                                  .values_list('id', 'bids__timestamp').order_by('id', 'bids__timestamp')
+                                  .iterator()):
+        scores[listing_id] = _add(scores.get(listing_id, (None, 0))[0], BID_WEIGHT, timestamp), 0
+    at = now()
+    for listing_id in (watch_table.objects.filter(listing__active__in=[True])
+                       .values_list('listing_id', flat=True).iterator()):
+        hot, watchers = scores.get(listing_id, (_add(None, 0, at), 0))
+        scores[listing_id] = hot, watchers + 1
+    with transaction.atomic():
+        ListingScore.objects.all().delete()
+        ListingScore.objects.bulk_create([ListingScore(listing_id=listing_id, hot=hot, watchers=watchers)
+                                          for listing_id, (hot, watchers) in scores.items()], batch_size=500)
+    return len(scores)
+
+
+def hot_listings(size=None, at=None):
+    """ The open listings with the most heat, hottest first
+
+    Reads the top of the hot and the watchers index, `size` rows deep, then deeper while
+    the threshold test fails: a listing below both cut-offs has at most the velocity of
+    the last hot row plus the watchers of the last watchers row, so once the size-th
+    best seen reaches that, no unread listing can beat it.
+
+    A bare `active` test rather than Listing.objects.open(): with `active IN (...)` SQLite
+    starts from the listing index and sorts every open listing, instead of walking the
+    score index and stopping after `depth` rows. Closing drops the score, so few are skipped.
+    """
+    size, at = size or FEED_SIZE, at or now()
+    scores = (ListingScore.objects.filter(listing__active=True)
+              .values('hot', 'watchers', id=F('listing_id'), name=F('listing__name'),
+                      image_key=F('listing__image_key'), current_high_bid=F('listing__current_high_bid')))
+    depth = size
+    while True:
+        by_velocity = list(scores.order_by('-hot')[:depth])
+        by_watchers = list(scores.order_by('-watchers')[:depth])
+        seen = {row['id']: row for row in by_velocity + by_watchers}
+        ranked = sorted(seen.values(), key=lambda row: (-heat(row['hot'], row['watchers'], at), row['id']))
+        if len(by_velocity) < depth:
+            # Every listing has been read
+            return ranked[:size]
+        threshold = heat(by_velocity[-1]['hot'], by_watchers[-1]['watchers'], at)
+        if len(ranked) >= size and heat(ranked[size - 1]['hot'], ranked[size - 1]['watchers'], at) >= threshold:
+            return ranked[:size]
+        depth *= 2
+
+def ending_soon(size=None, at=None):
+    """ The open listings that end next, read off the (active, ends_at) index """
+    return list(Listing.objects.open().filter(ends_at__gt=at or now()).order_by('ends_at')
+                .values('id', 'name', 'image_key', 'current_high_bid', 'ends_at')[:size or FEED_SIZE])
@@ -0,0 +1,141 @@
+""" Token-bucket rate limiting of the write endpoints, per signed-in user and per client IP
+
+Each limited view (settings.AUCTIONS_RATE_LIMITS) has a bucket per user and per address
+that refills at a steady rate up to a burst size; a POST takes one token from each, and
+is answered 429 with a Retry-After when either is empty. Buckets live in process memory,
+or in a SQLite file shared by all worker processes when AUCTIONS_RATE_LIMIT_DB is set.
+"""
+
+import math
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+# Address buckets are this much bigger than user buckets: several users can share an address
+IP_FACTOR = 4
+
+# Views that take the same writes as a limited view, and so share its buckets: the listing
+# page's own bid form posts to the listing view
+SHARED_LIMITS = {'listing': 'add_bid'}
+
+# Past this many buckets in memory, full ones are dropped
+MAX_MEMORY_BUCKETS = 10000
+
+
+class MemoryBuckets:
+    """ Buckets in this process's memory; each worker process limits on its own """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (tokens, updated, rate, burst)
+        self._buckets = {}
+
+    def take(self, key, rate, burst, now):
+        """ Take a token from the bucket; return 0 if there was one, else the seconds until there is """
+        with self._lock:
+            if len(self._buckets) > MAX_MEMORY_BUCKETS:
+                self._prune(now)
+            tokens, updated = self._buckets.get(key, (burst, now))[:2]
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now, rate, burst)
+            return wait
+
+    def _prune(self, now):
+        # A bucket that has refilled is the same as no bucket
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if bucket[0] + (now - bucket[1]) * bucket[2] < bucket[3]}
+
+    def reset(self):
+        with self._lock:
+            self._buckets = {}
+
+
+class SQLiteBuckets:
+    """ Buckets in a SQLite file, shared by every process on the host
+
+    Kept apart from the main database, so throttling never waits on its write lock. The
+    state is disposable: synchronous writes are off, and a lost file only resets the limits.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute("CREATE TABLE IF NOT EXISTS buckets "
+                               "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst, now):
+        """ Take a token from the bucket; return 0 if there was one, else the seconds until there is """
+        connection = self._connection()
+        # IMMEDIATE: read and write the bucket under one lock, so concurrent takes can't both get the last token
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE key = ?", [key]).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            connection.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                               [key, tokens - 1 if not wait else tokens, now])
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return wait
+
+    def reset(self):
+        self._connection().execute("DELETE FROM buckets")
+
+
+_backends = {}
+
+def buckets():
+    """ The bucket store picked by settings.AUCTIONS_RATE_LIMIT_DB, one per process """
+    path = getattr(settings, 'AUCTIONS_RATE_LIMIT_DB', None)
+    if path not in _backends:
+        _backends[path] = SQLiteBuckets(path) if path else MemoryBuckets()
+    return _backends[path]
+
+def throttle(view_name, user_id, address, now=None):
+    """ Take a token for a request; return 0 if it may proceed, else the seconds to wait """
+    view_name = SHARED_LIMITS.get(view_name, view_name)
+    limit = getattr(settings, 'AUCTIONS_RATE_LIMITS', {}).get(view_name)
+    if limit is None:
+        return 0
+    per_minute, burst = limit
+    store = buckets()
+    now = time.time() if now is None else now
+    keys = [(f'{view_name}:ip:{address}', IP_FACTOR)]
+    if user_id is not None:
+        keys.append((f'{view_name}:user:{user_id}', 1))
+    return max(store.take(key, per_minute * factor / 60, burst * factor, now) for key, factor in keys)
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """ Answer 429 to POSTs to a rate-limited view once the user or address has used up its bucket
+
+    MiddlewareMixin makes it async-capable, so it doesn't force async views under ASGI into
+    sync mode; Django runs process_view in a thread then.
+    """
+
+    def process_view(self, request, view, args, kwargs):
+        if request.method != 'POST' or request.resolver_match is None:
+            return None
+        user_id = request.user.pk if request.user.is_authenticated else None
+        wait = throttle(request.resolver_match.url_name, user_id, request.META.get('REMOTE_ADDR'))
+        if not wait:
+            return None
+        response = HttpResponse("Too many requests, please slow down.", status=429, content_type='text/plain')
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
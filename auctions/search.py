@@ -0,0 +1,31 @@
+""" Full-text listing search, backed by the auctions_listing_fts FTS5 table """
+
+import re
+
+from django.db import connection
+
+# Number of results shown per search page
+PAGE_SIZE = 20
+
+
+def match_expression(query):
+    """ Turn free text into a safe FTS5 query: every word must match, the last one as a prefix """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+def search_listings(query, page=1, size=None):
+    """ One page of listings matching the query, best match first, and whether more follow """
+    size = size or PAGE_SIZE
+    match = match_expression(query)
+    if match is None:
+        return [], False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT listing.id, listing.name, listing.active "
+            "FROM auctions_listing_fts JOIN auctions_listing AS listing ON listing.id = auctions_listing_fts.rowid "
+            "WHERE auctions_listing_fts MATCH %s ORDER BY auctions_listing_fts.rank LIMIT %s OFFSET %s",
+            [match, size + 1, (page - 1) * size])
+        rows = [{'id': row[0], 'name': row[1], 'active': bool(row[2])} for row in cursor.fetchall()]
+    return rows[:size], len(rows) > size
@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .auth import (invalidate_user)
+from .caching import (invalidate_listing, invalidate_listings)
+from .events import (record, record_watches)
+from .live import hub
+from .models import (User, Category, Listing, Bid, Comment, Event)
+from .ranking import (bump, watch, BID_WEIGHT)
+from .triggers import (install_triggers, rename_category_in_search_index)
+
+
+# Caches are dropped once the write commits: dropped any earlier, a reader in between would
+# cache the old rows again under the new generation, and keep serving them until PAGE_TIMEOUT
+
+@receiver([post_save, post_delete], sender=Bid)
+@receiver([post_save, post_delete], sender=Comment)
+def listing_activity_changed(sender, instance, **kwargs):
+    listing_id = instance.listing_id
+    transaction.on_commit(lambda: invalidate_listing(listing_id))
+
+@receiver([post_save, post_delete], sender=Listing)
+def listing_changed(sender, instance, **kwargs):
+    listing_id = instance.pk
+
+    def invalidate():
+        invalidate_listing(listing_id)
+        invalidate_listings()
+    transaction.on_commit(invalidate)
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Bid)
+def publish_bid(sender, instance, created, **kwargs):
+    if created:
+        data = {'amount': instance.amount, 'user': str(instance.user), 'timestamp': str(instance.timestamp)}
+        transaction.on_commit(lambda: hub.publish(instance.listing_id, 'bid', data))
+
+@receiver(post_save, sender=Comment)
+def publish_comment(sender, instance, created, **kwargs):
+    if created:
+        data = {'content': instance.content, 'user': str(instance.user), 'timestamp': str(instance.timestamp)}
+        transaction.on_commit(lambda: hub.publish(instance.listing_id, 'comment', data))
+
+@receiver(post_save, sender=Listing)
+def publish_close(sender, instance, created, **kwargs):
+    if not created and not instance.active:
+        transaction.on_commit(lambda: hub.publish(instance.pk, 'close', {}))
+
+
+@receiver(post_save, sender=Bid)
+def log_bid(sender, instance, created, **kwargs):
+    if created:
+        record(Event.BID, instance.listing_id, instance.user_id, instance.amount, instance.timestamp)
+
+@receiver(post_save, sender=Comment)
+def log_comment(sender, instance, created, **kwargs):
+    if created:
+        record(Event.COMMENT, instance.listing_id, instance.user_id, timestamp=instance.timestamp)
+
+@receiver(m2m_changed, sender=Listing.watched_by.through)
+def log_watches(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove') and pk_set:
+        # From a listing, pk_set holds user ids; from a user's watchlist, listing ids
+        pairs = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in sorted(pk_set)]
+        record_watches(Event.WATCH if action == 'post_add' else Event.UNWATCH, pairs)
+
+
+@receiver(post_save, sender=Bid)
+def score_bid(sender, instance, created, **kwargs):
+    if created:
+        bump(instance.listing_id, BID_WEIGHT, at=instance.timestamp)
+
+@receiver(m2m_changed, sender=Listing.watched_by.through)
+def score_watches(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove') and pk_set:
+        change = 1 if action == 'post_add' else -1
+        if reverse:
+            for listing_id in sorted(pk_set):
+                watch(listing_id, change)
+        else:
+            watch(instance.pk, len(pk_set) * change)
+
+
+@receiver(post_save, sender=Category)
+def category_renamed(sender, instance, created, **kwargs):
+    if not created:
+        rename_category_in_search_index(instance)
+        transaction.on_commit(invalidate_listings)
+
+@receiver(post_migrate)
+def reinstall_triggers(sender, **kwargs):
+    if sender.name == 'auctions':
+        install_triggers()
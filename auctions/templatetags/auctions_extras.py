@@ -0,0 +1,22 @@
+""" Inclusion tags for the listing page's bid and comment lists
+
+Each renders from plain rows (values()) rather than model instances, so building a list
+of thousands of bids costs one narrow query and no object construction. The listing page
+wraps both in {% cache %}, so they only run when a bid or comment invalidated the fragment.
+"""
+
+from django import template
+from django.db.models import F
+
+register = template.Library()
+
+
+@register.inclusion_tag('auctions/bid_list.html')
+def bid_list(bids):
+    """ A listing's bids, newest first; `bids` is the page's oldest-first queryset """
+    return {'bids': bids.reverse().values('amount', 'timestamp', user_name=F('user__username'))}
+
+@register.inclusion_tag('auctions/comment_list.html')
+def comment_list(comments):
+    """ A listing's comments, newest first; `comments` is the page's oldest-first queryset """
+    return {'comments': comments.reverse().values('content', 'timestamp', user_name=F('user__username'))}
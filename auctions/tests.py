@@ -1,3 +1,1672 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.base import BaseHandler
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.template.backends.django import Template
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+
+from .archive import (archive_closed, copy_to_archive)
+from .async_views import (db)
+from .auth import (cached_user)
+from .bidding import (place_bid, set_proxy, BidRejected)
+from .benchmark import (auth_round_trips, compare, render_times, run_mix, seed, summarize)
+from .bulk import (import_listings, read_rows, BATCH_SIZE)
+from .caching import (generation, listing_scope)
+from .database import (read_only, ReadReplicaRouter)
+from .events import (project, replay)
+from .expiry import (close_listings, settle_expired, next_expiry)
+from .forms import (ListingForm)
+from .images import (check_public, fetch, pending, process_pending, Image, ImageError, PublicRedirectHandler,
+                     MAX_ATTEMPTS)
+from .live import (hub, with_listing_events)
+from .middleware import (registry, PerformanceMiddleware)
+from .ranking import (bump, heat, hot_listings, rebuild, velocity, HALF_LIFE, WATCHER_WEIGHT)
+from .ratelimit import (buckets, throttle, MemoryBuckets, SQLiteBuckets, IP_FACTOR)
+from .models import (User, Category, Listing, Bid, ProxyBid, Comment, Notification, Event, ListingSummary,
+                     UserSummary, ListingScore, ArchivedListing, ArchivedBidSummary)
+from .search import (search_listings)
+from .util import (get_min_bid)
+
+
+@contextmanager
+def committed():
+    """ Run the on_commit callbacks queued inside the block, as its commit would; TestCase never commits """
+    start = len(connection.run_on_commit)
+    yield
+    while len(connection.run_on_commit) > start:
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for _, callback in callbacks:
+            callback()
+
+
+class BidTotalsTests(TestCase):
+    """ Denormalized high bid / bid count on Listing """
+
+    def setUp(self):
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+        self.bidder = User.objects.create_user(id=2, username="bidder", password="pw")
+        self.other = User.objects.create_user(id=3, username="other", password="pw")
+        self.listing = Listing.objects.create(id=1, name="Lamp", user=self.seller,
+                                              description="A lamp", starting_bid=10)
+
+    def test_min_bid_defaults_to_starting_bid(self):
+        self.assertEqual(get_min_bid(self.listing.id), 10)
+
+    def test_place_bid_updates_totals(self):
+        place_bid(self.listing.id, self.bidder, 15)
+        place_bid(self.listing.id, self.other, 20)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_high_bid, 20)
+        self.assertEqual(self.listing.high_bidder, self.other)
+        self.assertEqual(self.listing.bid_count, 2)
+        self.assertEqual(get_min_bid(self.listing.id), 20)
+
+    def test_lower_bid_is_rejected(self):
+        place_bid(self.listing.id, self.bidder, 30)
+        with self.assertRaises(BidRejected):
+            place_bid(self.listing.id, self.other, 30)
+        with self.assertRaises(BidRejected):
+            place_bid(self.listing.id, self.other, 20)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_high_bid, 30)
+        self.assertEqual(self.listing.high_bidder, self.bidder)
+        self.assertEqual(self.listing.bid_count, 1)
+        self.assertEqual(Bid.objects.count(), 1)
+
+    def test_bid_must_beat_starting_bid(self):
+        with self.assertRaises(BidRejected):
+            place_bid(self.listing.id, self.bidder, 10)
+
+    def test_closed_listing_rejects_bids(self):
+        Listing.objects.filter(pk=self.listing.id).update(active=False)
+        with self.assertRaises(BidRejected):
+            place_bid(self.listing.id, self.bidder, 50)
+
+    def test_stale_client_min_bid_is_ignored(self):
+        place_bid(self.listing.id, self.other, 40)
+        self.client.force_login(self.bidder)
+        self.client.post(reverse("add_bid", args=[self.listing.id]),
+                         {"bid_amount": 20, "min_bid": 10})
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_high_bid, 40)
+        self.assertEqual(self.listing.high_bidder, self.other)
+
+    def test_add_bid_view_records_totals(self):
+        self.client.force_login(self.bidder)
+        self.client.post(reverse("add_bid", args=[self.listing.id]),
+                         {"bid_amount": 12})
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_high_bid, 12)
+        self.assertEqual(self.listing.bid_count, 1)
+
+    def test_rebuild_bid_totals(self):
+        Bid.objects.create(listing=self.listing, user=self.bidder, amount=11)
+        Bid.objects.create(listing=self.listing, user=self.other, amount=14)
+        empty = Listing.objects.create(id=2, name="Chair", user=self.seller,
+                                       description="A chair", starting_bid=5,
+                                       current_high_bid=99, bid_count=3)
+        call_command("rebuild_bid_totals", stdout=StringIO())
+        self.listing.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual((self.listing.current_high_bid, self.listing.high_bidder, self.listing.bid_count),
+                         (14, self.other, 2))
+        self.assertEqual((empty.current_high_bid, empty.high_bidder, empty.bid_count),
+                         (None, None, 0))
+
+
+class ConcurrentBidTests(TransactionTestCase):
+    """ Many threads bidding on one listing at once """
+
+    THREADS = 20
+    BIDS_PER_THREAD = 100
+
+    def test_accepted_bids_strictly_increase(self):
+        users = [User.objects.create_user(id=n + 1, username=f"user{n}", password="pw")
+                 for n in range(self.THREADS)]
+        listing = Listing.objects.create(id=1, name="Vase", user=users[0],
+                                         description="A vase", starting_bid=0)
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def bidder(user, offset):
+            barrier.wait()
+            try:
+                # Every thread walks the same price ladder, so most bids collide
+                for step in range(self.BIDS_PER_THREAD):
+                    try:
+                        place_bid(listing.id, user, step * 2 + offset + 1)
+                    except BidRejected:
+                        pass
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bidder, args=(user, n % 2)) for n, user in enumerate(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        amounts = list(Bid.objects.filter(listing=listing).order_by('id').values_list('amount', flat=True))
+        self.assertTrue(amounts)
+        self.assertTrue(all(a < b for a, b in zip(amounts, amounts[1:])))
+        listing.refresh_from_db()
+        self.assertEqual(listing.current_high_bid, amounts[-1])
+        self.assertEqual(listing.bid_count, len(amounts))
+
+
+class QueryPlanTests(TestCase):
+    """ Every query a view runs must be answered from an index, never a full table scan """
+
+    def setUp(self):
+        self.user = User.objects.create_user(id=1, username="seller", password="pw")
+        self.home = Category.objects.create(name="Home")
+        self.listing = Listing.objects.create(id=1, name="Clock", user=self.user, category=self.home,
+                                              description="A clock", starting_bid=1)
+        Listing.objects.create(id=2, name="Radio", user=self.user, active=False,
+                               description="A radio", starting_bid=1)
+        place_bid(self.listing.id, self.user, 5)
+        Comment.objects.create(listing=self.listing, user=self.user, content="Nice")
+        self.listing.watched_by.add(self.user)
+        self.client.force_login(self.user)
+
+    def full_scans(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        scans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                for step in cursor.fetchall():
+                    if re.match(r'SCAN (TABLE )?\w+$', step[-1]):
+                        scans.append((step[-1], query['sql']))
+        return scans
+
+    def test_index(self):
+        self.assertEqual(self.full_scans(reverse("index")), [])
+
+    def test_listing(self):
+        self.assertEqual(self.full_scans(reverse("listing", args=[self.listing.id])), [])
+
+    def test_categories(self):
+        self.assertEqual(self.full_scans(reverse("categories")), [])
+
+    def test_category(self):
+        self.assertEqual(self.full_scans(reverse("category", args=[self.home.id]) + "?active_after=0"), [])
+
+    def test_uncategorized(self):
+        self.assertEqual(self.full_scans(reverse("uncategorized")), [])
+
+    def test_watchlist(self):
+        self.assertEqual(self.full_scans(reverse("watchlist")), [])
+
+    def test_api(self):
+        self.assertEqual(self.full_scans(reverse("api_listing", args=[self.listing.id])), [])
+        self.assertEqual(self.full_scans(reverse("api_bids", args=[self.listing.id])), [])
+
+
+@mock.patch("auctions.util.PAGE_SIZE", 2)
+class PaginationTests(TestCase):
+    """ Keyset pagination on the index and category pages """
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(id=1, username="seller", password="pw")
+        self.toys = Category.objects.create(name="Toys")
+        for n in range(1, 6):
+            Listing.objects.create(id=n, name=f"Item {n}", user=user, category=self.toys,
+                                   description="", starting_bid=1, active=(n != 5))
+
+    def names(self, rows):
+        return [row['name'] for row in rows]
+
+    def test_first_page(self):
+        response = self.client.get(reverse("index"))
+        self.assertEqual(self.names(response.context['active_listings']), ["Item 1", "Item 2"])
+        self.assertEqual(response.context['active_next'], 2)
+        self.assertEqual(self.names(response.context['closed_listings']), ["Item 5"])
+        self.assertIsNone(response.context['closed_next'])
+
+    def test_following_pages(self):
+        response = self.client.get(reverse("index") + "?active_after=2")
+        self.assertEqual(self.names(response.context['active_listings']), ["Item 3", "Item 4"])
+        self.assertIsNone(response.context['active_next'])
+
+    def test_bad_cursor_shows_first_page(self):
+        response = self.client.get(reverse("index") + "?active_after=abc")
+        self.assertEqual(self.names(response.context['active_listings']), ["Item 1", "Item 2"])
+
+    def test_only_rendered_columns_are_selected(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse("index"))
+        listing_queries = [q['sql'] for q in context.captured_queries if 'auctions_listing' in q['sql']]
+        self.assertTrue(listing_queries)
+        for sql in listing_queries:
+            self.assertNotIn('"description"', sql)
+
+    def test_category_page(self):
+        response = self.client.get(reverse("category", args=[self.toys.id]))
+        self.assertEqual(self.names(response.context['active_listings']), ["Item 1", "Item 2"])
+        self.assertContains(response, "?active_after=2")
+        response = self.client.get(reverse("uncategorized"))
+        self.assertEqual(list(response.context['active_listings']), [])
+        self.assertEqual(self.client.get(reverse("category", args=[99])).status_code, 404)
+
+
+class ListingQueryCountTests(TestCase):
+    """ The listing page runs a fixed number of queries however many bids and comments it shows """
+
+    # The listing, the watch check, the bids and the comments; the session and user come from the cache
+    QUERY_BUDGET = 4
+
+    def setUp(self):
+        self.users = [User.objects.create_user(id=n, username=f"user{n}", password="pw")
+                      for n in range(1, 11)]
+        self.listing = Listing.objects.create(id=1, name="Piano", user=self.users[0],
+                                              description="A piano", starting_bid=1)
+        self.listing.watched_by.add(*self.users)
+
+    def add_activity(self, count):
+        for n in range(count):
+            user = self.users[n % len(self.users)]
+            with committed():
+                place_bid(self.listing.id, user, self.listing.starting_bid + Bid.objects.count() + 1)
+                Comment.objects.create(listing=self.listing, user=user, content=f"Comment {n}")
+
+    def test_query_budget_does_not_grow(self):
+        self.client.force_login(self.users[1])
+        cached_user(self.users[1].pk)
+        url = reverse("listing", args=[self.listing.id])
+        for count in (1, 30):
+            self.add_activity(count)
+            with self.assertNumQueries(self.QUERY_BUDGET):
+                self.client.get(url)
+
+    def test_anonymous_visitor(self):
+        self.add_activity(5)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("listing", args=[self.listing.id]))
+        self.assertContains(response, "by user2")
+
+    def test_watch_button(self):
+        self.client.force_login(self.users[1])
+        response = self.client.get(reverse("listing", args=[self.listing.id]))
+        self.assertEqual(response.context['watchbutton'], 'Remove from watchlist')
+        self.listing.watched_by.remove(self.users[1])
+        response = self.client.get(reverse("listing", args=[self.listing.id]))
+        self.assertEqual(response.context['watchbutton'], 'Add to watchlist')
+
+
+class CachingTests(TestCase):
+    """ Cached pages and fragments are reused until a write invalidates them """
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+        self.bidder = User.objects.create_user(id=2, username="bidder", password="pw")
+        self.listing = Listing.objects.create(id=1, name="Kettle", user=self.seller,
+                                              description="A kettle", starting_bid=1)
+        self.url = reverse("listing", args=[self.listing.id])
+
+    def test_anonymous_page_is_cached(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_bid_invalidates_listing_page(self):
+        self.client.get(self.url)
+        with committed():
+            place_bid(self.listing.id, self.bidder, 7)
+        response = self.client.get(self.url)
+        self.assertContains(response, "7 by bidder")
+
+    def test_pages_are_invalidated_once_the_write_commits(self):
+        before = generation(listing_scope(self.listing.id))
+        with committed():
+            with transaction.atomic():
+                place_bid(self.listing.id, self.bidder, 7)
+                # A reader now would cache the page without the bid; it must not stay current
+                self.assertEqual(generation(listing_scope(self.listing.id)), before)
+        self.assertNotEqual(generation(listing_scope(self.listing.id)), before)
+
+    def test_comment_invalidates_fragment(self):
+        self.client.force_login(self.bidder)
+        self.client.get(self.url)
+        with committed():
+            Comment.objects.create(listing=self.listing, user=self.bidder, content="Still boils?")
+        self.assertContains(self.client.get(self.url), "Still boils?")
+
+    def test_signed_in_page_reuses_fragments(self):
+        self.client.force_login(self.bidder)
+        cached_user(self.bidder.pk)
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as second:
+            self.client.get(self.url)
+        self.assertEqual(len(second), len(first) - 2)
+
+    def test_new_listing_invalidates_index(self):
+        self.client.get(reverse("index"))
+        with committed():
+            Listing.objects.create(id=2, name="Toaster", user=self.seller,
+                                   description="A toaster", starting_bid=1)
+        self.assertContains(self.client.get(reverse("index")), "Toaster")
+        self.assertContains(self.client.get(reverse("categories")), "No category")
+
+
+class LiveEventTests(TransactionTestCase):
+    """ Bids, comments and closes are pushed to every open event stream """
+
+    def setUp(self):
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+        self.listing = Listing.objects.create(id=1, name="Bike", user=self.seller,
+                                              description="A bike", starting_bid=1)
+
+    def stream(self, action, clients=2):
+        """ Open event streams, run `action` in a worker thread, return what each client got """
+        async def not_found(scope, receive, send):
+            raise AssertionError("request should not reach Django")
+
+        application = with_listing_events(not_found)
+
+        async def client(received, disconnected):
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                received.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': f'/listing/{self.listing.id}/events'}
+            await application(scope, receive, send)
+
+        async def main():
+            disconnected = asyncio.Event()
+            received = [[] for _ in range(clients)]
+            tasks = [asyncio.ensure_future(client(messages, disconnected)) for messages in received]
+            while hub.subscriber_count(self.listing.id) < clients:
+                await asyncio.sleep(0.01)
+            await asyncio.get_running_loop().run_in_executor(None, action)
+            await asyncio.sleep(0.05)
+            disconnected.set()
+            await asyncio.gather(*tasks)
+            return received
+
+        received = asyncio.run(main())
+        self.assertEqual(hub.subscriber_count(self.listing.id), 0)
+        return [b"".join(m.get('body', b'') for m in messages) for messages in received]
+
+    def test_bid_comment_and_close_reach_every_client(self):
+        def action():
+            place_bid(self.listing.id, self.seller, 9)
+            Comment.objects.create(listing=self.listing, user=self.seller, content="Fast!")
+            self.listing.active = False
+            self.listing.save()
+            connection.close()
+
+        for body in self.stream(action):
+            self.assertIn(b'event: bid\ndata: {"amount": 9, "user": "seller"', body)
+            self.assertIn(b'event: comment\ndata: {"content": "Fast!"', body)
+            self.assertIn(b'event: close\n', body)
+
+    def test_rejected_bid_is_not_pushed(self):
+        def action():
+            with self.assertRaises(BidRejected):
+                place_bid(self.listing.id, self.seller, 1)
+            connection.close()
+
+        for body in self.stream(action, clients=1):
+            self.assertEqual(body, b"")
+
+
+class AsyncViewTests(TransactionTestCase):
+    """ The async page variants render the same content as the sync views """
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+        self.bidder = User.objects.create_user(id=2, username="bidder", password="pw")
+        self.listing = Listing.objects.create(id=1, name="Drum", user=self.seller,
+                                              category=Category.objects.create(name="Music"),
+                                              description="A drum", starting_bid=1)
+        Listing.objects.create(id=2, name="Flute", user=self.seller, active=False,
+                               description="A flute", starting_bid=1)
+        place_bid(self.listing.id, self.bidder, 4)
+        self.listing.watched_by.add(self.bidder)
+        self.async_client = AsyncClient()
+
+    def get(self, url, user=None):
+        async def fetch():
+            if user is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.async_client.force_login, user)
+            return await self.async_client.get(url)
+        return asyncio.run(fetch())
+
+    def test_index(self):
+        response = self.get(reverse("async_index"))
+        self.assertEqual([row['name'] for row in response.context['active_listings']], ["Drum"])
+        self.assertContains(response, "Flute")
+
+    def test_listing(self):
+        response = self.get(reverse("async_listing", args=[self.listing.id]), user=self.bidder)
+        self.assertContains(response, "4 by bidder")
+        self.assertEqual(response.context['watchbutton'], 'Remove from watchlist')
+        self.assertFalse(response.context['mylisting'])
+
+    def test_missing_listing(self):
+        self.assertEqual(self.get(reverse("async_listing", args=[99])).status_code, 404)
+
+    def test_categories(self):
+        self.assertContains(self.get(reverse("async_categories")), "Music")
+
+    def test_watchlist_requires_login(self):
+        self.assertEqual(self.get(reverse("async_watchlist")).status_code, 302)
+        self.assertContains(self.get(reverse("async_watchlist"), user=self.bidder), "Drum")
+
+    def test_middleware_chain_stays_async(self):
+        # load_middleware runs every middleware in sync mode when one of them can't do async
+        with mock.patch.object(ASGIHandler, 'adapt_method_mode', autospec=True,
+                               side_effect=BaseHandler.adapt_method_mode) as adapt:
+            ASGIHandler()
+        self.assertTrue(all(call.args[1] for call in adapt.call_args_list))
+
+    def test_page_cache_is_used_off_the_event_loop(self):
+        calls = []
+        get = cache.get
+
+        def checked_get(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                calls.append('event loop')
+            except RuntimeError:
+                calls.append('thread')
+            return get(*args, **kwargs)
+        with mock.patch.object(cache, 'get', side_effect=checked_get):
+            self.get(reverse("async_index"))
+            self.get(reverse("async_index"))
+        self.assertTrue(calls)
+        self.assertNotIn('event loop', calls)
+
+    def test_worker_threads_check_their_connections(self):
+        checked = []
+        with mock.patch('auctions.async_views.close_old_connections',
+                        side_effect=lambda: checked.append(threading.get_ident())):
+            worker = asyncio.run(db(threading.get_ident)())
+        self.assertEqual(checked, [worker, worker])
+
+    def test_queries_on_worker_threads_are_measured(self):
+        registry.reset()
+        self.get(reverse("async_index"))
+        # Both pages are read on executor threads, each with its own connection
+        self.assertEqual(registry.snapshot()['async_index']['queries'], 2)
+
+
+class ExpiryTests(TestCase):
+    """ Auctions close themselves at their end time """
+
+    def setUp(self):
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+        self.bidder = User.objects.create_user(id=2, username="bidder", password="pw")
+        self.now = now()
+
+    def make_listing(self, listing_id, ends_in):
+        return Listing.objects.create(id=listing_id, name=f"Lot {listing_id}", user=self.seller,
+                                      description="", starting_bid=1,
+                                      ends_at=None if ends_in is None else self.now + ends_in)
+
+    def test_settles_only_expired_listings_in_batches(self):
+        for n in range(1, 8):
+            self.make_listing(n, timedelta(minutes=-n))
+        later = self.make_listing(20, timedelta(hours=1))
+        endless = self.make_listing(21, None)
+        self.assertEqual(settle_expired(until=self.now, batch_size=3), 7)
+        self.assertFalse(Listing.objects.open().filter(id__lt=20).exists())
+        self.assertEqual(set(Listing.objects.open().values_list('id', flat=True)), {later.id, endless.id})
+        self.assertEqual(next_expiry(), later.ends_at)
+
+    def test_winning_bid_is_recorded(self):
+        lot = self.make_listing(1, timedelta(minutes=5))
+        place_bid(lot.id, self.seller, 3)
+        winning = place_bid(lot.id, self.bidder, 8)
+        settle_expired(until=self.now + timedelta(minutes=10))
+        lot.refresh_from_db()
+        self.assertFalse(lot.active)
+        self.assertEqual(lot.winning_bid, winning)
+        self.assertEqual(lot.high_bidder, self.bidder)
+
+    def test_no_bids_after_end_time(self):
+        lot = self.make_listing(1, timedelta(seconds=-1))
+        with self.assertRaises(BidRejected):
+            place_bid(lot.id, self.bidder, 5)
+
+    def test_owner_close_records_winner(self):
+        lot = self.make_listing(1, None)
+        winning = place_bid(lot.id, self.bidder, 4)
+        self.client.force_login(self.seller)
+        self.client.post(reverse("close_listing", args=[lot.id]))
+        lot.refresh_from_db()
+        self.assertFalse(lot.active)
+        self.assertEqual(lot.winning_bid, winning)
+
+    def test_settle_command(self):
+        self.make_listing(1, timedelta(minutes=-1))
+        out = StringIO()
+        call_command("settle_auctions", stdout=out)
+        self.assertIn("Settled 1 auctions", out.getvalue())
+
+
+class SearchTests(TestCase):
+    """ Full-text search through the FTS5 index """
+
+    def setUp(self):
+        self.user = User.objects.create_user(id=1, username="seller", password="pw")
+        sports = Category.objects.create(name="Sports")
+        self.kitchen = Category.objects.create(name="Kitchen")
+        Listing.objects.create(id=1, name="Red bicycle", user=self.user, category=sports,
+                               description="A fast bicycle with red paint", starting_bid=1)
+        Listing.objects.create(id=2, name="Bicycle pump", user=self.user, category=sports,
+                               description="Fits every tyre", starting_bid=1)
+        Listing.objects.create(id=3, name="Teapot", user=self.user, category=self.kitchen,
+                               description="Red and round", starting_bid=1)
+
+    def ids(self, query, **kwargs):
+        return [row['id'] for row in search_listings(query, **kwargs)[0]]
+
+    def test_ranked_matches(self):
+        self.assertEqual(self.ids("bicycle"), [1, 2])
+        self.assertEqual(self.ids("red bicycle"), [1])
+        self.assertEqual(self.ids("kitchen"), [3])
+
+    def test_prefix_and_punctuation(self):
+        self.assertEqual(self.ids("tea"), [3])
+        self.assertEqual(self.ids('"bicy*cle" OR ('), [])
+        self.assertEqual(self.ids("!!!"), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        Listing.objects.filter(pk=3).update(name="Kettle")
+        self.assertEqual(self.ids("kettle"), [3])
+        self.assertEqual(self.ids("teapot"), [])
+        Listing.objects.filter(pk=2).delete()
+        self.assertEqual(self.ids("bicycle"), [1])
+
+    def test_category_rename_is_indexed(self):
+        self.kitchen.name = "Tableware"
+        self.kitchen.save()
+        self.assertEqual(self.ids("tableware"), [3])
+        self.assertEqual(self.ids("kitchen"), [])
+
+    def test_pagination(self):
+        first, more = search_listings("sports", size=1)
+        self.assertTrue(more)
+        self.assertEqual({first[0]['id']} | set(self.ids("sports", page=2, size=1)), {1, 2})
+        self.assertEqual(search_listings("sports", page=2, size=1)[1], False)
+
+    def test_view_and_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM auctions_listing_fts")
+        self.assertNotContains(self.client.get(reverse("search") + "?q=pump"), "Bicycle pump")
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertContains(self.client.get(reverse("search") + "?q=pump"), "Bicycle pump")
+
+
+class CategoryTests(TestCase):
+    """ Per-category listing counts follow creates, closes and moves """
+
+    def setUp(self):
+        self.user = User.objects.create_user(id=1, username="seller", password="pw")
+        self.books = Category.objects.create(name="Books")
+        self.games = Category.objects.create(name="Games")
+
+    def counts(self, category):
+        category.refresh_from_db()
+        return category.active_count, category.closed_count
+
+    def test_counts_follow_listing_changes(self):
+        for n in range(1, 4):
+            Listing.objects.create(id=n, name=f"Book {n}", user=self.user, category=self.books,
+                                   description="", starting_bid=1)
+        Listing.objects.bulk_create([Listing(id=4, name="Chess", user=self.user, category=self.games,
+                                             description="", starting_bid=1, active=False)])
+        self.assertEqual(self.counts(self.books), (3, 0))
+        self.assertEqual(self.counts(self.games), (0, 1))
+        close_listings([1, 2])
+        self.assertEqual(self.counts(self.books), (1, 2))
+        Listing.objects.filter(pk=3).update(category=self.games)
+        self.assertEqual(self.counts(self.books), (0, 2))
+        self.assertEqual(self.counts(self.games), (1, 1))
+        Listing.objects.filter(pk=4).delete()
+        self.assertEqual(self.counts(self.games), (1, 0))
+
+    def test_bids_do_not_touch_counts(self):
+        Listing.objects.create(id=1, name="Atlas", user=self.user, category=self.books,
+                               description="", starting_bid=1)
+        place_bid(1, self.user, 5)
+        self.assertEqual(self.counts(self.books), (1, 0))
+
+    def test_categories_page_is_one_small_query(self):
+        Listing.objects.create(id=1, name="Atlas", user=self.user, category=self.books,
+                               description="", starting_bid=1)
+        cache.clear()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("categories"))
+        self.assertContains(response, "Books</a> (1 open, 0 closed)")
+        self.assertNotContains(response, "No category")
+
+    def test_new_listing_form_creates_category(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse("add_listing"), {"user": self.user.id, "name": "Novel", "description": "A novel",
+                                                  "starting_bid": 2, "category_name": " Books "})
+        self.client.post(reverse("add_listing"), {"user": self.user.id, "name": "Dice", "description": "Six dice",
+                                                  "starting_bid": 2, "category_name": "Dice games"})
+        self.assertEqual(self.counts(self.books), (1, 0))
+        self.assertEqual(Category.objects.get(name="Dice games").active_count, 1)
+
+
+class BulkTests(TestCase):
+    """ Streaming listing import and data export """
+
+    CSV = (
+        "name,description,starting_bid,category_name,image_url,ends_at\n"
+        "Lamp,A lamp,5,Home,,\n"
+        "Broken,,not a number,Home,,\n"
+        "Sofa,A sofa,40,Home,,2030-01-01 12:00\n"
+        "Kite,A kite,3,Toys,,\n"
+    )
+
+    def setUp(self):
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+
+    def test_import_reports_bad_rows_without_aborting(self):
+        rows = read_rows(StringIO(self.CSV), 'csv')
+        with self.assertNumQueries(6):
+            result = import_listings(rows, self.seller, batch_size=2)
+        self.assertEqual(result.created, 3)
+        self.assertEqual([error['line'] for error in result.errors], [3])
+        self.assertEqual(set(result.errors[0]['errors']), {'description', 'starting_bid'})
+        self.assertEqual(sorted(Listing.objects.values_list('name', flat=True)), ["Kite", "Lamp", "Sofa"])
+        self.assertEqual(Category.objects.get(name="Home").active_count, 2)
+        self.assertEqual(Listing.objects.get(name="Kite").user, self.seller)
+
+    def test_import_jsonl(self):
+        jsonl = ('{"name": "Clock", "description": "A clock", "starting_bid": 7, "category": "Home"}\n'
+                 '\n'
+                 '{"name": "Bad json"\n'
+                 '[1, 2]\n')
+        result = import_listings(read_rows(StringIO(jsonl), 'jsonl'), self.seller)
+        self.assertEqual(result.created, 1)
+        self.assertEqual([error['line'] for error in result.errors], [3, 4])
+        self.assertEqual(Listing.objects.get().category.name, "Home")
+
+    def test_upload_endpoint(self):
+        self.client.force_login(self.seller)
+        upload = SimpleUploadedFile("listings.csv", self.CSV.encode())
+        response = self.client.post(reverse("import_listings"), {'file': upload})
+        self.assertContains(response, "Imported 3 listings, 1 rows rejected.")
+        self.assertEqual(Listing.objects.count(), 3)
+
+    def test_upload_batch_size_is_bounded(self):
+        self.client.force_login(self.seller)
+        with mock.patch('auctions.views.import_listings', wraps=import_listings) as importer:
+            for batch_size in ("-1", "0", "junk", "1000000000"):
+                upload = SimpleUploadedFile("listings.csv", self.CSV.encode())
+                response = self.client.post(reverse("import_listings"), {'file': upload, 'batch_size': batch_size})
+                self.assertContains(response, "rows rejected.")
+        self.assertEqual([call.kwargs['batch_size'] for call in importer.call_args_list], [1] + [BATCH_SIZE] * 3)
+
+    def test_unreadable_rows_are_reported(self):
+        self.client.force_login(self.seller)
+        content = (b"name,description,starting_bid,category_name,image_url,ends_at\n"
+                   b"Lamp,A lamp,5,Home,,\n"
+                   b"Caf\xe9,Latin-1,5,Home,,\n"
+                   b"Rug," + b"x" * (csv.field_size_limit() + 1) + b",5,Home,,\n"
+                   b"Kite,A kite,3,Toys,,\n")
+        response = self.client.post(reverse("import_listings"), {'file': SimpleUploadedFile("listings.csv", content)})
+        self.assertContains(response, "Imported 2 listings, 2 rows rejected.")
+        self.assertContains(response, "Line 3: __all__: Not valid UTF-8 text")
+        self.assertContains(response, "Line 4: __all__: field larger than field limit")
+        self.assertEqual(sorted(Listing.objects.values_list('name', flat=True)), ["Kite", "Lamp"])
+
+    def test_export_streams_every_row(self):
+        listing = Listing.objects.create(id=1, name="Vase", user=self.seller, description="A vase", starting_bid=2)
+        place_bid(listing.id, self.seller, 4)
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse("export", args=["listings", "csv"]))
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,name,description,starting_bid,category_name,image_url,ends_at,"
+                                   "active,current_high_bid,bid_count,user_username")
+        self.assertEqual(lines[1], "1,Vase,A vase,2,,,,True,4,1,seller")
+        response = self.client.get(reverse("export", args=["bids", "jsonl"]))
+        self.assertIn(b'"amount": 4', b"".join(response.streaming_content))
+        self.assertEqual(self.client.get(reverse("export", args=["users", "csv"])).status_code, 404)
+
+    def test_export_import_round_trip(self):
+        Listing.objects.create(id=1, name="Vase", user=self.seller, description="A vase", starting_bid=2,
+                               category=Category.objects.create(name="Home"))
+        out = StringIO()
+        call_command("export_data", "listings", stdout=out)
+        Listing.objects.all().delete()
+        result = import_listings(read_rows(StringIO(out.getvalue()), 'csv'), self.seller)
+        self.assertEqual((result.created, result.error_count), (1, 0))
+        self.assertEqual(Listing.objects.get().category.name, "Home")
+
+
+class BenchmarkHarnessTests(TestCase):
+    """ The load generator seeds data and measures every endpoint in the mix """
+
+    def test_seed_and_run_mix(self):
+        seed(users=5, listings=20, bids=3, comments=2, watches=4, categories=3)
+        self.assertEqual(Listing.objects.count(), 20)
+        self.assertEqual(Bid.objects.count(), 60)
+        self.assertEqual(Listing.watched_by.through.objects.count(), 20)
+        samples, wall_time = run_mix(requests=60, clients=3)
+        results = summarize(samples, wall_time)
+        self.assertEqual(results['requests'], 60)
+        for figures in results['endpoints'].values():
+            self.assertLessEqual(figures['p50_ms'], figures['p99_ms'])
+            self.assertGreater(figures['max_queries'], 0)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'throughput_rps': 100, 'endpoints': {'listing': {'p95_ms': 10, 'max_queries': 5}}}
+        same = {'throughput_rps': 95, 'endpoints': {'listing': {'p95_ms': 11, 'max_queries': 5}}}
+        worse = {'throughput_rps': 50, 'endpoints': {'listing': {'p95_ms': 20, 'max_queries': 6}}}
+        self.assertEqual(compare(same, baseline), [])
+        self.assertEqual(len(compare(worse, baseline)), 3)
+
+
+class InstrumentationTests(TestCase):
+    """ Sampled requests are measured per view and exported in Prometheus text format """
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+        self.listing = Listing.objects.create(id=1, name="Lamp", user=self.seller,
+                                              description="A lamp", starting_bid=1)
+
+    def run_queries(self, count):
+        def view(request):
+            for _ in range(count):
+                list(Listing.objects.filter(pk=self.listing.id))
+            return HttpResponse()
+        return view
+
+    def test_request_is_measured(self):
+        self.client.get(reverse("listing", args=[self.listing.id]))
+        figures = registry.snapshot()['listing']
+        self.assertEqual(figures['requests'], 1)
+        self.assertEqual(figures['queries'], 3)
+        self.assertGreater(figures['template_seconds'], 0)
+        self.assertLessEqual(figures['db_seconds'] + figures['template_seconds'], figures['seconds'])
+
+    def test_django_templates_are_left_alone(self):
+        # Rendering is timed by the views' own render calls, not by patching Django
+        self.assertEqual(Template.render.__module__, 'django.template.backends.django')
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("listing", args=[self.listing.id]))
+        response = self.client.get(reverse("metrics"))
+        self.assertContains(response, 'auctions_request_seconds_count{view="listing"} 1')
+        self.assertContains(response, 'auctions_db_queries_total{view="listing"} 3')
+        remote = self.client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.9")
+        self.assertEqual(remote.status_code, 404)
+
+    def test_duplicate_queries_are_flagged(self):
+        middleware = PerformanceMiddleware(self.run_queries(5))
+        with self.assertLogs('auctions.performance', 'WARNING') as logs:
+            middleware(RequestFactory().get("/"))
+        self.assertIn('"duplicate_queries": 5', logs.output[0])
+        self.assertEqual(registry.snapshot()['unresolved']['duplicate_queries'], 5)
+
+    def test_every_connection_is_measured(self):
+        def view(request):
+            # Stands in for the replica, or another thread's connection
+            other = connection.copy()
+            try:
+                with other.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            finally:
+                other.close()
+            return HttpResponse()
+        PerformanceMiddleware(view)(RequestFactory().get("/"))
+        self.assertEqual(registry.snapshot()['unresolved']['queries'], 1)
+
+    @override_settings(AUCTIONS_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_skipped(self):
+        PerformanceMiddleware(self.run_queries(1))(RequestFactory().get("/"))
+        self.assertEqual(registry.snapshot(), {})
+
+
+class DatabaseSettingsTests(TestCase):
+    """ New SQLite connections are tuned, and read-only views can be routed to a replica """
+
+    def test_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+    def test_journal_mode_is_left_to_the_migration(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = connection.copy()
+        other.settings_dict['NAME'] = os.path.join(directory, 'other.sqlite3')
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], 'delete')
+        migration = importlib.import_module('auctions.migrations.0025_wal_journal_mode')
+        migration.journal_mode('wal')(None, mock.Mock(connection=other))
+        with other.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    def test_read_only_views_use_replica(self):
+        router = ReadReplicaRouter()
+        routes = {}
+
+        @read_only
+        def view(request):
+            routes[request.method] = router.db_for_read(Listing)
+
+        view(RequestFactory().get("/"))
+        view(RequestFactory().post("/"))
+        self.assertEqual(routes, {'GET': 'replica', 'POST': None})
+        self.assertIsNone(router.db_for_read(Listing))
+        self.assertFalse(router.allow_migrate('replica', 'auctions'))
+
+
+class WatchlistTests(TestCase):
+    """ The watchlist shows bidding status in a fixed number of queries; outbid bidders are notified """
+
+    def setUp(self):
+        self.users = [User.objects.create_user(id=n, username=f"user{n}", password="pw")
+                      for n in range(1, 5)]
+        self.listings = [Listing.objects.create(id=n, name=f"Lot {n}", user=self.users[0],
+                                                description="A lot", starting_bid=10,
+                                                ends_at=now() + timedelta(hours=n))
+                         for n in range(1, 4)]
+        for listing in self.listings:
+            listing.watched_by.add(self.users[1])
+
+    def test_status_and_price(self):
+        place_bid(1, self.users[1], 20)
+        place_bid(2, self.users[1], 20)
+        place_bid(2, self.users[2], 30)
+        self.client.force_login(self.users[1])
+        rows = {row['id']: row for row in self.client.get(reverse("watchlist_api")).json()['listings']}
+        self.assertEqual((rows[1]['status'], rows[1]['price'], rows[1]['my_bid']), ('winning', 20, 20))
+        self.assertEqual((rows[2]['status'], rows[2]['price'], rows[2]['my_bid']), ('outbid', 30, 20))
+        self.assertEqual((rows[3]['status'], rows[3]['price'], rows[3]['my_bid']), ('watching', 10, None))
+        self.assertGreater(rows[3]['seconds_left'], rows[1]['seconds_left'])
+
+    def test_query_count_does_not_grow(self):
+        self.client.force_login(self.users[1])
+        cached_user(self.users[1].pk)
+        counts = []
+        for n in range(4, 64):
+            listing = Listing.objects.create(id=n, name=f"Lot {n}", user=self.users[0],
+                                             description="A lot", starting_bid=10)
+            listing.watched_by.add(self.users[1])
+            place_bid(n, self.users[1], 20)
+            place_bid(n, self.users[2], 30)
+            if n in (4, 63):
+                for url in (reverse("watchlist"), reverse("watchlist_api")):
+                    with CaptureQueriesContext(connection) as queries:
+                        self.client.get(url)
+                    counts.append(len(queries))
+        self.assertEqual(counts[:2], counts[2:])
+
+    def test_outbid_fan_out(self):
+        place_bid(1, self.users[1], 20)
+        place_bid(1, self.users[2], 30)
+        place_bid(1, self.users[1], 40)
+        with CaptureQueriesContext(connection) as queries:
+            place_bid(1, self.users[3], 50)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "auctions_notification"')]
+        self.assertEqual(len(inserts), 1)
+        # Only the bidder it displaced; the others were told when they were outbid
+        latest = Notification.objects.filter(amount=50)
+        self.assertEqual(list(latest.values_list('user_id', flat=True)), [2])
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertFalse(Notification.objects.filter(user=self.users[3]).exists())
+
+    def test_displaced_leader_is_found_without_a_read(self):
+        place_bid(1, self.users[1], 20)
+        with CaptureQueriesContext(connection) as queries:
+            place_bid(1, self.users[2], 30)
+        bid_reads = [query for query in queries
+                     if query['sql'].startswith('SELECT') and 'FROM "auctions_bid"' in query['sql']]
+        self.assertEqual(bid_reads, [])
+        self.assertEqual(list(Notification.objects.values_list('user_id', 'amount')), [(2, 30)])
+        place_bid(1, self.users[2], 40)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_notifications_grow_with_bids_not_bidders(self):
+        for n in range(40):
+            place_bid(1, self.users[1 + n % 3], 20 + n)
+        self.assertEqual(Notification.objects.count(), 39)
+
+    def test_page_marks_notifications_read(self):
+        place_bid(1, self.users[1], 20)
+        place_bid(1, self.users[2], 30)
+        self.client.force_login(self.users[1])
+        first = self.client.get(reverse("watchlist_api")).json()['notifications']
+        self.assertEqual(len(first), 1)
+        since = self.client.get(reverse("watchlist_api"), {'since': first[0]['id']}).json()['notifications']
+        self.assertEqual(since, [])
+        self.assertContains(self.client.get(reverse("watchlist")), "<strong>New:</strong>")
+        self.assertNotContains(self.client.get(reverse("watchlist")), "<strong>New:</strong>")
+
+
+def stub_fetch(url):
+    """ Image fetcher for tests: a 640x480 PNG for every URL except .../missing """
+    if url.endswith('/missing'):
+        raise ImageError(f"{url} not found")
+    output = io.BytesIO()
+    Image.new('RGB', (640, 480), (200, 30, len(url))).save(output, 'PNG')
+    return output.getvalue()
+
+
+@skipUnless(Image, "Pillow is not installed")
+class ImageTests(TestCase):
+    """ Listing images become content-addressed thumbnails, made away from the request path """
+
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = override_settings(MEDIA_ROOT=self.media, AUCTIONS_IMAGE_FETCHER='auctions.tests.stub_fetch')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(id=1, username="seller", password="pw")
+        self.listing = Listing.objects.create(id=1, name="Vase", user=self.user, description="A vase",
+                                              starting_bid=1, image_url="https://example.com/vase.jpg")
+
+    def test_thumbnails_are_made_and_served(self):
+        self.assertEqual(process_pending(), 1)
+        self.listing.refresh_from_db()
+        key = self.listing.image_key
+        self.assertEqual(len(key), 32)
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, f'srcset="/media/thumbnails/{key}-100.webp"')
+        thumbnail = self.client.get(f"/media/thumbnails/{key}-100.webp")
+        self.assertEqual(thumbnail['Content-Type'], 'image/webp')
+        self.assertIn('immutable', thumbnail['Cache-Control'])
+        with Image.open(io.BytesIO(b''.join(thumbnail.streaming_content))) as image:
+            self.assertEqual(image.size, (100, 100))
+        self.assertEqual(self.client.get("/media/../db.sqlite3").status_code, 404)
+        self.assertEqual(process_pending(), 0)
+
+    def test_same_image_is_stored_once(self):
+        Listing.objects.create(id=2, name="Vase too", user=self.user, description="A vase",
+                               starting_bid=1, image_url="https://example.com/vase.jpg#copy")
+        Listing.objects.filter(pk=2).update(image_url="https://example.com/vase.jpg")
+        process_pending()
+        keys = set(Listing.objects.values_list('image_key', flat=True))
+        self.assertEqual(len(keys), 1)
+
+    def test_failed_fetch_is_retried_then_given_up(self):
+        Listing.objects.filter(pk=1).update(image_url="https://example.com/missing")
+        for _ in range(MAX_ATTEMPTS):
+            self.assertTrue(pending().exists())
+            process_pending()
+        self.assertFalse(pending().exists())
+        self.assertEqual(Listing.objects.get(pk=1).image_key, '')
+
+    def test_a_failing_listing_does_not_stop_the_batch(self):
+        Listing.objects.filter(pk=1).update(image_url="/media/uploads/../../etc/passwd")
+        with override_settings(AUCTIONS_IMAGE_FETCHER='auctions.images.fetch'):
+            self.assertEqual(process_pending(), 0)
+        self.assertEqual(Listing.objects.get(pk=1).image_failures, 1)
+        Listing.objects.filter(pk=1).update(image_url='')
+
+        def broken(url):
+            if url.endswith('broken'):
+                raise RuntimeError("Unexpected")
+            return stub_fetch(url)
+        Listing.objects.create(id=2, name="Lamp", user=self.user, description="A lamp",
+                               starting_bid=1, image_url="https://example.com/broken")
+        Listing.objects.create(id=3, name="Rug", user=self.user, description="A rug",
+                               starting_bid=1, image_url="https://example.com/rug.jpg")
+        with mock.patch('auctions.images.get_fetcher', return_value=broken), self.assertLogs('auctions.images'):
+            self.assertEqual(process_pending(), 1)
+        self.assertEqual(Listing.objects.get(pk=2).image_failures, 1)
+        self.assertNotEqual(Listing.objects.get(pk=3).image_key, '')
+
+    def test_private_addresses_are_not_fetched(self):
+        for url in ["http://127.0.0.1/a.jpg", "http://localhost:8000/a.jpg", "http://10.1.2.3/a.jpg",
+                    "http://169.254.169.254/latest/meta-data/", "http://[::1]/a.jpg", "file:///etc/passwd"]:
+            with self.assertRaises(ImageError):
+                fetch(url)
+        with self.assertRaises(ImageError):
+            PublicRedirectHandler().redirect_request(None, None, 302, "Found", {}, "http://192.168.0.1/")
+        with mock.patch('socket.getaddrinfo', return_value=[(None, None, None, '', ('93.184.216.34', 80))]):
+            check_public("http://example.com/a.jpg")
+
+    def test_upload(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile("desk.png", stub_fetch("desk"), content_type="image/png")
+        self.client.post(reverse("add_listing"), {'user': 1, 'name': "Desk", 'description': "A desk",
+                                                  'starting_bid': 5, 'image': upload})
+        desk = Listing.objects.get(name="Desk")
+        self.assertRegex(desk.image_url, r'^/media/uploads/[0-9a-f]{64}\.png$')
+        with override_settings(AUCTIONS_IMAGE_FETCHER='auctions.images.fetch'):
+            process_pending()
+        self.assertNotEqual(Listing.objects.get(name="Desk").image_key, '')
+        served = self.client.get(desk.image_url)
+        self.assertEqual(served['Content-Type'], 'image/png')
+        self.assertEqual(served['X-Content-Type-Options'], 'nosniff')
+
+    def test_only_images_are_stored_and_served(self):
+        self.client.force_login(self.user)
+        page = b"<html><script>alert(document.cookie)</script></html>"
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+        for name, data in [("evil.html", page), ("evil.svg", svg), ("evil.png", page)]:
+            upload = SimpleUploadedFile(name, data, content_type="image/png")
+            form = ListingForm({'user': 1, 'name': name, 'description': "Evil", 'starting_bid': 5},
+                               {'image': upload})
+            self.assertEqual(form.errors['image'], ["Upload a JPEG, PNG, WebP or GIF image."])
+            upload.seek(0)
+            self.client.post(reverse("add_listing"), {'user': 1, 'name': name, 'description': "Evil",
+                                                      'starting_bid': 5, 'image': upload})
+        self.assertFalse(Listing.objects.filter(description="Evil").exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media, 'uploads')))
+        # A PNG sent as .html is stored under the extension of what it decodes as
+        upload = SimpleUploadedFile("desk.html", stub_fetch("desk"), content_type="text/html")
+        self.client.post(reverse("add_listing"), {'user': 1, 'name': "Desk", 'description': "A desk",
+                                                  'starting_bid': 5, 'image': upload})
+        self.assertRegex(Listing.objects.get(name="Desk").image_url, r'\.png$')
+        os.makedirs(os.path.join(self.media, 'uploads'), exist_ok=True)
+        with open(os.path.join(self.media, 'uploads', '0' * 64 + '.html'), 'wb') as stored:
+            stored.write(page)
+        self.assertEqual(self.client.get(f"/media/uploads/{'0' * 64}.html").status_code, 404)
+
+    def test_pending_uses_partial_index(self):
+        with connection.cursor() as cursor:
+            sql, params = pending().values('id').query.sql_with_params()
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(step[-1] for step in cursor.fetchall())
+        self.assertIn('listing_image_pending_idx', plan)
+
+
+class APITests(TestCase):
+    """ The JSON API pages with cursors, selects fields and answers conditional GETs with 304 """
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+        self.bidder = User.objects.create_user(id=2, username="bidder", password="pw")
+        self.listing = Listing.objects.create(id=1, name="Globe", user=self.seller,
+                                              description="A globe", starting_bid=5)
+        Listing.objects.create(id=2, name="Atlas", user=self.seller, description="An atlas",
+                               starting_bid=5, active=False)
+        for amount in (10, 20, 30):
+            place_bid(1, self.bidder, amount)
+        self.url = reverse("api_listing", args=[1])
+
+    def test_listing_fields(self):
+        data = self.client.get(self.url, {'fields': 'name,price,high_bidder'}).json()
+        self.assertEqual(data, {'name': "Globe", 'price': 30, 'high_bidder': "bidder"})
+        self.assertEqual(self.client.get(self.url, {'fields': 'secret'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("api_listing", args=[99])).status_code, 404)
+
+    def test_etag_revalidation(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(1):
+            unchanged = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+        place_bid(1, self.bidder, 40)
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['price'], 40)
+
+    def test_last_modified(self):
+        response = self.client.get(reverse("api_bids", args=[1]))
+        self.assertIn('Last-Modified', response)
+        unchanged = self.client.get(reverse("api_bids", args=[1]),
+                                    HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(unchanged.status_code, 304)
+
+    def test_last_modified_sees_closes_and_edits(self):
+        # Back-date everything, as Last-Modified only has whole seconds
+        earlier = now() - timedelta(minutes=5)
+        Bid.objects.update(timestamp=earlier)
+        Listing.objects.update(modified_at=earlier)
+        since = self.client.get(self.url)['Last-Modified']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=since).status_code, 304)
+        close_listings([1])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+        Listing.objects.update(modified_at=earlier)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=since).status_code, 304)
+        self.listing.refresh_from_db()
+        self.listing.description = "A globe, on a stand"
+        self.listing.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+
+    def test_bid_pages(self):
+        url = reverse("api_bids", args=[1])
+        first = self.client.get(url, {'limit': 2, 'fields': 'amount'}).json()
+        self.assertEqual(first['results'], [{'amount': 10}, {'amount': 20}])
+        second = self.client.get(first['next']).json()
+        self.assertEqual(second, {'results': [{'amount': 30}], 'next': None})
+        self.assertEqual(self.client.get(url, {'limit': 1000}).status_code, 400)
+
+    def test_listing_collection(self):
+        url = reverse("api_listings")
+        data = self.client.get(url, {'active': 1, 'fields': 'id,name'}).json()
+        self.assertEqual(data['results'], [{'id': 1, 'name': "Globe"}])
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        place_bid(1, self.bidder, 50)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.post(url).status_code, 405)
+
+
+class ArchiveTests(TestCase):
+    """ Long-closed listings move to the archive tables and are still served at listing/<id> """
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+        self.bidders = [User.objects.create_user(id=n, username=f"bidder{n}", password="pw") for n in (2, 3)]
+        self.category = Category.objects.create(name="Clocks")
+        for n in (1, 2, 3):
+            Listing.objects.create(id=n, name=f"Clock {n}", user=self.seller, category=self.category,
+                                   description="A clock", starting_bid=1)
+        for amount, bidder in ((5, 0), (6, 1), (7, 0)):
+            place_bid(1, self.bidders[bidder], amount)
+        Comment.objects.create(listing_id=1, user=self.bidders[1], content="Does it chime?")
+        Listing.objects.get(pk=1).watched_by.add(self.bidders[1])
+        close_listings([1, 2])
+        Listing.objects.filter(pk=1).update(closed_at=now() - timedelta(days=100))
+
+    def test_old_closed_listing_is_moved(self):
+        self.assertEqual(archive_closed(timedelta(days=90)), 1)
+        self.assertEqual(sorted(Listing.objects.values_list('id', flat=True)), [2, 3])
+        self.assertFalse(Bid.objects.filter(listing_id=1).exists())
+        self.assertFalse(Comment.objects.filter(listing_id=1).exists())
+        self.assertFalse(Notification.objects.filter(listing_id=1).exists())
+        archived = ArchivedListing.objects.get(pk=1)
+        self.assertEqual((archived.final_price, archived.winner, archived.bid_count), (7, "bidder2", 3))
+        self.assertEqual(archived.comments[0]['content'], "Does it chime?")
+        summaries = {summary.user: (summary.bid_count, summary.highest_bid) for summary in archived.bid_summaries.all()}
+        self.assertEqual(summaries, {'bidder2': (2, 7), 'bidder3': (1, 6)})
+        self.category.refresh_from_db()
+        self.assertEqual((self.category.active_count, self.category.closed_count), (1, 1))
+        self.assertEqual(search_listings("Clock")[0], [{'id': 2, 'name': "Clock 2", 'active': False},
+                                                       {'id': 3, 'name': "Clock 3", 'active': True}])
+
+    def test_archived_ids_are_not_reused(self):
+        Listing.objects.filter(pk=3).delete()
+        Listing.objects.filter(pk=2).update(closed_at=now() - timedelta(days=100))
+        self.assertEqual(archive_closed(timedelta(days=90)), 2)
+        # Listing 3 was the highest id ever; a plain INTEGER PRIMARY KEY would hand out 1 here
+        listing = Listing.objects.create(name="Clock 4", user=self.seller, description="A clock", starting_bid=1)
+        self.assertEqual(listing.id, 4)
+        self.assertContains(self.client.get(reverse("listing", args=[2])), "Clock 2")
+
+    def test_archived_listing_page(self):
+        archive_closed(timedelta(days=90))
+        response = self.client.get(reverse("listing", args=[1]))
+        self.assertContains(response, "Won by bidder2 for $7")
+        self.assertContains(response, "bidder3: 1 bid, up to 6")
+        self.assertContains(response, "Does it chime?")
+        self.assertEqual(self.client.get(reverse("listing", args=[99])).status_code, 404)
+
+    def test_archived_watches_are_logged_as_unwatches(self):
+        archive_closed(timedelta(days=90))
+        self.assertEqual(list(Event.objects.filter(kind=Event.UNWATCH).values_list('listing_id', 'user_id')),
+                         [(1, 3)])
+        project()
+        self.assertEqual(UserSummary.objects.get(pk=3).watching, 0)
+
+    def test_copy_is_repeatable(self):
+        copy_to_archive([1])
+        copy_to_archive([1])
+        self.assertEqual(ArchivedListing.objects.count(), 1)
+        self.assertEqual(ArchivedBidSummary.objects.count(), 2)
+
+
+class ProxyBidTests(TestCase):
+    """ Proxies bid for their owners up to a maximum; a bidding war is settled in a fixed number of writes """
+
+    def setUp(self):
+        # No passwords: hashing sixty of them would dominate the run
+        self.users = User.objects.bulk_create([User(id=n, username=f"user{n}") for n in range(1, 61)])
+        self.listing = Listing.objects.create(id=1, name="Vase", user=self.users[0],
+                                              description="A vase", starting_bid=10)
+
+    def state(self):
+        listing = Listing.objects.get(pk=1)
+        top = Bid.objects.filter(listing_id=1).order_by('-amount', 'id').first()
+        return listing.current_high_bid, listing.high_bidder_id, listing.bid_count, top.user_id
+
+    def test_proxy_opens_above_starting_bid(self):
+        set_proxy(1, self.users[1], 50)
+        self.assertEqual(self.state(), (11, 2, 1, 2))
+
+    def test_higher_proxy_wins_one_increment_above_runner_up(self):
+        set_proxy(1, self.users[1], 50)
+        set_proxy(1, self.users[2], 80)
+        self.assertEqual(self.state(), (51, 3, 3, 3))
+        self.assertEqual(Bid.objects.get(user=self.users[1], amount=50).listing_id, 1)
+
+    def test_earlier_proxy_wins_a_tie(self):
+        set_proxy(1, self.users[1], 50)
+        set_proxy(1, self.users[2], 50)
+        self.assertEqual(self.state(), (50, 2, 3, 2))
+
+    def test_manual_bid_is_answered_by_proxy(self):
+        set_proxy(1, self.users[1], 50)
+        bid = place_bid(1, self.users[2], 30)
+        self.assertEqual((bid.user_id, bid.amount), (3, 30))
+        self.assertEqual(self.state(), (31, 2, 3, 2))
+        self.assertTrue(Notification.objects.filter(user=self.users[2], amount=31).exists())
+
+    def test_manual_bid_above_every_maximum_wins(self):
+        set_proxy(1, self.users[1], 50)
+        place_bid(1, self.users[2], 60)
+        self.assertEqual(self.state(), (60, 3, 3, 3))
+
+    def test_leader_raising_maximum_keeps_price(self):
+        set_proxy(1, self.users[1], 50)
+        set_proxy(1, self.users[1], 90)
+        self.assertEqual(self.state(), (11, 2, 1, 2))
+        self.assertEqual(ProxyBid.objects.get(user=self.users[1]).maximum, 90)
+
+    def test_maximum_below_price_is_rejected(self):
+        place_bid(1, self.users[1], 40)
+        with self.assertRaises(BidRejected):
+            set_proxy(1, self.users[2], 30)
+        self.assertFalse(ProxyBid.objects.exists())
+
+    def test_writes_do_not_grow_with_competing_proxies(self):
+        writes = []
+        for competitors in (2, 50):
+            Listing.objects.filter(pk=1).update(current_high_bid=None, high_bidder=None, bid_count=0)
+            Bid.objects.all().delete()
+            ProxyBid.objects.all().delete()
+            for n in range(1, competitors + 1):
+                ProxyBid.objects.create(listing_id=1, user=self.users[n], maximum=100 + n)
+            with CaptureQueriesContext(connection) as queries:
+                place_bid(1, self.users[55], 20)
+            writes.append(len([query for query in queries if query['sql'].startswith(('INSERT', 'UPDATE'))]))
+            self.assertEqual(self.state()[:2], (100 + competitors, competitors + 1))
+        self.assertEqual(writes[0], writes[1])
+
+    def test_bid_form_sets_proxy(self):
+        self.client.force_login(self.users[1])
+        self.client.post(reverse("add_bid", args=[1]), {"bid_amount": 70, "auto": "on"})
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.current_high_bid, ProxyBid.objects.get().maximum), (11, 70))
+        self.listing.watched_by.add(self.users[1])
+        rows = self.client.get(reverse("watchlist_api")).json()['listings']
+        self.assertEqual((rows[0]['status'], rows[0]['my_maximum']), ('winning', 70))
+
+
+class SessionTests(TestCase):
+    """ Signed-in requests read neither the session nor the user table; ownership is checked by id """
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(id=1, username="seller", password="pw")
+        self.bidder = User.objects.create_user(id=2, username="bidder", password="pw")
+        self.listing = Listing.objects.create(id=1, name="Radio", user=self.seller,
+                                              description="A radio", starting_bid=1)
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        return [query['sql'] for query in queries if 'django_session' in query['sql'] or
+                'FROM "auctions_user" WHERE "auctions_user"."id"' in query['sql']]
+
+    def test_session_and_user_are_cached(self):
+        self.client.force_login(self.bidder)
+        self.client.get(reverse("watchlist"))
+        self.assertEqual(self.auth_queries(reverse("watchlist")), [])
+
+    def test_saving_user_evicts_it(self):
+        self.client.force_login(self.bidder)
+        self.client.get(reverse("watchlist"))
+        self.bidder.set_password("changed")
+        self.bidder.save()
+        # The session hash no longer matches, so the session is signed out
+        self.assertEqual(self.client.get(reverse("watchlist")).status_code, 302)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        self.client.force_login(self.bidder)
+        self.assertEqual(self.client.get(reverse("watchlist")).status_code, 200)
+        self.assertEqual(self.auth_queries(reverse("watchlist")), [])
+
+    def test_only_seller_can_close(self):
+        self.client.force_login(self.bidder)
+        self.assertFalse(self.client.get(reverse("listing", args=[1])).context['mylisting'])
+        self.client.post(reverse("close_listing", args=[1]))
+        self.assertTrue(Listing.objects.get(pk=1).active)
+        self.client.force_login(self.seller)
+        self.assertTrue(self.client.get(reverse("listing", args=[1])).context['mylisting'])
+        self.client.post(reverse("close_listing", args=[1]))
+        self.assertFalse(Listing.objects.get(pk=1).active)
+
+    def test_round_trip_benchmark(self):
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db',
+                               AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend']):
+            stock = auth_round_trips(requests=2, pages=['watchlist'])
+        tuned = auth_round_trips(requests=2, pages=['watchlist'])
+        self.assertEqual(stock['watchlist']['auth_queries'], 2)
+        self.assertEqual(tuned['watchlist']['auth_queries'], 0)
+        self.assertEqual(stock['watchlist']['other_queries'], tuned['watchlist']['other_queries'])
+
+
+class EventLogTests(TestCase):
+    """ Activity is logged as events and projected into summaries, incrementally or by a full replay """
+
+    def setUp(self):
+        self.users = [User.objects.create_user(id=n, username=f"user{n}", password="pw") for n in (1, 2, 3)]
+        for n in (1, 2):
+            Listing.objects.create(id=n, name=f"Clock {n}", user=self.users[0], description="A clock",
+                                   starting_bid=5)
+        place_bid(1, self.users[1], 10)
+        place_bid(1, self.users[2], 12)
+        place_bid(2, self.users[1], 6)
+        Comment.objects.create(listing_id=1, user=self.users[2], content="Wind-up?")
+        Listing.objects.get(pk=1).watched_by.add(self.users[1], self.users[2])
+        self.users[1].watchlist.add(Listing.objects.get(pk=2))
+        Listing.objects.get(pk=1).watched_by.remove(self.users[2])
+        close_listings([1])
+
+    def summaries(self):
+        return (list(ListingSummary.objects.order_by('listing_id').values()),
+                list(UserSummary.objects.order_by('user_id').values()))
+
+    def test_events_are_logged(self):
+        self.assertEqual(list(Event.objects.order_by('id').values_list('kind', 'listing_id', 'user_id', 'amount')), [
+            ('bid', 1, 2, 10), ('bid', 1, 3, 12), ('bid', 2, 2, 6), ('comment', 1, 3, None),
+            ('watch', 1, 2, None), ('watch', 1, 3, None), ('watch', 2, 2, None), ('unwatch', 1, 3, None),
+            ('close', 1, 3, 12)])
+        close_listings([1])
+        self.assertEqual(Event.objects.filter(kind=Event.CLOSE).count(), 1)
+
+    def test_projected_summaries(self):
+        self.assertEqual(project(), 9)
+        self.assertEqual(project(), 0)
+        clock = ListingSummary.objects.get(pk=1)
+        self.assertEqual((clock.bid_count, clock.high_bid, clock.high_bidder_id, clock.comment_count,
+                          clock.watchers, clock.winner_id), (2, 12, 3, 1, 1, 3))
+        self.assertIsNotNone(clock.closed_at)
+        bidder = UserSummary.objects.get(pk=2)
+        self.assertEqual((bidder.bid_count, bidder.highest_bid, bidder.watching, bidder.wins), (2, 10, 2, 0))
+        self.assertEqual(UserSummary.objects.get(pk=3).wins, 1)
+
+    def test_incremental_projection_matches_replay(self):
+        project(batch_size=4)
+        place_bid(2, self.users[2], 8)
+        while project(batch_size=2):
+            pass
+        incremental = self.summaries()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(replay(batch_size=3), 10)
+        self.assertEqual(self.summaries(), incremental)
+        # One keyset read per batch, never the whole log at once
+        reads = [query for query in queries if 'FROM "auctions_event"' in query['sql']]
+        self.assertEqual(len(reads), 5)
+
+    def test_log_is_read_only_in_admin(self):
+        admin = User.objects.create_superuser(id=9, username="admin", password="pw")
+        self.client.force_login(admin)
+        event = Event.objects.first()
+        url = reverse("admin:auctions_event_change", args=[event.id])
+        self.assertContains(self.client.get(reverse("admin:auctions_event_changelist")), "Bid placed")
+        self.client.post(url, {'kind': 'close', 'listing_id': 2, 'amount': 1})
+        self.assertEqual(self.client.post(reverse("admin:auctions_event_delete", args=[event.id]),
+                                          {'post': 'yes'}).status_code, 403)
+        self.assertEqual(self.client.get(reverse("admin:auctions_event_add")).status_code, 403)
+        unchanged = Event.objects.get(pk=event.id)
+        self.assertEqual((unchanged.kind, unchanged.listing_id, unchanged.amount), (event.kind, 1, 10))
+
+    def test_replay_command(self):
+        out = StringIO()
+        call_command("replay_events", stdout=out)
+        self.assertIn("Replayed 9 events", out.getvalue())
+        self.assertEqual(ListingSummary.objects.count(), 2)
+
+
+class RateLimitTests(TestCase):
+    """ POSTs to the write views are throttled per user and per address; watch repeats are coalesced """
+
+    def setUp(self):
+        cache.clear()
+        buckets().reset()
+        self.users = [User.objects.create_user(id=n, username=f"user{n}", password="pw") for n in (1, 2)]
+        Listing.objects.create(id=1, name="Drum", user=self.users[0], description="A drum", starting_bid=1)
+
+    def test_bucket_refills(self):
+        store = MemoryBuckets()
+        self.assertEqual([store.take('key', 1, 2, 100.0) for _ in range(3)], [0, 0, 1.0])
+        self.assertEqual(store.take('key', 1, 2, 101.5), 0)
+        self.assertEqual(store.take('key', 1, 2, 101.5), 0.5)
+
+    @override_settings(AUCTIONS_RATE_LIMITS={'add_comment': (60, 2)})
+    def test_user_bucket(self):
+        self.client.force_login(self.users[1])
+        url = reverse("add_comment", args=[1])
+        statuses = [self.client.post(url, {"comment_content": "Loud?"}).status_code for _ in range(3)]
+        self.assertEqual(statuses, [302, 302, 429])
+        self.assertEqual(Comment.objects.count(), 2)
+        # Other users have buckets of their own
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.post(url, {"comment_content": "Very"}).status_code, 302)
+
+    @override_settings(AUCTIONS_RATE_LIMITS={'add_bid': (60, 1)})
+    def test_address_bucket(self):
+        url = reverse("add_bid", args=[1])
+        statuses = [self.client.post(url, {"bid_amount": 5}, REMOTE_ADDR="203.0.113.7").status_code
+                    for _ in range(IP_FACTOR + 1)]
+        self.assertEqual(statuses[-1], 429)
+        self.assertEqual(self.client.post(url, {"bid_amount": 5}, REMOTE_ADDR="203.0.113.8").status_code, 302)
+
+    @override_settings(AUCTIONS_RATE_LIMITS={'add_bid': (60, 3)})
+    def test_listing_page_bids_share_the_bid_bucket(self):
+        self.client.force_login(self.users[1])
+        listing_url, add_bid_url = reverse("listing", args=[1]), reverse("add_bid", args=[1])
+        statuses = [self.client.post(listing_url, {"bid_amount": amount}).status_code for amount in (5, 6)]
+        statuses += [self.client.post(add_bid_url, {"bid_amount": 7}).status_code,
+                     self.client.post(listing_url, {"bid_amount": 8}).status_code]
+        self.assertEqual(statuses, [200, 200, 302, 429])
+        self.assertEqual(Bid.objects.count(), 3)
+
+    def test_retry_after(self):
+        with override_settings(AUCTIONS_RATE_LIMITS={'add_bid': (6, 1)}):
+            self.assertEqual(throttle('add_bid', 2, '203.0.113.7', now=0.0), 0)
+            self.assertEqual(throttle('add_bid', 2, '203.0.113.7', now=0.0), 10.0)
+            self.assertEqual(throttle('index', 2, '203.0.113.7', now=0.0), 0)
+            self.assertEqual(throttle('listing', 2, '203.0.113.7', now=0.0), 10.0)
+
+    def test_shared_file_buckets(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/limits.sqlite3"
+            # Two stores on one file stand in for two worker processes
+            first, second = SQLiteBuckets(path), SQLiteBuckets(path)
+            self.assertEqual(first.take('key', 1, 2, 100.0), 0)
+            self.assertEqual(second.take('key', 1, 2, 100.0), 0)
+            self.assertEqual(first.take('key', 1, 2, 100.0), 1.0)
+
+    def test_watch_repeats_are_coalesced(self):
+        self.client.force_login(self.users[1])
+        url = reverse("add_watchlist", args=[1])
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(5):
+                self.client.post(url, {"watch": "add"})
+        writes = [query for query in queries
+                  if query['sql'].startswith('INSERT') and '"auctions_listing_watched_by"' in query['sql']]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(Listing.objects.filter(watched_by=self.users[1]).exists())
+        # A change of mind is written at once; bare toggles right after it are coalesced into it
+        self.client.post(url, {"watch": "remove"})
+        self.client.post(url)
+        self.client.post(url)
+        self.assertFalse(Listing.objects.filter(watched_by=self.users[1]).exists())
+        self.assertEqual(Event.objects.filter(kind__in=[Event.WATCH, Event.UNWATCH]).count(), 2)
+
+
+class TemplateRenderTests(TestCase):
+    """ The listing page's bid and comment lists come from cached inclusion fragments """
+
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(id=n, username=f"user{n}", password="pw") for n in (1, 2, 3)]
+        Listing.objects.create(id=1, name="Harp", user=self.users[0], description="A harp", starting_bid=1)
+
+    def test_lists_newest_first(self):
+        place_bid(1, self.users[1], 5)
+        place_bid(1, self.users[2], 9)
+        Comment.objects.create(listing_id=1, user=self.users[1], content="Tuned?")
+        Comment.objects.create(listing_id=1, user=self.users[2], content="Yes")
+        content = self.client.get(reverse("listing", args=[1])).content.decode()
+        self.assertLess(content.index("9 by user3"), content.index("5 by user2"))
+        self.assertLess(content.index('user3 said: "Yes"'), content.index('user2 said: "Tuned?"'))
+
+    def test_cached_fragments_skip_the_lists(self):
+        for amount in range(2, 12):
+            place_bid(1, self.users[1 + amount % 2], amount)
+        self.client.force_login(self.users[1])
+        self.client.get(reverse("listing", args=[1]))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(reverse("listing", args=[1])), "11 by user3")
+        self.assertFalse([query for query in queries if 'FROM "auctions_bid"' in query['sql']])
+
+    def test_render_benchmark(self):
+        figures = render_times(bid_counts=(3, 30), repeat=1)
+        self.assertEqual(set(figures), {(page, count, mode) for page in ('index', 'listing')
+                                        for count in (3, 30) for mode in ('cold', 'warm')})
+        self.assertEqual(Listing.objects.get(name="Render 30").bid_count, 30)
+
+
+class FeedTests(TestCase):
+    """ The hot and ending-soon feeds read the score table and indexes, never the bids or watches """
+
+    def setUp(self):
+        cache.clear()
+        self.users = User.objects.bulk_create([User(id=n, username=f"user{n}") for n in range(1, 7)])
+        for n in (1, 2, 3):
+            Listing.objects.create(id=n, name=f"Lot {n}", user=self.users[0], description="A lot",
+                                   starting_bid=1, ends_at=now() + timedelta(hours=4 - n))
+
+    def test_bids_and_watches_update_scores(self):
+        place_bid(1, self.users[1], 5)
+        place_bid(1, self.users[2], 6)
+        self.users[1].watchlist.add(1, 2)
+        score = ListingScore.objects.get(pk=1)
+        self.assertAlmostEqual(velocity(score.hot), 2, places=3)
+        self.assertEqual(score.watchers, 1)
+        self.assertEqual(ListingScore.objects.get(pk=2).watchers, 1)
+        # Unwatching takes away the watcher, not bid velocity
+        self.users[1].watchlist.remove(1)
+        score = ListingScore.objects.get(pk=1)
+        self.assertAlmostEqual(velocity(score.hot), 2, places=3)
+        self.assertEqual(score.watchers, 0)
+
+    def test_closed_listings_stay_unscored(self):
+        self.users[1].watchlist.add(1)
+        close_listings([1, 2])
+        self.users[2].watchlist.add(1, 2)
+        self.users[1].watchlist.remove(1)
+        self.assertFalse(ListingScore.objects.filter(listing_id__in=[1, 2]).exists())
+        self.assertNotIn(1, [row['id'] for row in hot_listings()])
+
+    def test_velocity_decays(self):
+        start = now()
+        bump(1, 4, at=start)
+        bump(2, 1, at=start + 2 * HALF_LIFE)
+        # Two half-lives on, the older four weigh as much as the fresh one
+        later = start + 2 * HALF_LIFE
+        self.assertAlmostEqual(velocity(ListingScore.objects.get(pk=1).hot, later), 1, places=6)
+        bump(1, 1, at=later)
+        self.assertAlmostEqual(velocity(ListingScore.objects.get(pk=1).hot, later), 2, places=6)
+        self.assertGreater(ListingScore.objects.get(pk=1).hot, ListingScore.objects.get(pk=2).hot)
+
+    def test_hot_feed_ranks_without_aggregating(self):
+        place_bid(2, self.users[1], 5)
+        place_bid(2, self.users[2], 6)
+        place_bid(3, self.users[1], 5)
+        self.users[2].watchlist.add(1)
+        with CaptureQueriesContext(connection) as queries:
+            content = self.client.get(reverse("hot")).content.decode()
+        self.assertLess(content.index("Lot 2"), content.index("Lot 3"))
+        self.assertLess(content.index("Lot 3"), content.index("Lot 1"))
+        self.assertEqual(len(queries), 2)
+        for query in queries:
+            self.assertNotIn('"auctions_bid"', query['sql'])
+            self.assertNotIn('watched_by', query['sql'])
+
+    def test_watchers_keep_a_listing_hot(self):
+        start = now() - 4 * HALF_LIFE
+        bump(1, 3, at=start)
+        for user in self.users[1:]:
+            user.watchlist.add(1)
+        bump(2, 1)
+        # 3 bids a day ago are worth 3/16 now, but with five watchers it still beats a fresh bid
+        self.assertEqual([row['id'] for row in hot_listings()], [1, 2])
+        self.assertAlmostEqual(heat(ListingScore.objects.get(pk=1).hot, 5), 3 / 16 + 5 * WATCHER_WEIGHT, places=3)
+
+    def test_top_k_matches_full_ranking(self):
+        at = now()
+        Listing.objects.bulk_create([Listing(id=n, name=f"Lot {n}", user=self.users[0], description="A lot",
+                                             starting_bid=1) for n in range(4, 60)])
+        for n in range(1, 60):
+            bump(n, n / 10, at=at)
+            # Velocity and watchers pull in opposite directions, so the feed has to read deeper
+            ListingScore.objects.filter(pk=n).update(watchers=(60 - n) // 2)
+        full = sorted(ListingScore.objects.all(), key=lambda score: (-heat(score.hot, score.watchers, at), score.pk))
+        self.assertEqual([row['id'] for row in hot_listings(5, at)], [score.pk for score in full[:5]])
+
+    def test_ending_soon(self):
+        Listing.objects.create(id=4, name="Lot 4", user=self.users[0], description="A lot", starting_bid=1)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("ending"))
+        names = [row['name'] for row in response.context['listings']]
+        self.assertEqual(names, ["Lot 3", "Lot 2", "Lot 1"])
+
+    def test_closing_drops_score(self):
+        place_bid(1, self.users[1], 5)
+        close_listings([1])
+        self.assertFalse(ListingScore.objects.filter(pk=1).exists())
+        self.assertEqual(self.client.get(reverse("hot")).context['listings'], [])
+
+    def test_rebuild_matches_increments(self):
+        place_bid(1, self.users[1], 5)
+        place_bid(1, self.users[2], 6)
+        self.users[1].watchlist.add(1, 3)
+        incremental = {score.pk: (score.hot, score.watchers) for score in ListingScore.objects.all()}
+        self.assertEqual(rebuild(), 2)
+        for score in ListingScore.objects.all():
+            self.assertAlmostEqual(velocity(score.hot), velocity(incremental[score.pk][0]), places=3)
+            self.assertEqual(score.watchers, incremental[score.pk][1])
@@ -0,0 +1,102 @@
+""" SQLite triggers that keep the search index and the per-category counts in step with listings
+
+Triggers rather than model signals, so bulk_create and queryset updates are covered too.
+SQLite drops a table's triggers whenever a migration rebuilds it, so they are (re)installed
+after every migrate by the post_migrate hook in signals.py. All of them live on
+auctions_listing: a trigger on another table that mentions auctions_listing would make
+SQLite refuse the rename step of Django's table rebuilds.
+"""
+
+from django.db import connection
+
+SEARCH_TRIGGERS = {
+    'auctions_listing_fts_insert': """
+        CREATE TRIGGER auctions_listing_fts_insert AFTER INSERT ON auctions_listing BEGIN
+            INSERT INTO auctions_listing_fts(rowid, name, description, category)
+            VALUES (new.id, new.name, new.description,
+                    (SELECT name FROM auctions_category WHERE id = new.category_id));
+        END""",
+    'auctions_listing_fts_delete': """
+        CREATE TRIGGER auctions_listing_fts_delete AFTER DELETE ON auctions_listing BEGIN
+            DELETE FROM auctions_listing_fts WHERE rowid = old.id;
+        END""",
+    'auctions_listing_fts_update': """
+        CREATE TRIGGER auctions_listing_fts_update
+        AFTER UPDATE OF name, description, category_id ON auctions_listing BEGIN
+            DELETE FROM auctions_listing_fts WHERE rowid = old.id;
+            INSERT INTO auctions_listing_fts(rowid, name, description, category)
+            VALUES (new.id, new.name, new.description,
+                    (SELECT name FROM auctions_category WHERE id = new.category_id));
+        END""",
+}
+
+COUNT_TRIGGERS = {
+    'auctions_category_count_insert': """
+        CREATE TRIGGER auctions_category_count_insert AFTER INSERT ON auctions_listing
+        WHEN new.category_id IS NOT NULL BEGIN
+            UPDATE auctions_category SET active_count = active_count + new.active,
+                                         closed_count = closed_count + 1 - new.active
+            WHERE id = new.category_id;
+        END""",
+    'auctions_category_count_delete': """
+        CREATE TRIGGER auctions_category_count_delete AFTER DELETE ON auctions_listing
+        WHEN old.category_id IS NOT NULL BEGIN
+            UPDATE auctions_category SET active_count = active_count - old.active,
+                                         closed_count = closed_count - 1 + old.active
+            WHERE id = old.category_id;
+        END""",
+    'auctions_category_count_update': """
+        CREATE TRIGGER auctions_category_count_update AFTER UPDATE OF active, category_id ON auctions_listing
+        WHEN old.active IS NOT new.active OR old.category_id IS NOT new.category_id BEGIN
+            UPDATE auctions_category SET active_count = active_count - old.active,
+                                         closed_count = closed_count - 1 + old.active
+            WHERE id = old.category_id;
+            UPDATE auctions_category SET active_count = active_count + new.active,
+                                         closed_count = closed_count + 1 - new.active
+            WHERE id = new.category_id;
+        END""",
+}
+
+
+def rebuild_search_index():
+    """ Refill the search table from the listings, returning the number indexed """
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM auctions_listing_fts")
+        cursor.execute("INSERT INTO auctions_listing_fts(rowid, name, description, category) "
+                       "SELECT listing.id, listing.name, listing.description, category.name "
+                       "FROM auctions_listing AS listing "
+                       "LEFT JOIN auctions_category AS category ON category.id = listing.category_id")
+        return cursor.rowcount
+
+def rename_category_in_search_index(category):
+    """ Carry a category rename over to the search rows of its listings """
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE auctions_listing_fts SET category = %s "
+                       "WHERE rowid IN (SELECT id FROM auctions_listing WHERE category_id = %s)",
+                       [category.name, category.pk])
+
+def rebuild_category_counts():
+    """ Recount every category's open and closed listings """
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE auctions_category SET "
+                       "active_count = (SELECT COUNT(*) FROM auctions_listing "
+                       "                WHERE category_id = auctions_category.id AND active), "
+                       "closed_count = (SELECT COUNT(*) FROM auctions_listing "
+                       "                WHERE category_id = auctions_category.id AND NOT active)")
+
+def install_triggers():
+    """ Create any missing trigger, rebuilding whatever it maintains since it may have drifted """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {row[0] for row in cursor.fetchall()}
+        if 'auctions_listing_fts' not in existing or 'auctions_category' not in existing:
+            return
+        for triggers, rebuild in ((SEARCH_TRIGGERS, rebuild_search_index),
+                                  (COUNT_TRIGGERS, rebuild_category_counts)):
+            missing = [sql for name, sql in triggers.items() if name not in existing]
+            for sql in missing:
+                cursor.execute(sql)
+            if missing:
+                rebuild()
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
 
 urlpatterns = [
     path("", views.index, name="index"),
@@ -8,11 +8,28 @@ urlpatterns = [
     path("logout", views.logout_view, name="logout"),
     path("register", views.register, name="register"),
     path("add_listing", views.add_listing, name="add_listing"),
+    path("import_listings", views.import_listings_view, name="import_listings"),
+    path("export/<str:kind>.<str:format>", views.export_view, name="export"),
     path("close_listing/<int:listing_id>", views.close_listing, name="close_listing"),
     path("add_comment/<int:listing_id>", views.add_comment, name="add_comment"),
     path("add_bid/<int:listing_id>", views.add_bid, name="add_bid"),
     path("add_watchlist/<int:listing_id>", views.add_watchlist, name="add_watchlist"),
     path("watchlist", views.watchlist, name="watchlist"),
+    path("watchlist.json", views.watchlist_api, name="watchlist_api"),
     path("categories", views.categories, name="categories"),
-    path("listing/<int:listing_id>", views.listing, name="listing")
+    path("category/none", views.category, name="uncategorized"),
+    path("category/<int:category_id>", views.category, name="category"),
+    path("hot", views.hot, name="hot"),
+    path("ending", views.ending, name="ending"),
+    path("search", views.search, name="search"),
+    path("metrics", views.metrics, name="metrics"),
+    path("listing/<int:listing_id>", views.listing, name="listing"),
+    path("api/listings", api.listings, name="api_listings"),
+    path("api/listings/<int:listing_id>", api.listing, name="api_listing"),
+    path("api/listings/<int:listing_id>/bids", api.bids, name="api_bids"),
+    path("api/listings/<int:listing_id>/comments", api.comments, name="api_comments"),
+    path("async/", async_views.index, name="async_index"),
+    path("async/categories", async_views.categories, name="async_categories"),
+    path("async/watchlist", async_views.watchlist, name="async_watchlist"),
+    path("async/listing/<int:listing_id>", async_views.listing, name="async_listing")
 ]
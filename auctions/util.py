@@ -1,10 +1,107 @@
-from .models import (Listing, Bid)
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import (Listing, Bid, ProxyBid)
+
+# Number of listings shown per page on the index and category pages
+PAGE_SIZE = 50
+
+# Most recent outbid notifications shown on the watchlist
+NOTIFICATIONS_SHOWN = 50
+
+# Seconds during which repeats of a watch or unwatch are answered from the cache
+WATCH_WINDOW = 30
 
 def get_min_bid(listing_id):
-    current_listing = Listing.objects.get(pk=listing_id)
+    current_listing = Listing.objects.only('starting_bid', 'current_high_bid').get(pk=listing_id)
+    if current_listing.current_high_bid is None:
+        return current_listing.starting_bid
+    return current_listing.current_high_bid
+
+def rebuild_bid_totals(listings=None):
+    """ Recompute current_high_bid, high_bidder and bid_count from the bids table """
+    if listings is None:
+        listings = Listing.objects.all()
+    top_bid = Bid.objects.filter(listing=OuterRef('pk')).order_by('-amount', 'id')
+    bid_count = (Bid.objects.filter(listing=OuterRef('pk'))
+                 .order_by().values('listing').annotate(count=Count('id')).values('count'))
+    return listings.update(
+        current_high_bid=Subquery(top_bid.values('amount')[:1]),
+        high_bidder=Subquery(top_bid.values('user')[:1]),
+        bid_count=Coalesce(Subquery(bid_count), 0),
+    )
+
+def parse_int(value):
+    """ Turn a numeric request parameter into an int, or None when it is missing or junk """
     try:
-        min_bid = Bid.objects.filter(listing__id=listing_id).order_by('-amount').first().amount
-    except AttributeError:
-        min_bid = current_listing.starting_bid
-    return min_bid
-    
\ No newline at end of file
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_cursor(value):
+    """ Turn a ?after= query parameter into a listing id, ignoring junk """
+    return parse_int(value)
+
+def keyset_page(queryset, after=None, size=None):
+    """ One page of listings with an id above `after`, plus the cursor for the next page
+
+    Only id, name and thumbnail key are selected, and paging is done with WHERE id > after instead of
+    OFFSET, so every page costs the same single index range read however deep it is.
+    """
+    size = size or PAGE_SIZE
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    rows = list(queryset.order_by('id').values('id', 'name', 'image_key')[:size + 1])
+    next_cursor = rows[size - 1]['id'] if len(rows) > size else None
+    return rows[:size], next_cursor
+
+def watched_listings(user):
+    """ The user's watchlist with price and bidding status, in a single query
+
+    `price` is the current high bid (or starting bid), `my_bid` the user's highest bid,
+    `my_maximum` their proxy maximum, if any, and `status` one of 'winning', 'outbid' or 'watching'.
+    """
+    my_bid = Bid.objects.filter(listing=OuterRef('pk'), user=user).order_by('-amount').values('amount')[:1]
+    my_maximum = ProxyBid.objects.filter(listing=OuterRef('pk'), user=user).values('maximum')[:1]
+    return (user.watchlist
+            .annotate(price=Coalesce('current_high_bid', 'starting_bid'), my_bid=Subquery(my_bid),
+                      my_maximum=Subquery(my_maximum))
+            .annotate(status=Case(
+                When(high_bidder=user, then=Value('winning')),
+                When(my_bid__isnull=False, then=Value('outbid')),
+                default=Value('watching'),
+                output_field=CharField()))
+            .order_by('-active', F('ends_at').asc(nulls_last=True), 'id'))
+
+def recent_notifications(user, since=None):
+    """ The user's latest outbid notifications, newest first, optionally only those after id `since` """
+    notifications = user.notifications.all()
+    if since is not None:
+        notifications = notifications.filter(id__gt=since)
+    return list(notifications.order_by('-id')
+                .values('id', 'listing_id', 'amount', 'timestamp', 'read', listing_name=F('listing__name'))[:NOTIFICATIONS_SHOWN])
+
+def set_watching(listing_id, user, watching=None):
+    """ Add the listing to the user's watchlist, take it off, or (watching=None) toggle it
+
+    Returns whether anything was written. Writes within WATCH_WINDOW of the pair's last
+    change are coalesced: a repeat of that change is answered from the cache without
+    touching the database, and so is a bare toggle, which counts as a repeat.
+    """
+    key = f'auctions:watching:{user.pk}:{listing_id}'
+    recent = cache.get(key)
+    if recent is not None and watching in (None, recent):
+        return False
+    through = Listing.watched_by.through.objects.filter(listing_id=listing_id, user_id=user.pk)
+    current = through.exists()
+    if watching is None:
+        watching = not current
+    if watching != current:
+        # Through the related manager, so m2m_changed logs the event
+        if watching:
+            user.watchlist.add(listing_id)
+        else:
+            user.watchlist.remove(listing_id)
+    cache.set(key, watching, WATCH_WINDOW)
+    return watching != current
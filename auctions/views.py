@@ -2,67 +2,92 @@
 
 from django.contrib.auth import authenticate, login, logout
 from django.db import IntegrityError
-from django.http import HttpResponseRedirect
-from django.shortcuts import render
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import (FileResponse, Http404, HttpResponse, HttpResponseRedirect, JsonResponse,
+                         StreamingHttpResponse)
+from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.timezone import now
 from django.contrib.auth.decorators import login_required
-from django.forms.models import model_to_dict
 
-from .models import (User, Bid, Listing, Comment)
-from .util import (get_min_bid)
+from .models import (User, Bid, Category, Listing, Comment)
+from .archive import (archived_page)
+from .caching import (cache_anonymous_page, listing_scope, LISTINGS_SCOPE)
+from .database import (read_only)
+from .expiry import (close_listings)
+from .bidding import (place_bid, set_proxy, BidRejected)
+from .ranking import (ending_soon, hot_listings)
+from .bulk import (export_rows, format_for, import_listings, read_rows, text_stream, BATCH_SIZE, EXPORTS, FORMATS)
+from .search import (search_listings)
+from .util import (keyset_page, parse_cursor, parse_int, recent_notifications, set_watching, watched_listings)
 from .forms import (ListingForm, BidForm, CommentForm)
+from .images import (media_type, SERVED_NAME)
+from .middleware import (registry, render)
 
+# Cache lifetime of content-addressed media: a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
 
+
+@cache_anonymous_page(lambda: LISTINGS_SCOPE)
+@read_only
 def index(request):
-    """ Homepage, displaying open and closed auctions """
-    listings_db = Listing.objects.all()
-    active_listings = []
-    closed_listings = []
-    for row in listings_db:
-        if row.active:
-            active_listings.append(model_to_dict(row))
-        else:
-            closed_listings.append(model_to_dict(row))
+    """ Homepage, displaying open and closed auctions one page at a time """
+    active_after = parse_cursor(request.GET.get('active_after'))
+    closed_after = parse_cursor(request.GET.get('closed_after'))
+    active_listings, active_next = keyset_page(Listing.objects.open(), active_after)
+    closed_listings, closed_next = keyset_page(Listing.objects.closed(), closed_after)
     return render(request, "auctions/index.html", {'active_listings': active_listings,
-                                                   'closed_listings': closed_listings
+                                                   'closed_listings': closed_listings,
+                                                   'active_after': active_after,
+                                                   'closed_after': closed_after,
+                                                   'active_next': active_next,
+                                                   'closed_next': closed_next
                                                    })
 
+@cache_anonymous_page(listing_scope)
+@read_only
 def listing(request, listing_id):
     """ Listing page, displaying description, bid and content """
 
     # Get all the page's variables
-    current_user = str(request.user)
-    current_listing = Listing.objects.get(pk=listing_id)
+    try:
+        current_listing = Listing.objects.select_related('user', 'high_bidder').get(pk=listing_id)
+    except Listing.DoesNotExist:
+        # Long-closed auctions have moved to the archive tables
+        return render(request, "auctions/archived_listing.html", archived_page(listing_id))
     active = current_listing.active
-    bids = Bid.objects.filter(listing__id=listing_id)
-    comments = Comment.objects.filter(listing__id=listing_id)
+    bids = Bid.objects.filter(listing__id=listing_id).order_by('timestamp')
+    comments = Comment.objects.filter(listing__id=listing_id).order_by('timestamp')
 
     # Set forms
     commentform = CommentForm()
-    bidform = BidForm(initial={"min_bid":get_min_bid(listing_id)})
+    bidform = BidForm()
 
     # Check if listing belongs to user
-    mylisting = (current_listing.user.username == current_user)
+    mylisting = (current_listing.user_id == request.user.pk)
 
     # Generate watch button
-    watchers = current_listing.watched_by.all()
-    if request.user in watchers:
+    watching = (request.user.is_authenticated and
+                current_listing.watched_by.filter(pk=request.user.pk).exists())
+    if watching:
         watchbutton = 'Remove from watchlist'
     else:
         watchbutton = 'Add to watchlist'
 
     # Decide the winner if inactive
-    try:
-        winner = Bid.objects.filter(listing__id=listing_id).order_by('-amount').first().user
-    except AttributeError:
-        winner = "no one"
+    winner = current_listing.high_bidder or "no one"
 
     if request.method == "POST":
         bidform = BidForm(request.POST)
         if bidform.is_valid():
             bid_amount = bidform.cleaned_data["bid_amount"]
-            newbid = Bid(user=request.user, amount=bid_amount, listing=current_listing)
-            newbid.save()
+            bid = set_proxy if bidform.cleaned_data["auto"] else place_bid
+            try:
+                bid(listing_id, request.user, bid_amount)
+            except BidRejected as rejection:
+                bidform.add_error(None, str(rejection))
 
     # Render the page
     return render(request, "auctions/listing.html", {'id': listing_id,
@@ -72,24 +97,68 @@ def listing(request, listing_id):
                                                      'comments': comments,
                                                      'commentform': commentform,
                                                      'watchbutton': watchbutton,
+                                                     'watching': watching,
                                                      'mylisting': mylisting,
                                                      'active': active,
                                                      'winner': winner
                                                     })
 
+@cache_anonymous_page(lambda: LISTINGS_SCOPE)
+@read_only
 def categories(request):
-    listings = Listing.objects.all()
-    category_set = {"No category": []}
-    for listing in listings:
-        if listing.category == "":
-            category_set["No category"].append(listing)
-        else: 
-            try:
-                category_set[listing.category].append(listing)
-            except KeyError:
-                category_set[listing.category] = [listing]
-    print(category_set)
-    return render(request, "auctions/categories.html", {'categories': category_set})
+    """ Overview of all categories with their listing counts, each linking to its own page """
+    return render(request, "auctions/categories.html", {
+        'categories': Category.objects.order_by('name'),
+        # Called by the template only when the cached fragment needs rebuilding
+        'uncategorized': Listing.objects.filter(category__isnull=True).exists
+    })
+
+@cache_anonymous_page(lambda category_id=None: LISTINGS_SCOPE)
+@read_only
+def category(request, category_id=None):
+    """ Open and closed auctions in one category, or without one, one page at a time """
+    if category_id is None:
+        name = None
+        in_category = Listing.objects.filter(category__isnull=True)
+    else:
+        name = get_object_or_404(Category, pk=category_id).name
+        in_category = Listing.objects.filter(category_id=category_id)
+    active_after = parse_cursor(request.GET.get('active_after'))
+    closed_after = parse_cursor(request.GET.get('closed_after'))
+    active_listings, active_next = keyset_page(in_category.open(), active_after)
+    closed_listings, closed_next = keyset_page(in_category.closed(), closed_after)
+    return render(request, "auctions/category.html", {'name': name,
+                                                      'active_listings': active_listings,
+                                                      'closed_listings': closed_listings,
+                                                      'active_after': active_after,
+                                                      'closed_after': closed_after,
+                                                      'active_next': active_next,
+                                                      'closed_next': closed_next
+                                                      })
+
+# The feeds aren't page-cached: every bid reorders them, and each is a single top-K index read
+
+@read_only
+def hot(request):
+    """ Open auctions ranked by their recent bids and watchers """
+    return render(request, "auctions/feed.html", {'title': "Hot Listings", 'listings': hot_listings()})
+
+@read_only
+def ending(request):
+    """ Open auctions that end soonest, soonest first """
+    return render(request, "auctions/feed.html", {'title': "Ending Soon", 'listings': ending_soon()})
+
+@cache_anonymous_page(lambda: LISTINGS_SCOPE)
+def search(request):
+    """ Full-text search over listing names, descriptions and categories """
+    query = request.GET.get('q', '')
+    page = max(parse_int(request.GET.get('page')) or 1, 1)
+    results, more = search_listings(query, page)
+    return render(request, "auctions/search.html", {'query': query,
+                                                    'results': results,
+                                                    'page': page,
+                                                    'next_page': page + 1 if more else None
+                                                    })
 
 @login_required
 def add_comment(request, listing_id):
@@ -106,51 +175,107 @@ def add_comment(request, listing_id):
 
 @login_required
 def watchlist(request):
-    user = User.objects.get(username=request.user)
-    current_watchlist = user.watchlist.all()
-    return render(request, "auctions/watchlist.html", {'watchlist': current_watchlist})
+    """ Watched listings with price, bidding status and time left, plus the outbid notifications """
+    notifications = recent_notifications(request.user)
+    if any(not notification['read'] for notification in notifications):
+        request.user.notifications.filter(read=False).update(read=True)
+    return render(request, "auctions/watchlist.html", {'watchlist': watched_listings(request.user),
+                                                       'notifications': notifications})
+
+@login_required
+def watchlist_api(request):
+    """ The watchlist page as JSON; ?since=<id> returns only newer notifications, none are marked read """
+    current_time = now()
+    listings = [{
+        'id': listing.id,
+        'name': listing.name,
+        'active': listing.active,
+        'price': listing.price,
+        'my_bid': listing.my_bid,
+        'my_maximum': listing.my_maximum,
+        'status': listing.status,
+        'ends_at': listing.ends_at,
+        'seconds_left': (max(int((listing.ends_at - current_time).total_seconds()), 0)
+                         if listing.ends_at and listing.active else None),
+    } for listing in watched_listings(request.user)]
+    notifications = recent_notifications(request.user, parse_cursor(request.GET.get('since')))
+    return JsonResponse({'listings': listings, 'notifications': notifications})
 
 @login_required
 def close_listing(request, listing_id):
-    current_user = str(request.user)
-    current_listing = Listing.objects.get(pk=listing_id)
     if request.method == "POST":
-        if current_listing.user.username == current_user:
-            current_listing.active = False
-            current_listing.save()
+        # Only the seller may close it
+        if Listing.objects.filter(pk=listing_id, user_id=request.user.pk).exists():
+            close_listings([listing_id])
     return HttpResponseRedirect(reverse("listing", args=[listing_id]))
 
 @login_required
 def add_bid(request, listing_id):
-    current_listing = Listing.objects.get(pk=listing_id)
     if request.method == "POST":
         bidform = BidForm(request.POST)
         if bidform.is_valid():
             bid_amount = bidform.cleaned_data["bid_amount"]
-            newbid = Bid(user=request.user, amount=bid_amount, listing=current_listing)
-            newbid.save()
+            bid = set_proxy if bidform.cleaned_data["auto"] else place_bid
+            try:
+                bid(listing_id, request.user, bid_amount)
+            except BidRejected:
+                pass
     return HttpResponseRedirect(reverse("listing", args=[listing_id]))
 
 @login_required
 def add_watchlist(request, listing_id):
-    current_listing = Listing.objects.get(pk=listing_id)
-    watchers = current_listing.watched_by.all()
     if request.method == "POST":
-        if request.user in watchers:
-            current_listing.watched_by.remove(request.user)
-        else:
-            current_listing.watched_by.add(request.user)
-        print(watchers)
+        # The button says what it does; a bare POST (from older pages) toggles
+        watch = request.POST.get("watch")
+        set_watching(listing_id, request.user, {"add": True, "remove": False}.get(watch))
     return HttpResponseRedirect(reverse("listing", args=[listing_id]))
 
 @login_required
 def add_listing(request):
     form = ListingForm(initial={"user":request.user})
     if request.method == "POST":
-        newlisting = ListingForm(request.POST)
-        newlisting.save()
+        newlisting = ListingForm(request.POST, request.FILES)
+        if newlisting.is_valid():
+            newlisting.save()
     return render(request, "auctions/newlisting.html", {'form': form})
 
+@login_required
+def import_listings_view(request):
+    """ Upload a CSV or JSONL file of listings, owned by the uploader """
+    result = None
+    if request.method == "POST" and 'file' in request.FILES:
+        upload = request.FILES['file']
+        rows = read_rows(text_stream(upload.file), format_for(upload.name))
+        # At most BATCH_SIZE rows are held at once, however large the upload
+        batch_size = min(max(parse_int(request.POST.get('batch_size')) or BATCH_SIZE, 1), BATCH_SIZE)
+        result = import_listings(rows, request.user, batch_size=batch_size)
+    return render(request, "auctions/import.html", {'result': result})
+
+@login_required
+def export_view(request, kind, format):
+    """ Stream every listing, bid or comment as CSV or JSONL """
+    if kind not in EXPORTS or format not in FORMATS:
+        raise Http404("No such export")
+    content_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export_rows(kind, format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{format}"'
+    return response
+
+def media(request, name):
+    """ Serve an uploaded image or thumbnail; names are content hashes, so they can be cached for good """
+    if not SERVED_NAME.fullmatch(name) or not default_storage.exists(name):
+        raise Http404("No such image")
+    response = FileResponse(default_storage.open(name), content_type=media_type(name))
+    response['X-Content-Type-Options'] = 'nosniff'
+    patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
+
+def metrics(request):
+    """ Per-view request figures in Prometheus text format, for local scrapers only """
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise Http404()
+    return HttpResponse(registry.prometheus(), content_type='text/plain; version=0.0.4')
+
 def login_view(request):
     if request.method == "POST":
 
@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from auctions.live import with_listing_events
+
+# Live listing event streams are served here, everything else goes to Django
+application = with_listing_events(django_application)
+
@@ -42,47 +42,185 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'auctions.middleware.PerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'auctions.ratelimit.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'commerce.urls'
 
+# AUCTIONS_TEMPLATES=production parses each template once per process (the cached loader)
+# and skips collecting template debug information; development re-reads templates from disk,
+# so edits show up without a restart. Defaults to production when DEBUG is off.
+
+AUCTIONS_TEMPLATES = os.environ.get('AUCTIONS_TEMPLATES', 'development' if DEBUG else 'production')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
+                'django.template.context_processors.media',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'debug': AUCTIONS_TEMPLATES != 'production',
+            'loaders': [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ],
         },
     },
 ]
 
+if AUCTIONS_TEMPLATES == 'production':
+    TEMPLATES[0]['OPTIONS']['loaders'] = [('django.template.loaders.cached.Loader',
+                                           TEMPLATES[0]['OPTIONS']['loaders'])]
+
 WSGI_APPLICATION = 'commerce.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# Connections are kept open for AUCTIONS_CONN_MAX_AGE seconds (0 closes them after
+# every request) and tuned with SQLITE_PRAGMAS by auctions.database.configure_sqlite.
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('AUCTIONS_CONN_MAX_AGE', '600')),
     }
 }
 
+# Per-connection settings only. The database itself is switched to WAL, where readers no
+# longer block the writer or the writer the readers, once by migration 0025.
+SQLITE_PRAGMAS = {
+    # Safe with WAL: a power cut can lose the last commits, never corrupt the file
+    'synchronous': 'normal',
+    # Wait up to 20s for a lock instead of failing with "database is locked"
+    'busy_timeout': 20000,
+    # 64 MB page cache (negative values are KiB) and 256 MB memory-mapped I/O
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+
+# AUCTIONS_READ_REPLICA=<path> sends the reads of read-only views to a separate,
+# read-only connection on that file: the primary itself, or a copy of it
+# (e.g. kept in step by Litestream).
+
+DATABASE_ROUTERS = []
+
+if os.environ.get('AUCTIONS_READ_REPLICA'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': f"file:{os.environ['AUCTIONS_READ_REPLICA']}?mode=ro",
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS.append('auctions.database.ReadReplicaRouter')
+
+# Closed listings are moved to the archive tables this many days after closing (see
+# auctions/archive.py). AUCTIONS_ARCHIVE_DB=<path> keeps those tables in a separate
+# SQLite file; create them there with `manage.py migrate --database archive`.
+
+AUCTIONS_ARCHIVE_AFTER_DAYS = int(os.environ.get('AUCTIONS_ARCHIVE_AFTER_DAYS', '90'))
+
+if os.environ.get('AUCTIONS_ARCHIVE_DB'):
+    DATABASES['archive'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['AUCTIONS_ARCHIVE_DB'],
+    }
+    # First, so archive reads aren't sent to the replica
+    DATABASE_ROUTERS.insert(0, 'auctions.database.ArchiveRouter')
+
 AUTH_USER_MODEL = 'auctions.User'
 
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Local memory by default. Set AUCTIONS_CACHE=file or AUCTIONS_CACHE=redis to share
+# the cache between worker processes (redis needs the django-redis package).
+
+AUCTIONS_CACHE = os.environ.get('AUCTIONS_CACHE', 'locmem')
+
+if AUCTIONS_CACHE == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('AUCTIONS_CACHE_LOCATION', os.path.join(BASE_DIR, '.cache')),
+        }
+    }
+elif AUCTIONS_CACHE == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ.get('AUCTIONS_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Sessions and the signed-in user
+# AUCTIONS_SESSIONS picks the session store: cached_db (the default; reads come from the
+# cache, writes go through to the database), signed_cookies (nothing stored server-side),
+# cache (only with a shared cache such as redis) or db (Django's default). The auth backend
+# caches the user row as well (auctions/auth.py).
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get('AUCTIONS_SESSIONS', 'cached_db')
+
+AUTHENTICATION_BACKENDS = ['auctions.auth.CachedModelBackend']
+
+# Rate limiting (auctions/ratelimit.py)
+# Token buckets for POSTs per view: (tokens per minute, burst), per signed-in user and, four
+# times as big, per client address. Buckets are kept in each process's memory, or in a
+# SQLite file shared by all workers when AUCTIONS_RATE_LIMIT_DB names one. Bids posted to the
+# listing page count against add_bid.
+
+AUCTIONS_RATE_LIMITS = {
+    'add_bid': (30, 10),
+    'add_comment': (10, 5),
+    'add_watchlist': (20, 10),
+}
+
+AUCTIONS_RATE_LIMIT_DB = os.environ.get('AUCTIONS_RATE_LIMIT_DB')
+
+# Performance instrumentation (auctions/middleware.py)
+# Share of requests measured, 0.0 - 1.0; the metrics endpoint only answers INTERNAL_IPS.
+# Per-request log lines go to the auctions.performance logger at INFO, N+1 warnings at WARNING.
+
+AUCTIONS_METRICS_SAMPLE_RATE = float(os.environ.get('AUCTIONS_METRICS_SAMPLE_RATE', '1.0'))
+
+INTERNAL_IPS = ['127.0.0.1', '::1']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'auctions.performance': {
+            'handlers': ['console'],
+            'level': os.environ.get('AUCTIONS_PERFORMANCE_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -120,3 +258,11 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Uploaded listing images and their thumbnails (see auctions/images.py)
+
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.environ.get('AUCTIONS_MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
+# Callable taking an image URL and returning its bytes; tests swap in a stub
+AUCTIONS_IMAGE_FETCHER = 'auctions.images.fetch'
@@ -13,10 +13,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
+from auctions.views import media
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path(settings.MEDIA_URL.lstrip("/") + "<path:name>", media, name="media"),
     path("", include("auctions.urls"))
 ]
\ No newline at end of file